@@ -1,11 +1,13 @@
 import os
 import sys
+import queue
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import subprocess
 import pyperclip
-from typing import Optional
+from typing import Optional, IO
+from collections import deque
 from dataclasses import dataclass
 from tkinter.font import Font
 import time
@@ -82,6 +84,11 @@ class ModernButton(tk.Canvas):
             if self.command:
                 self.command()
 
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            self.itemconfig(self.text_id, text=text)
+
 
 class ModernEntry(tk.Frame):
     """自定义现代输入框"""
@@ -127,13 +134,24 @@ class LivestreamConsole:
     """现代化直播控制台"""
 
     DEFAULT_URL = "http://127.0.0.1:5000"
+    LOG_MAX_LINES = 1000  # 日志框最多保留的行数
+    LOG_POLL_MS = 100  # 主线程取日志的间隔（毫秒）
+    STATUS_POLL_MS = 1000  # 刷新运行计数的间隔（毫秒）
+    IN_PROCESS = os.environ.get('CONSOLE_SUBPROCESS') != '1'  # 默认在本进程内运行服务，设为 1 时启动 web.py 子进程
 
     def __init__(self):
         self.process: Optional[subprocess.Popen] = None
+        self.server = None  # 本进程内运行时的 web.BackgroundServer
+        self.busy = False  # 正在启动或停止
         self.theme = Theme()
+        # 子进程输出和其它线程的日志都先放进队列，由 Tk 主线程定时批量写入日志框
+        self.log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.log_lines = 0
         self.setup_root()
         self.create_widgets()
         self.setup_layout()
+        self.log_job = self.root.after(self.LOG_POLL_MS, self.drain_log)
+        self.status_job = self.root.after(self.STATUS_POLL_MS, self.refresh_status)
 
     def setup_root(self):
         """初始化主窗口"""
@@ -184,7 +202,15 @@ class LivestreamConsole:
             self.button_frame,
             text="启动服务",
             command=self.run_web,
-            width=150,
+            width=100,
+            height=40,
+            color=self.theme.primary
+        )
+        self.restart_button = ModernButton(
+            self.button_frame,
+            text="重启服务",
+            command=self.restart_web,
+            width=100,
             height=40,
             color=self.theme.primary
         )
@@ -192,7 +218,7 @@ class LivestreamConsole:
             self.button_frame,
             text="复制链接",
             command=self.copy_to_clipboard,
-            width=150,
+            width=100,
             height=40,
             color=self.theme.secondary
         )
@@ -233,6 +259,14 @@ class LivestreamConsole:
             bg=self.theme.bg,
             fg=self.theme.text_secondary
         )
+        self.counter_label = tk.Label(
+            self.status_frame,
+            text="",
+            font=self.text_font,
+            bg=self.theme.bg,
+            fg=self.theme.text_secondary,
+            justify=tk.LEFT
+        )
 
     def setup_layout(self):
         """设置控件布局"""
@@ -246,8 +280,9 @@ class LivestreamConsole:
 
         # 按钮区域
         self.button_frame.pack(fill=tk.X, pady=(0, 20))
-        self.run_button.pack(side=tk.LEFT, padx=10)
-        self.copy_button.pack(side=tk.RIGHT, padx=10)
+        self.run_button.pack(side=tk.LEFT, padx=5)
+        self.restart_button.pack(side=tk.LEFT, padx=5)
+        self.copy_button.pack(side=tk.RIGHT, padx=5)
 
         # 日志区域
         self.log_frame.pack(fill=tk.BOTH, expand=True)
@@ -256,49 +291,154 @@ class LivestreamConsole:
 
         # 状态栏
         self.status_frame.pack(fill=tk.X, pady=(20, 0))
-        self.status_label.pack(side=tk.LEFT)
+        self.status_label.pack(anchor=tk.W)
+        self.counter_label.pack(anchor=tk.W)
 
     def update_log(self, message: str) -> None:
-        """更新日志文本框"""
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, f"{message}\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state=tk.DISABLED)
+        """追加一行日志，任意线程都可以调用"""
+        self.log_queue.put(message)
 
-    def run_web(self) -> None:
-        """启动 web.py 服务"""
+    def drain_log(self) -> None:
+        """在主线程里把队列中的日志一次写入，只保留最后 LOG_MAX_LINES 行"""
+        batch = deque(maxlen=self.LOG_MAX_LINES)
+        try:
+            while True:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if batch:
+            self.log_text.config(state=tk.NORMAL)
+            self.log_text.insert(tk.END, "\n".join(batch) + "\n")
+            self.log_lines += len(batch)
+            excess = self.log_lines - self.LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+                self.log_lines = self.LOG_MAX_LINES
+            self.log_text.see(tk.END)
+            self.log_text.config(state=tk.DISABLED)
+
+        self.log_job = self.root.after(self.LOG_POLL_MS, self.drain_log)
+
+    def refresh_status(self) -> None:
+        """刷新按钮状态和各房间的运行计数，计数直接读采集线程的内存"""
+        running = self.is_running()
+        self.run_button.set_text("停止服务" if running else "启动服务")
+        lines = []
+        if running and self.server is not None:
+            for status in self.server.status():
+                lines.append(
+                    f"房间 {status['room']}：已保存 {status['saved']} 条，"
+                    f"轮询 {status['poll_latency'] * 1000:.0f} ms\n"
+                    f"  文件 {status['file'] or '-'}"
+                )
+        self.counter_label.config(text="\n".join(lines))
+        self.status_job = self.root.after(self.STATUS_POLL_MS, self.refresh_status)
+
+    def is_running(self) -> bool:
+        """服务是否在运行"""
+        if self.IN_PROCESS:
+            return self.server is not None and self.server.running
+        return self.process is not None and self.process.poll() is None
+
+    def read_room_id(self) -> Optional[str]:
+        """读取并校验房间ID，写入环境变量供 web.Config 使用"""
         room_id = self.room_id_entry.get()
         if not room_id.isdigit():
             messagebox.showerror("错误", "请输入有效的房间ID（数字）")
+            return None
+        os.environ['ROOM_ID'] = room_id
+        return room_id
+
+    def run_web(self) -> None:
+        """启动服务，已在运行时停止"""
+        if self.busy:
             return
+        if self.is_running():
+            self.run_in_background(self.stop_web, "正在停止服务...")
+            return
+        room_id = self.read_room_id()
+        if room_id:
+            self.run_in_background(self.start_web, f"正在启动服务，房间ID: {room_id}")
 
-        os.environ['ROOM_ID'] = room_id
-        try:
-            web_thread = threading.Thread(target=self.start_web, daemon=True)
-            web_thread.start()
-            self.update_log(f"正在启动服务，房间ID: {room_id}")
-        except Exception as e:
-            messagebox.showerror("错误", f"运行服务时发生错误: {e}")
+    def restart_web(self) -> None:
+        """停止后按当前输入的房间ID重新启动"""
+        if self.busy:
+            return
+        room_id = self.read_room_id()
+        if room_id:
+            self.run_in_background(self.restart_server, f"正在重启服务，房间ID: {room_id}")
+
+    def run_in_background(self, action, message: str) -> None:
+        """在后台线程里启停服务，创建应用和刷盘都不会卡住界面"""
+        self.busy = True
+        self.update_log(message)
+
+        def task():
+            try:
+                action()
+            except Exception as e:
+                self.update_log(f"服务运行错误: {e}")
+            finally:
+                self.busy = False
+
+        threading.Thread(target=task, daemon=True).start()
 
     def start_web(self) -> None:
-        """启动 web.py 子进程并捕获输出"""
-        try:
-            self.process = subprocess.Popen(
-                ['python', 'web.py'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8'
-            )
+        """启动服务：默认在本进程内运行，日志直接经 log_callback 送进日志队列"""
+        if not self.IN_PROCESS:
+            self.start_subprocess()
+            return
+        if self.server is None:
+            from web import BackgroundServer  # 用到时才导入 Flask 等依赖，界面启动更快
+            self.server = BackgroundServer(log_callback=self.update_log)
+        self.server.start()
+        self.update_log(f"服务已启动: {self.DEFAULT_URL}")
+
+    def stop_web(self) -> None:
+        """停止服务，本进程内运行时会刷完写入队列"""
+        if self.IN_PROCESS:
+            if self.server is not None:
+                self.server.stop()
+        elif self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+        self.update_log("服务已停止")
 
-            while True:
-                output = self.process.stdout.readline()
-                if not output:
-                    break
-                self.update_log(output.strip())
+    def restart_server(self) -> None:
+        self.stop_web()
+        self.start_web()
+
+    def start_subprocess(self) -> None:
+        """启动 web.py 子进程并捕获输出"""
+        self.process = subprocess.Popen(
+            ['python', 'web.py'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace'
+        )
 
-        except Exception as e:
-            self.update_log(f"服务运行错误: {e}")
+        # stderr 必须同时读走，否则管道写满后子进程会卡住
+        pumps = [threading.Thread(target=self.pump_output, args=(stream,), daemon=True)
+                 for stream in (self.process.stdout, self.process.stderr)]
+        for pump in pumps:
+            pump.start()
+        threading.Thread(target=self.wait_subprocess, args=(self.process, pumps), daemon=True).start()
+
+    def wait_subprocess(self, process: subprocess.Popen, pumps) -> None:
+        """输出读完后记录子进程退出"""
+        for pump in pumps:
+            pump.join()
+        self.update_log(f"服务已退出，返回码: {process.wait()}")
+
+    def pump_output(self, stream: IO[str]) -> None:
+        """逐行读取子进程输出放入日志队列"""
+        for line in stream:
+            line = line.rstrip()
+            if line:
+                self.update_log(line)
 
     def copy_to_clipboard(self) -> None:
         """复制URL到剪贴板"""
@@ -309,6 +449,10 @@ class LivestreamConsole:
         """关闭窗口"""
         if self.process:
             self.process.terminate()
+        if self.server is not None:
+            self.server.stop()  # 刷完写入队列再退出
+        self.root.after_cancel(self.log_job)
+        self.root.after_cancel(self.status_job)
         self.root.destroy()
 
     def run(self) -> None:
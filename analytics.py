@@ -0,0 +1,170 @@
+"""直播间实时统计
+
+所有结构都是定长内存：按分钟滚动的计数桶、HyperLogLog 估算独立发言人数、
+Space-Saving 估算热词和话痨榜，长时间直播、大房间也不会越用越多。
+弹幕经过去重后由采集线程（轮询调度或 WebSocket 接收线程）调用 add，不经过写入线程；
+/stats 等接口线程调用 snapshot，二者用锁隔开。
+"""
+import hashlib
+import heapq
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+TOKEN = re.compile(r'[A-Za-z0-9]+|[一-鿿]+')
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """基数估算，2^p 个寄存器，标准误差约 1.04/sqrt(2^p)"""
+
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value: str):
+        x = _hash64(value)
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """并入另一个相同 p 的估算器"""
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)  # 小基数时用线性计数
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Space-Saving 近似 top-k，最多跟踪 capacity 个键
+
+    用最小堆找计数最小的键，每次顶替 O(log capacity)。计数只增不减，命中已有键时不动堆，
+    堆里的计数可能过时，顶替时弹出的堆顶如果过时就按当前计数放回再看下一个。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.labels: Dict[str, str] = {}
+        self._heap: List[Tuple[int, str]] = []  # （入堆时的计数, 键），每个跟踪的键恰好一项
+
+    def add(self, key: str, label: Optional[str] = None):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+            self.errors[key] = 0
+            heapq.heappush(self._heap, (1, key))
+        else:
+            # 顶替计数最小的键，继承它的计数作为误差上界
+            floor, victim = self._heap[0]
+            while self.counts[victim] != floor:
+                heapq.heapreplace(self._heap, (self.counts[victim], victim))
+                floor, victim = self._heap[0]
+            heapq.heapreplace(self._heap, (floor + 1, key))
+            del self.counts[victim]
+            self.errors.pop(victim)
+            self.labels.pop(victim, None)
+            self.counts[key] = floor + 1
+            self.errors[key] = floor
+        if label is not None:
+            self.labels[key] = label
+
+    def top(self, n: int) -> List[dict]:
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [{'key': key, 'label': self.labels.get(key, key), 'count': count, 'error': self.errors[key]}
+                for key, count in ranked]
+
+
+def tokenize(text: str) -> List[str]:
+    """切出弹幕里的词：英文数字整段；四字以内的中文整段，更长的按二字切"""
+    tokens = set()
+    for token in TOKEN.findall(text.casefold()):
+        if token.isascii() or len(token) <= 4:
+            if len(token) >= 2 or not token.isascii():
+                tokens.add(token)
+        else:
+            tokens.update(token[i:i + 2] for i in range(len(token) - 1))
+    return list(tokens)
+
+
+class RoomAnalytics:
+    """单个房间的统计，采集线程调用 add，接口线程调用 snapshot"""
+
+    def __init__(self, window_minutes: int = 60, top_k: int = 20):
+        self.window_minutes = window_minutes
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._buckets: deque = deque(maxlen=window_minutes)  # [分钟, 条数, HyperLogLog]
+        self._total = 0
+        self._users = HyperLogLog(14)
+        self._words = SpaceSaving(top_k * 10)
+        self._chatters = SpaceSaving(top_k * 10)
+
+    def _bucket(self, minute: int) -> Optional[list]:
+        if self._buckets and self._buckets[-1][0] == minute:
+            return self._buckets[-1]
+        if self._buckets and minute < self._buckets[-1][0]:
+            # 稍晚到达的旧弹幕记进对应的桶，太旧的丢弃
+            for bucket in self._buckets:
+                if bucket[0] == minute:
+                    return bucket
+            return None
+        bucket = [minute, 0, HyperLogLog(10)]
+        self._buckets.append(bucket)
+        return bucket
+
+    def add(self, record):
+        """记录一条弹幕，record 需有 timeline、uid、nickname、text 属性（web.DanmakuRecord）"""
+        user = str(record.uid or record.nickname)
+        tokens = tokenize(record.text)
+        with self._lock:
+            self._total += 1
+            self._users.add(user)
+            self._chatters.add(user, record.nickname)
+            for token in tokens:
+                self._words.add(token)
+            bucket = self._bucket(record.timeline // 60)
+            if bucket is not None:
+                bucket[1] += 1
+                bucket[2].add(user)
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        now_minute = int(now if now is not None else time.time()) // 60
+        with self._lock:
+            counts: Dict[int, int] = {}
+            recent = HyperLogLog(10)
+            for minute, count, users in self._buckets:
+                if minute > now_minute - self.window_minutes:
+                    counts[minute] = count
+                    recent.merge(users)
+            per_minute: List[Tuple[int, int]] = [
+                (minute * 60, counts.get(minute, 0))
+                for minute in range(now_minute - self.window_minutes + 1, now_minute + 1)
+            ]
+            return {
+                'total': self._total,
+                'unique_users': self._users.count(),
+                'window_minutes': self.window_minutes,
+                'window_total': sum(counts.values()),
+                'window_unique_users': recent.count(),
+                'messages_per_minute': per_minute,
+                'top_words': self._words.top(self.top_k),
+                'top_chatters': self._chatters.top(self.top_k),
+            }
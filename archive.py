@@ -0,0 +1,335 @@
+"""弹幕归档分段格式
+
+text   danmaku_<日期>_<n>.txt，每行 [YYYY-MM-DD HH:MM:SS] 昵称: 内容，兼容旧版
+binary danmaku_<日期>_<n>.dmk，紧凑二进制记录，当天所有分段共用 danmaku_<日期>.dmkd 字符串字典
+
+二进制记录依次为 varint 编码的：时间线差值（zigzag）、用户 ID、昵称字典号、
+头像字典号、内容字节数，后跟 UTF-8 内容。昵称和头像 URL 在 .dmkd 里按首次出现
+的顺序编号，当天只存一次。头像 URL 每个四五十字节，字典如果按分段各存一份，
+观众多的直播间里几乎每条弹幕都要带一份新字符串，反而比文本格式还大。
+字典只追加，读取时按文件增长的部分增量加载并缓存；分段用 mmap 按需解析，
+不会把整个分段读进内存。
+"""
+import mmap
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+MAGIC = b'DMK1'
+TEXT_SUFFIX = '.txt'
+BINARY_SUFFIX = '.dmk'
+DICT_SUFFIX = '.dmkd'
+
+TEXT_LINE = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] (.*?): (.*)$')
+SEGMENT_NAME = re.compile(r'^danmaku_(\d{4}-\d{2}-\d{2})_(\d+)\.(txt|dmk)$')
+DICTIONARY_CACHE_SIZE = 8  # 读取时最多缓存几天的字典
+
+
+class ArchiveRecord(NamedTuple):
+    """从归档读出的一条弹幕，offset 为记录在分段文件中的字节偏移"""
+    timeline: int
+    uid: int
+    nickname: str
+    text: str
+    face: str
+    offset: int
+
+
+def encode_varint(value: int) -> bytes:
+    """无符号 varint 编码"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def decode_varint(buf, pos: int) -> Tuple[int, int]:
+    """从 pos 处解码一个 varint，返回（值, 新位置）"""
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+@lru_cache(maxsize=4096)
+def format_timeline(timeline: int) -> str:
+    """时间线格式化为 YYYY-MM-DD HH:MM:SS，同一秒只格式化一次"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeline))
+
+
+def parse_text_line(line: str) -> Optional[Tuple[int, str, str]]:
+    """解析一行文本归档，返回（时间线, 昵称, 内容），格式不对或日期不合法时返回 None"""
+    match = TEXT_LINE.match(line.rstrip('\r\n'))
+    if not match:
+        return None
+    try:
+        timeline = int(time.mktime(time.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')))
+    except ValueError:
+        return None
+    return timeline, match.group(2), match.group(3)
+
+
+class TextSegmentWriter:
+    """文本分段写入类"""
+
+    suffix = TEXT_SUFFIX
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def write(self, timeline: int, uid: int, nickname: str, text: str, face: str) -> int:
+        """追加一条弹幕，返回其字节偏移"""
+        offset = self._file.tell()
+        self._file.write(f"[{format_timeline(timeline)}] {nickname}: {text}\n".encode('utf-8'))
+        return offset
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class BinarySegmentWriter:
+    """二进制分段写入类，重新打开已有分段时会恢复字典和最后的时间线
+
+    同一天的分段共用一个字典，同一时间只能有一个写入者，轮换分段时先关闭上一个。
+    """
+
+    suffix = BINARY_SUFFIX
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.dict_path = dictionary_path(path)
+        strings, dict_end = DICTIONARIES.load(self.dict_path)
+        self._strings: Dict[str, int] = {value: index for index, value in enumerate(strings)}
+        self._last_timeline = 0
+        data_end = self._recover(len(strings))
+
+        # 截掉上次异常退出时写了一半的尾巴，再继续追加
+        self._dict_file = open(self.dict_path, 'ab')
+        self._dict_file.truncate(dict_end)
+        self._dict_file.seek(0, 2)
+        self._file = open(path, 'ab')
+        self._file.truncate(data_end)
+        self._file.seek(0, 2)
+        if data_end == 0:
+            self._file.write(MAGIC)
+
+    def _recover(self, dict_size: int) -> int:
+        """扫描已有分段，恢复最后的时间线，返回有效数据的结束位置"""
+        if not self.path.exists() or self.path.stat().st_size <= len(MAGIC):
+            return 0
+        end = len(MAGIC)
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for _, end, delta, *_ in _decode_records(buf, len(MAGIC), len(buf), dict_size):
+                self._last_timeline += delta
+        return end
+
+    def _string_id(self, value: str) -> int:
+        """查字典，新字符串追加到 .dmkd"""
+        index = self._strings.get(value)
+        if index is None:
+            index = len(self._strings)
+            self._strings[value] = index
+            data = value.encode('utf-8')
+            self._dict_file.write(encode_varint(len(data)) + data)
+        return index
+
+    def write(self, timeline: int, uid: int, nickname: str, text: str, face: str) -> int:
+        """追加一条弹幕，返回其字节偏移"""
+        offset = self._file.tell()
+        data = text.encode('utf-8')
+        self._file.write(b''.join((
+            encode_varint(zigzag(timeline - self._last_timeline)),
+            encode_varint(uid),
+            encode_varint(self._string_id(nickname)),
+            encode_varint(self._string_id(face)),
+            encode_varint(len(data)),
+            data,
+        )))
+        self._last_timeline = timeline
+        return offset
+
+    def flush(self):
+        # 先刷字典，保证记录引用的字符串一定已经落盘
+        self._dict_file.flush()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._dict_file.close()
+        self._file.close()
+
+
+SEGMENT_WRITERS = {
+    'text': TextSegmentWriter,
+    'binary': BinarySegmentWriter,
+}
+
+
+def dictionary_path(path: Path) -> Path:
+    """分段对应的字典文件，同一天的分段共用一个"""
+    match = SEGMENT_NAME.match(path.name)
+    if not match:
+        return path.with_suffix(DICT_SUFFIX)
+    return path.with_name(f"danmaku_{match.group(1)}{DICT_SUFFIX}")
+
+
+def _parse_dictionary(data: bytes, strings: List[str]) -> int:
+    """解析字典条目追加到 strings，返回有效字节数，末尾写了一半的条目不算"""
+    pos = 0
+    while pos < len(data):
+        try:
+            length, end = decode_varint(data, pos)
+        except IndexError:
+            break
+        if end + length > len(data):
+            break
+        strings.append(data[end:end + length].decode('utf-8'))
+        pos = end + length
+    return pos
+
+
+class DictionaryCache:
+    """字符串字典缓存
+
+    字典只会在末尾追加，文件变大时只读新增的部分；文件变小或被替换（异常退出后截断、
+    转换时重新生成）就整个重读。按最近使用保留 DICTIONARY_CACHE_SIZE 个。
+    """
+
+    def __init__(self, capacity: int = DICTIONARY_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries: 'OrderedDict[Path, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path: Path) -> Tuple[List[str], int]:
+        """返回（字符串列表, 有效字节数），列表只会被追加，调用方不要修改"""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return [], 0
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is None or entry[0] != stat.st_ino or entry[2] > stat.st_size:
+                entry = (stat.st_ino, [], 0)
+            inode, strings, end = entry
+            if stat.st_size > end:
+                with open(path, 'rb') as f:
+                    f.seek(end)
+                    end += _parse_dictionary(f.read(), strings)
+            self._entries[path] = (inode, strings, end)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+            return strings, end
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+DICTIONARIES = DictionaryCache()
+
+
+def load_dictionary(path: Path) -> List[str]:
+    """读取字符串字典"""
+    return DICTIONARIES.load(path)[0]
+
+
+def _decode_records(buf, pos: int, size: int, dict_size: int) -> Iterator[tuple]:
+    """解码二进制记录，产出（偏移, 结束位置, 时间差, 用户ID, 昵称号, 头像号, 内容），遇到残缺记录即停止"""
+    while pos < size:
+        offset = pos
+        try:
+            delta, pos = decode_varint(buf, pos)
+            uid, pos = decode_varint(buf, pos)
+            nick_id, pos = decode_varint(buf, pos)
+            face_id, pos = decode_varint(buf, pos)
+            length, pos = decode_varint(buf, pos)
+        except IndexError:
+            return
+        if pos + length > size or nick_id >= dict_size or face_id >= dict_size:
+            return
+        text = buf[pos:pos + length].decode('utf-8')
+        pos += length
+        yield offset, pos, unzigzag(delta), uid, nick_id, face_id, text
+
+
+def iter_binary_segment(path: Path, start_offset: int = 0,
+                        start_timeline: Optional[int] = None) -> Iterator[ArchiveRecord]:
+    """逐条读取二进制分段
+
+    从中间偏移开始读时需要同时给出该记录的时间线（稀疏索引里有），
+    因为时间线是相对上一条记录的差值。
+    """
+    strings = load_dictionary(dictionary_path(path))
+    with open(path, 'rb') as f:
+        size = f.seek(0, 2)
+        if size <= len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} 不是弹幕二进制分段")
+            timeline = 0
+            first = True
+            for offset, _, delta, uid, nick_id, face_id, text in _decode_records(
+                    buf, max(start_offset, len(MAGIC)), size, len(strings)):
+                if first and start_timeline is not None:
+                    timeline = start_timeline
+                else:
+                    timeline += delta
+                first = False
+                yield ArchiveRecord(timeline, uid, strings[nick_id], text, strings[face_id], offset)
+
+
+def iter_text_segment(path: Path, start_offset: int = 0) -> Iterator[ArchiveRecord]:
+    """逐行读取文本分段，格式不对的行跳过"""
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for raw in f:
+            parsed = parse_text_line(raw.decode('utf-8', errors='replace'))
+            if parsed:
+                timeline, nickname, text = parsed
+                yield ArchiveRecord(timeline, 0, nickname, text, '', offset)
+            offset += len(raw)
+
+
+def iter_segment(path: Path, start_offset: int = 0,
+                 start_timeline: Optional[int] = None) -> Iterator[ArchiveRecord]:
+    """按扩展名选择格式，逐条读取分段"""
+    if path.suffix == BINARY_SUFFIX:
+        return iter_binary_segment(path, start_offset, start_timeline)
+    return iter_text_segment(path, start_offset)
+
+
+def segment_sort_key(path: Path) -> Tuple[str, int]:
+    """分段按（日期, 序号）排序"""
+    match = SEGMENT_NAME.match(path.name)
+    return (match.group(1), int(match.group(2))) if match else (path.name, 0)
+
+
+def list_segments(folder: Path) -> List[Path]:
+    """列出目录下所有分段，按写入顺序排列"""
+    return sorted((path for path in folder.iterdir() if SEGMENT_NAME.match(path.name)),
+                  key=segment_sort_key)
@@ -0,0 +1,219 @@
+"""归档分段的稀疏索引
+
+每个分段旁边有一个同名 .idx 文件，追加写入两种行：
+    c <时间线> <字节偏移> <之前的最晚时间线>   每隔 every 条记录一个检查点
+    l <最早时间线> <最晚时间线> <条数>   每次刷盘时的分段概况，读取时以最后一行为准
+按时间范围查询时先二分定位分段，再在分段内二分检查点，只读取命中的那一段字节。
+时间线只是大致递增（同一批里可能有先收到的更晚弹幕），所以分段和检查点都按
+“之前所有记录的最晚时间线”二分，这个值单调不减，二分找到的起点之前不会有落在范围内的记录。
+"""
+import bisect
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from archive import ArchiveRecord, iter_segment, list_segments, segment_sort_key
+
+INDEX_SUFFIX = '.idx'
+
+
+class SegmentIndex:
+    """单个分段的索引"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.index_path = path.with_suffix(path.suffix + INDEX_SUFFIX)
+        self.checkpoints: List[Tuple[int, int, int]] = []  # （时间线, 偏移, 之前所有记录的最晚时间线）
+        self.min_timeline: Optional[int] = None
+        self.max_timeline: Optional[int] = None
+        self.count = 0
+
+    def load(self) -> bool:
+        """读取 .idx，不存在时返回 False"""
+        if not self.index_path.exists():
+            return False
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 4 and parts[0] == 'c':
+                    self.checkpoints.append((int(parts[1]), int(parts[2]), int(parts[3])))
+                elif len(parts) == 4 and parts[0] == 'l':
+                    self.min_timeline, self.max_timeline, self.count = map(int, parts[1:])
+        return True
+
+    def add(self, timeline: int, offset: int, every: int) -> Optional[Tuple[int, int, int]]:
+        """记录一条新写入的弹幕，到检查点时返回该检查点"""
+        checkpoint = None
+        if self.count % every == 0:
+            checkpoint = (timeline, offset, -1 if self.max_timeline is None else self.max_timeline)
+            self.checkpoints.append(checkpoint)
+        self.count += 1
+        self.min_timeline = timeline if self.min_timeline is None else min(self.min_timeline, timeline)
+        self.max_timeline = timeline if self.max_timeline is None else max(self.max_timeline, timeline)
+        return checkpoint
+
+    def save(self):
+        """整体写出 .idx，没有记录时不写"""
+        if self.count == 0:
+            return
+        lines = [f"c {timeline} {offset} {before}\n" for timeline, offset, before in self.checkpoints]
+        lines.append(f"l {self.min_timeline} {self.max_timeline} {self.count}\n")
+        self.index_path.write_text(''.join(lines), encoding='utf-8')
+
+    def seek(self, timeline: int) -> Tuple[int, Optional[int]]:
+        """找到之前所有记录都早于 timeline 的最后一个检查点，返回（偏移, 该处时间线）"""
+        position = bisect.bisect_left(self.checkpoints, timeline, key=lambda checkpoint: checkpoint[2]) - 1
+        if position < 0:
+            return 0, None
+        return self.checkpoints[position][1], self.checkpoints[position][0]
+
+
+class ArchiveIndex:
+    """一个存储目录下所有分段的稀疏索引
+
+    写入线程调用 track/record/flush 维护索引，查询线程调用 query，二者用锁隔开。
+    没有 .idx 的旧分段在第一次查询时由查询线程在锁外扫描补建，建好后在锁内放入，不阻塞写入。
+    """
+
+    def __init__(self, folder: Path, every: int = 64):
+        self.folder = folder
+        self.every = every
+        self._segments: Dict[Path, SegmentIndex] = {}
+        self._order: List[SegmentIndex] = []
+        self._max_prefix: List[int] = []
+        self._dirty = True
+        self._pending: Dict[Path, List[str]] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # 只在查询线程之间互斥，避免同时扫描同一批旧分段
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        """加载所有分段的索引，缺失的在锁外扫描补建"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            with self._lock:
+                missing = [path for path in list_segments(self.folder) if path not in self._segments]
+            self._install([self._build(path) for path in missing])
+            self._loaded = True
+
+    def _build(self, path: Path) -> Tuple[SegmentIndex, bool]:
+        """读取分段索引，没有 .idx 但已有数据时扫描补建，返回（索引, 是否扫描过），不写文件"""
+        segment = SegmentIndex(path)
+        if segment.load() or not path.exists():
+            return segment, False
+        for record in iter_segment(path):
+            segment.add(record.timeline, record.offset, self.every)
+        return segment, True
+
+    def _install(self, built: List[Tuple[SegmentIndex, bool]]):
+        """把锁外建好的索引放进来；写入线程已经登记过的分段以它的为准，丢弃这边的结果"""
+        with self._lock:
+            for segment, scanned in built:
+                if segment.path in self._segments:
+                    continue
+                if scanned:
+                    segment.save()  # 在锁内写出，避免覆盖写入线程随后追加的检查点
+                self._segments[segment.path] = segment
+            self._dirty = True
+
+    def _segment(self, path: Path) -> SegmentIndex:
+        """在锁内取分段索引，缺失时当场读取或扫描"""
+        segment = self._segments.get(path)
+        if segment is None:
+            segment, scanned = self._build(path)
+            if scanned:
+                segment.save()
+            self._segments[path] = segment
+            self._dirty = True
+        return segment
+
+    def track(self, path: Path):
+        """写入线程打开分段、写入任何内容之前调用，登记后查询线程不会再去扫描它"""
+        with self._lock:
+            self._segment(path)
+
+    def record(self, path: Path, timeline: int, offset: int):
+        """写入线程每写一条弹幕调用一次"""
+        with self._lock:
+            segment = self._segment(path)
+            checkpoint = segment.add(timeline, offset, self.every)
+            lines = self._pending.setdefault(path, [])
+            if checkpoint:
+                lines.append(f"c {checkpoint[0]} {checkpoint[1]} {checkpoint[2]}\n")
+            self._dirty = True
+
+    def flush(self):
+        """把新检查点和分段概况追加到 .idx，在分段数据刷盘之后调用"""
+        with self._lock:
+            touched = list(self._pending.items())
+            self._pending = {}
+            for path, lines in touched:
+                segment = self._segments[path]
+                lines.append(f"l {segment.min_timeline} {segment.max_timeline} {segment.count}\n")
+                with open(segment.index_path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(lines))
+
+    def _rebuild_order(self):
+        """分段按写入顺序排列，并计算最晚时间线的前缀最大值以便二分"""
+        self._order = sorted((segment for segment in self._segments.values() if segment.count),
+                             key=lambda segment: segment_sort_key(segment.path))
+        self._max_prefix = []
+        running = None
+        for segment in self._order:
+            running = segment.max_timeline if running is None else max(running, segment.max_timeline)
+            self._max_prefix.append(running)
+        self._dirty = False
+
+    def _plan(self, start: int, end: int) -> List[Tuple[Path, int, Optional[int]]]:
+        """确定要读取的分段及起始偏移"""
+        self._ensure_loaded()
+        with self._lock:
+            if self._dirty:
+                self._rebuild_order()
+            first = bisect.bisect_left(self._max_prefix, start)
+            plan = []
+            for segment in self._order[first:]:
+                # 时间线不严格递增，后面的分段仍可能有落在范围内的记录，只跳过不停下
+                if segment.min_timeline > end or segment.max_timeline < start:
+                    continue
+                offset, timeline = segment.seek(start)
+                plan.append((segment.path, offset, timeline))
+            return plan
+
+    def read_at(self, path: Path, offset: int) -> Optional[ArchiveRecord]:
+        """读取指定偏移处的一条弹幕，二进制分段从之前最近的检查点顺序读过去"""
+        with self._lock:
+            segment = self._segments.get(path)
+        if segment is None:
+            self._install([self._build(path)])
+        with self._lock:
+            segment = self._segments[path]
+            position = bisect.bisect_right(segment.checkpoints, offset, key=lambda checkpoint: checkpoint[1]) - 1
+            start_offset, start_timeline = (0, None) if position < 0 else (
+                segment.checkpoints[position][1], segment.checkpoints[position][0])
+        for record in iter_segment(path, start_offset, start_timeline):
+            if record.offset == offset:
+                return record
+            if record.offset > offset:
+                break
+        return None
+
+    def query(self, start: int, end: int, limit: int = 1000) -> Iterator[ArchiveRecord]:
+        """按时间范围逐条产出弹幕，最多 limit 条
+
+        分段内的时间线只是大致递增（同一批里可能有先收到的更晚弹幕），
+        遇到超出范围的记录跳过而不是停下，读到分段末尾为止。
+        """
+        produced = 0
+        for path, offset, timeline in self._plan(start, end):
+            for record in iter_segment(path, offset, timeline):
+                if record.timeline < start or record.timeline > end:
+                    continue
+                yield record
+                produced += 1
+                if produced >= limit:
+                    return
+
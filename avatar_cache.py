@@ -0,0 +1,215 @@
+"""头像代理缓存
+
+推送给前端的头像地址改为 /avatar/<文件名>，每个头像只向 CDN 取一次，
+缩成小图后存进有大小上限的磁盘 LRU，最近用过的再放一份在内存里。
+文件名取自 B 站头像地址 .../bfs/face/<文件名>，本身不带状态，多个 Web 进程都能直接服务。
+
+安装了 Pillow 时在本地缩图；没有时让 CDN 按 @<尺寸>w_<尺寸>h 后缀直接返回缩略图。
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import requests
+
+FACE_URL = re.compile(r'^(?:https?:)?//i\d\.hdslb\.com/bfs/face/(.+)$')
+AVATAR_NAME = re.compile(r'^[\w\-]+(?:/[\w\-]+)*\.\w+$')
+ROUTE_PREFIX = '/avatar/'
+
+
+@lru_cache(maxsize=None)
+def load_pillow():
+    """第一次创建缓存时才导入 Pillow，只采集的进程不用加载；没有安装时返回 None，缩图改由 CDN 完成"""
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return None
+    return Image, features
+
+
+def avatar_name(url: str, upstream: str = '') -> Optional[str]:
+    """从头像地址取出可代理的文件名，不是 B 站头像时返回 None"""
+    if not url:
+        return None
+    match = FACE_URL.match(url)
+    name = match.group(1) if match else (url[len(upstream):] if upstream and url.startswith(upstream) else None)
+    if name is None:
+        return None
+    name = name.split('@', 1)[0].split('?', 1)[0]  # 去掉 CDN 的缩放后缀和查询参数
+    return name if AVATAR_NAME.match(name) else None
+
+
+def proxied_avatar_url(url: str, upstream: str = '') -> str:
+    """推送给前端的头像地址，无法代理的原样返回"""
+    name = avatar_name(url, upstream)
+    return ROUTE_PREFIX + name if name else url
+
+
+def sniff_content_type(data: bytes) -> str:
+    """按文件头判断图片类型"""
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'GIF8'):
+        return 'image/gif'
+    return 'image/jpeg'
+
+
+class AvatarCache:
+    """头像缩略图的两级缓存：内存 LRU（按条数）+ 磁盘 LRU（按字节数）"""
+
+    def __init__(self, folder: Path, upstream: str, size: int = 64, max_bytes: int = 64 * 1024 * 1024,
+                 memory_items: int = 512, timeout: float = 5.0, session: Optional[requests.Session] = None,
+                 logger=None):
+        self.folder = Path(folder)
+        self.upstream = upstream
+        self.size = size
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.logger = logger
+        self._pillow = load_pillow()
+        self.hits = {'memory': 0, 'disk': 0, 'fetch': 0, 'error': 0}
+        self._memory: 'OrderedDict[str, Tuple[bytes, str]]' = OrderedDict()
+        self._disk: 'OrderedDict[str, int]' = OrderedDict()  # 磁盘文件名 -> 字节数，按最近使用排列
+        self._disk_bytes = 0
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._load_disk()
+
+    def _log(self, message: str):
+        if self.logger:
+            self.logger.log(message)
+
+    def _load_disk(self):
+        """按修改时间恢复磁盘 LRU 顺序"""
+        entries = sorted((path.stat().st_mtime, path.name, path.stat().st_size)
+                         for path in self.folder.iterdir() if path.suffix == '.img')
+        for _, filename, size in entries:
+            self._disk[filename] = size
+            self._disk_bytes += size
+
+    @staticmethod
+    def etag(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()[:16]
+
+    def _disk_path(self, name: str) -> Path:
+        return self.folder / (hashlib.sha1(name.encode('utf-8')).hexdigest() + '.img')
+
+    def get(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """返回（缩略图, ETag），取不到时返回 None"""
+        path = self._disk_path(name)
+        with self._lock:
+            cached = self._memory.get(name)
+            if cached:
+                self._memory.move_to_end(name)
+                # 磁盘 LRU 也按最近使用排列，否则常用的头像总在内存里命中，反而最先从磁盘淘汰
+                if path.name in self._disk:
+                    self._disk.move_to_end(path.name)
+                self.hits['memory'] += 1
+                return cached
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            data = None
+        if data is not None:
+            try:
+                os.utime(path)
+            except OSError:
+                pass  # 刚被其它进程淘汰
+            with self._lock:
+                if path.name in self._disk:
+                    self._disk.move_to_end(path.name)
+                self.hits['disk'] += 1
+            return self._remember(name, data)
+        return self._fetch_once(name)
+
+    def _remember(self, name: str, data: bytes) -> Tuple[bytes, str]:
+        entry = (data, self.etag(data))
+        with self._lock:
+            self._memory[name] = entry
+            self._memory.move_to_end(name)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return entry
+
+    def _fetch_once(self, name: str) -> Optional[Tuple[bytes, str]]:
+        """同一个头像同时只向上游请求一次，其它请求等它完成"""
+        with self._lock:
+            event = self._inflight.get(name)
+            leader = event is None
+            if leader:
+                event = self._inflight[name] = threading.Event()
+        if not leader:
+            event.wait(self.timeout * 2)
+            with self._lock:
+                return self._memory.get(name)
+        try:
+            data = self._fetch(name)
+            if data is None:
+                return None
+            self._store(name, data)
+            return self._remember(name, data)
+        finally:
+            with self._lock:
+                self._inflight.pop(name, None)
+            event.set()
+
+    def _fetch(self, name: str) -> Optional[bytes]:
+        url = self.upstream + name
+        if self._pillow is None:
+            url += f"@{self.size}w_{self.size}h.webp"
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = self._thumbnail(response.content)
+        except Exception as e:
+            self.hits['error'] += 1
+            self._log(f"获取头像失败 {name}: {e}")
+            return None
+        self.hits['fetch'] += 1
+        return data
+
+    def _thumbnail(self, data: bytes) -> bytes:
+        if self._pillow is None:
+            return data
+        Image, features = self._pillow
+        with Image.open(BytesIO(data)) as image:
+            image.thumbnail((self.size, self.size))
+            out = BytesIO()
+            if features.check('webp'):
+                image.convert('RGBA').save(out, 'WEBP', quality=80)
+            else:
+                image.convert('RGB').save(out, 'JPEG', quality=85)
+            return out.getvalue()
+
+    def _store(self, name: str, data: bytes):
+        """写入磁盘缓存，超出上限时淘汰最久未用的"""
+        path = self._disk_path(name)
+        tmp_path = path.with_suffix(f'.tmp{threading.get_ident()}')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(path.name, 0)
+            self._disk[path.name] = len(data)
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                filename, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(filename)
+        for filename in evicted:
+            (self.folder / filename).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.hits, 'memory_items': len(self._memory), 'disk_items': len(self._disk),
+                    'disk_bytes': self._disk_bytes}
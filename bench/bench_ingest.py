@@ -0,0 +1,198 @@
+"""采集流程基准测试
+
+在子进程里启动 gethistory 替身服务器，把 Config.BILIBILI_API_BASE 指过去，
+在临时目录里端到端驱动 DanmakuManager（请求、解析、去重、写入、推送），
+结束后把吞吐、各阶段延迟、写入字节数和峰值内存写成 JSON，方便前后对比：
+
+    python bench/bench_ingest.py --duration 20 --output before.json
+    python bench/bench_ingest.py --duration 20 --output after.json --baseline before.json
+"""
+import argparse
+import json
+import multiprocessing
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import metrics  # noqa: E402
+import stub_server  # noqa: E402
+from rss import peak_rss_kb  # noqa: E402
+from keyword_filter import KeywordFilter  # noqa: E402
+from web import Config, CustomLogger, DanmakuManager, FileManager  # noqa: E402
+
+ROOM_ID = 1
+
+STAGES = {
+    'poll': metrics.POLL_SECONDS,
+    'json_decode': metrics.JSON_DECODE_SECONDS,
+    'dedup': metrics.DEDUP_SECONDS,
+    'filter': metrics.FILTER_SECONDS,
+    'store': metrics.STORE_SECONDS,
+    'emit': metrics.EMIT_SECONDS,
+    'write_batch': metrics.WRITE_BATCH_SECONDS,
+    'flush': metrics.FLUSH_SECONDS,
+}
+
+
+class CountingSocketIO:
+    """代替 SocketIO，只统计推送的事件数和弹幕数"""
+
+    def __init__(self):
+        self.events = 0
+        self.messages = 0
+
+    def emit(self, event, data, to=None):
+        self.events += 1
+        self.messages += len(data) if isinstance(data, list) else 1
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def folder_bytes(folder: Path) -> int:
+    return sum(path.stat().st_size for path in folder.rglob('*') if path.is_file())
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ''
+
+
+def stage_summary(histogram) -> dict:
+    summary = histogram.labels(ROOM_ID).summary()
+    # 分位数为所在分桶的上界（毫秒），落在 +Inf 分桶时记为 None
+    return {
+        'count': summary['count'],
+        'mean_ms': summary['mean'] * 1000,
+        **{f"{key}_ms": (None if value == float('inf') else value * 1000)
+           for key, value in summary.items() if key.startswith('p')},
+    }
+
+
+def run(args) -> dict:
+    port = free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=stub_server.serve,
+        args=('127.0.0.1', port, args.rate, args.window, args.dup_ratio, args.seed, ready),
+        daemon=True)
+    server.start()
+    ready.wait(10)
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='danmaku_bench_') as tmp:
+            config = Config(BILIBILI_API_BASE=f"http://127.0.0.1:{port}", ROOM_IDS=[ROOM_ID],
+                            ARCHIVE_FORMAT=args.archive_format, LOG_LEVEL=args.log_level)
+            logger = CustomLogger(level=config.LOG_LEVEL)
+            sink = CountingSocketIO()
+            keyword_filter = KeywordFilter(args.keywords, reload_interval=0) if args.keywords else None
+            manager = DanmakuManager(config, FileManager(tmp, logger=logger), sink,
+                                     logger=logger, room_id=ROOM_ID, keyword_filter=keyword_filter)
+            manager.start()
+
+            polls = returned = new = 0
+            started = time.perf_counter()
+            deadline = started + args.duration
+            while time.perf_counter() < deadline:
+                try:
+                    batch_returned, batch_new, _ = manager._fetch_and_process_danmaku()
+                except Exception as e:
+                    logger.log(f"轮询出错: {e}")
+                    continue
+                polls += 1
+                returned += batch_returned
+                new += batch_new
+                if args.interval:
+                    time.sleep(args.interval)
+            ingest_elapsed = time.perf_counter() - started
+            manager.stop()  # 刷完写入队列和推送队列
+            elapsed = time.perf_counter() - started
+
+            base = Path(tmp)
+            bytes_written = {
+                'archive': folder_bytes(base / 'danmaku_files'),
+                'search': folder_bytes(base / 'search') if (base / 'search').exists() else 0,
+                'dedup_journal': folder_bytes(base / 'time_set'),
+            }
+            bytes_written['total'] = folder_bytes(base)
+    finally:
+        server.terminate()
+        server.join()
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'params': vars(args),
+        'elapsed_s': elapsed,
+        'polls': polls,
+        'messages_returned': returned,
+        'messages_new': new,
+        'messages_emitted': sink.messages,
+        'duplicate_ratio': 1 - new / returned if returned else 0.0,
+        'polls_per_s': polls / ingest_elapsed,
+        'messages_per_s': new / elapsed,
+        'stages': {name: stage_summary(histogram) for name, histogram in STAGES.items()},
+        'bytes_written': bytes_written,
+        'bytes_per_message': bytes_written['archive'] / new if new else 0.0,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """打印与基线的对比"""
+    def line(name, old, new, lower_is_better=False):
+        if not old:
+            return
+        change = (new - old) / old * 100
+        better = change < 0 if lower_is_better else change > 0
+        print(f"  {name:<28} {old:>12.3f} -> {new:>12.3f}  {change:+6.1f}% {'↑' if better else '↓'}")
+
+    print(f"对比基线 {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    line('messages_per_s', baseline['messages_per_s'], report['messages_per_s'])
+    line('bytes_per_message', baseline['bytes_per_message'], report['bytes_per_message'], True)
+    line('peak_rss_kb', baseline['peak_rss_kb'], report['peak_rss_kb'], True)
+    for name, stage in report['stages'].items():
+        old = baseline['stages'].get(name)
+        if old:
+            line(f"{name}.mean_ms", old['mean_ms'], stage['mean_ms'], True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕采集基准测试")
+    parser.add_argument('--duration', type=float, default=10, help="压测秒数")
+    parser.add_argument('--rate', type=float, default=0, help="替身服务器每秒新弹幕数，0 为不限速")
+    parser.add_argument('--window', type=int, default=10, help="每次 gethistory 返回的条数")
+    parser.add_argument('--dup-ratio', type=float, default=0.5, help="不限速时每次返回中重复弹幕的比例")
+    parser.add_argument('--interval', type=float, default=0, help="两次轮询之间的间隔（秒），0 为背靠背")
+    parser.add_argument('--archive-format', choices=['text', 'binary'], default='text')
+    parser.add_argument('--log-level', default='INFO')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keywords', help="屏蔽词表，给出时测量过滤阶段的耗时")
+    parser.add_argument('--output', default='bench_ingest.json', help="结果 JSON 路径")
+    parser.add_argument('--baseline', help="之前的结果 JSON，给出时打印对比")
+    args = parser.parse_args()
+
+    report = run(args)
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"{report['messages_new']} 条新弹幕 / {report['elapsed_s']:.1f}s = {report['messages_per_s']:.0f} 条/秒，"
+          f"峰值内存 {report['peak_rss_kb'] / 1024:.1f} MB，结果已写入 {args.output}")
+    if args.baseline:
+        compare(report, json.loads(Path(args.baseline).read_text(encoding='utf-8')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""启动耗时和空闲内存对比
+
+分别以无界面采集（collector.py）和完整应用（web.py 的 BackgroundServer）启动，
+都把 BILIBILI_API_BASE 指向替身服务器，在独立子进程和临时目录里各跑几次，记录：
+    ready_s      从启动解释器到开始采集的时间
+    import_s     其中导入模块和创建组件的时间
+    rss_kb       空闲一段时间后的常驻内存
+    modules      已导入的模块数，以及是否加载了 Flask 等 Web 依赖
+房间数可以给多个，用来估算每多一个房间增加的内存：
+
+    python bench/bench_startup.py --rooms 1,8 --repeat 3 --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from rss import current_rss_kb
+
+ROOT = Path(__file__).resolve().parent.parent
+MODES = ('collector', 'full')
+MARKER = 'BENCH '
+
+
+def child(mode: str, idle: float, port: int):
+    """子进程：启动一种模式，报告就绪时间，空闲后报告内存，再正常停止"""
+    sys.path.insert(0, str(ROOT))
+    started = time.perf_counter()
+    if mode == 'collector':
+        from collector import Collector
+        from web import Config
+        service = Collector(Config())
+    else:
+        from web import BackgroundServer
+        service = BackgroundServer(port=port)
+    service.start()
+    print(MARKER + json.dumps({'import_s': time.perf_counter() - started}), flush=True)
+    time.sleep(idle)
+    print(MARKER + json.dumps({
+        'rss_kb': current_rss_kb(),
+        'modules': len(sys.modules),
+        'web_stack_loaded': any(name in sys.modules for name in ('flask', 'flask_socketio', 'werkzeug')),
+    }), flush=True)
+    service.stop()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure(mode: str, rooms: int, idle: float, api_base: str) -> dict:
+    """起一个子进程测一次"""
+    with tempfile.TemporaryDirectory(prefix='danmaku_startup_') as tmp:
+        env = dict(os.environ, BILIBILI_API_BASE=api_base, LOG_LEVEL='INFO',
+                   ROOM_IDS=','.join(str(100 + i) for i in range(rooms)))
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, str(Path(__file__).resolve()), '--child', mode,
+                                    '--idle', str(idle), '--port', str(free_port())],
+                                   cwd=tmp, env=env, stdout=subprocess.PIPE, text=True, encoding='utf-8')
+        result = {}
+        for line in process.stdout:
+            if not line.startswith(MARKER):
+                continue
+            if not result:
+                result['ready_s'] = time.perf_counter() - started
+            result.update(json.loads(line[len(MARKER):]))
+        process.wait(timeout=30)
+        if 'rss_kb' not in result:
+            raise RuntimeError(f"{mode} 子进程异常退出，返回码 {process.returncode}")
+        return result
+
+
+def run(args) -> dict:
+    import multiprocessing
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    import stub_server
+
+    port = free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=stub_server.serve, args=('127.0.0.1', port, 5, 10, 0, 0, ready),
+                                     daemon=True)
+    server.start()
+    ready.wait(10)
+    results = {}
+    try:
+        for rooms in args.rooms:
+            for mode in MODES:
+                runs = [measure(mode, rooms, args.idle, f"http://127.0.0.1:{port}") for _ in range(args.repeat)]
+                results[f"{mode}:{rooms}"] = {
+                    'mode': mode,
+                    'rooms': rooms,
+                    'ready_s': statistics.median(sample['ready_s'] for sample in runs),
+                    'import_s': statistics.median(sample['import_s'] for sample in runs),
+                    'rss_kb': statistics.median(sample['rss_kb'] for sample in runs),
+                    'modules': runs[-1]['modules'],
+                    'web_stack_loaded': runs[-1]['web_stack_loaded'],
+                }
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'params': {'rooms': args.rooms, 'repeat': args.repeat, 'idle': args.idle},
+        'results': results,
+    }
+
+
+def print_report(report: dict):
+    results = report['results']
+    print(f"{'模式':<10} {'房间':>4} {'就绪(s)':>9} {'导入(s)':>9} {'内存(MB)':>9} {'模块数':>6}  Web 依赖")
+    for result in results.values():
+        print(f"{result['mode']:<10} {result['rooms']:>4} {result['ready_s']:>9.3f} {result['import_s']:>9.3f} "
+              f"{result['rss_kb'] / 1024:>9.1f} {result['modules']:>6}  {'是' if result['web_stack_loaded'] else '否'}")
+    rooms = report['params']['rooms']
+    for count in rooms:
+        lean, full = results[f"collector:{count}"], results[f"full:{count}"]
+        print(f"{count} 个房间：无界面采集就绪快 {full['ready_s'] - lean['ready_s']:.3f}s，"
+              f"内存少 {(full['rss_kb'] - lean['rss_kb']) / 1024:.1f} MB")
+    if len(rooms) > 1:
+        low, high = min(rooms), max(rooms)
+        for mode in MODES:
+            per_room = (results[f"{mode}:{high}"]['rss_kb'] - results[f"{mode}:{low}"]['rss_kb']) / (high - low)
+            print(f"{mode} 每多一个房间约增加 {per_room / 1024:.2f} MB")
+
+
+def parse_room_counts(value: str) -> list:
+    """解析 --rooms，多组时按最少和最多两组的差值算每个房间的内存，所以不能重复"""
+    try:
+        counts = [int(count) for count in value.split(',') if count.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"房间数必须是整数: {value}")
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError(f"房间数必须为正整数: {value}")
+    if len(set(counts)) != len(counts):
+        raise argparse.ArgumentTypeError(f"房间数不能重复: {value}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时和空闲内存对比")
+    parser.add_argument('--rooms', type=parse_room_counts, default=[1], help="房间数，逗号分隔可测多组，不能重复")
+    parser.add_argument('--repeat', type=int, default=3, help="每种组合跑几次取中位数")
+    parser.add_argument('--idle', type=float, default=5, help="就绪后空闲多少秒再读内存")
+    parser.add_argument('--output', default='bench_startup.json', help="结果 JSON 路径")
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.idle, args.port)
+        return
+    report = run(args)
+    Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print_report(report)
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
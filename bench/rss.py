@@ -0,0 +1,24 @@
+"""基准测试共用的内存读数，单位统一为 KB
+
+ru_maxrss 在 Linux 上是 KB，在 macOS 上是字节，这里统一换算。
+"""
+import sys
+
+
+def peak_rss_kb() -> int:
+    """本进程的峰值常驻内存"""
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def current_rss_kb() -> int:
+    """当前常驻内存，Linux 读 /proc，其它平台退回峰值"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return peak_rss_kb()
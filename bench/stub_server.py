@@ -0,0 +1,139 @@
+"""gethistory 替身服务器
+
+生成与真实接口同样结构的响应（timeline、uid、nickname、text、user.base.face），
+供基准测试在本地压测采集流程，不依赖网络和真实直播间。
+同时在 /bfs/face/<文件名> 提供按文件名着色的头像图片，设置
+AVATAR_UPSTREAM=http://127.0.0.1:<端口>/bfs/face/ 即可离线测试头像代理。
+
+两种模式：
+    --rate N   每秒产生 N 条新弹幕，每次请求返回最新的 --window 条，重复率取决于轮询快慢
+    --rate 0   不限速，每次请求返回 --window 条，其中 --dup-ratio 比例是上一次已经返回过的
+"""
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+WORDS = ['主播加油', '哈哈哈哈', '666', 'awsl', '前方高能', '下次一定', '这也太强了', '来了来了',
+         '好耶', '草', 'gg', '晚上好', '弹幕护体', '名场面', '?????', '爷青回']
+
+
+class SyntheticHistory:
+    """合成弹幕源"""
+
+    def __init__(self, rate: float = 0, window: int = 10, dup_ratio: float = 0.5,
+                 users: int = 5000, seed: int = 0):
+        self.rate = rate
+        self.window = window
+        self.dup_ratio = dup_ratio
+        self.users = users
+        self.random = random.Random(seed)
+        self.started = time.time()
+        self.produced = 0
+        self.served = 0
+        self.faces_served = 0
+        self.recent: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _message(self) -> dict:
+        uid = self.random.randint(1, self.users)
+        # 不限速时假定每秒 50 条，让时间线保持在去重窗口的合理范围内
+        offset = self.produced / self.rate if self.rate else self.produced / 50
+        self.produced += 1
+        return {
+            'timeline': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started + offset)),
+            'uid': uid,
+            'nickname': f"观众{uid}",
+            'text': f"{self.random.choice(WORDS)} {self.produced}",
+            'user': {'uid': uid, 'base': {'face': f"https://i0.hdslb.com/bfs/face/{uid:08d}.jpg"}},
+        }
+
+    def next_batch(self) -> list:
+        with self._lock:
+            if self.rate:
+                due = int((time.time() - self.started) * self.rate)
+                fresh = min(due - self.produced, self.window)
+                self.produced = max(self.produced, due - fresh)
+            else:
+                fresh = self.window if not self.recent else round(self.window * (1 - self.dup_ratio))
+            for _ in range(fresh):
+                self.recent.append(self._message())
+            self.served += 1
+            return list(self.recent)
+
+
+def make_png(width: int, height: int, rgb: tuple) -> bytes:
+    """生成纯色 PNG，不依赖 Pillow"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    rows = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+def make_handler(history: SyntheticHistory, face_size: int = 256):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/bfs/face/'):
+                self._send_face()
+                return
+            if not self.path.startswith('/xlive/web-room/v1/dM/gethistory'):
+                self.send_error(404)
+                return
+            body = json.dumps({'code': 0, 'message': '0', 'data': {'admin': [], 'room': history.next_batch()}},
+                              ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_face(self):
+            name = self.path[len('/bfs/face/'):].split('@', 1)[0]
+            body = make_png(face_size, face_size, hashlib.md5(name.encode('utf-8')).digest()[:3])
+            history.faces_served += 1
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str, port: int, rate: float, window: int, dup_ratio: float, seed: int = 0,
+          ready: Optional[threading.Event] = None):
+    """启动替身服务器并一直运行，ready 可以是 multiprocessing.Event"""
+    history = SyntheticHistory(rate, window, dup_ratio, seed=seed)
+    server = ThreadingHTTPServer((host, port), make_handler(history))
+    server.daemon_threads = True
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gethistory 替身服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--rate', type=float, default=0, help="每秒新弹幕数，0 为不限速")
+    parser.add_argument('--window', type=int, default=10, help="每次返回的条数，真实接口为 10")
+    parser.add_argument('--dup-ratio', type=float, default=0.5, help="不限速时每次返回中重复弹幕的比例")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(f"gethistory 替身服务器: http://{args.host}:{args.port}")
+    serve(args.host, args.port, args.rate, args.window, args.dup_ratio, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""B站直播间弹幕 WebSocket 协议
+
+包含数据包编解码、带心跳和断线重连的采集客户端，
+以及一个回放录制帧的本地替身服务器，方便离线测试解码和吞吐。
+
+    python bili_ws.py --replay frames.jsonl --port 7777
+    python bili_ws.py --synthetic 100000 --compression brotli --speed 0
+"""
+import argparse
+import base64
+import hashlib
+import json
+import socketserver
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, List, Tuple
+
+try:
+    import websocket  # websocket-client
+except ImportError:
+    websocket = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+HEADER = struct.Struct('>IHHII')  # 包长, 头长, 协议版本, 操作码, 序号
+
+PROTO_JSON = 0
+PROTO_INT = 1
+PROTO_ZLIB = 2
+PROTO_BROTLI = 3
+
+OP_HEARTBEAT = 2
+OP_HEARTBEAT_REPLY = 3
+OP_MESSAGE = 5
+OP_AUTH = 7
+OP_AUTH_REPLY = 8
+
+
+def encode_packet(op: int, body=b'', protover: int = PROTO_INT) -> bytes:
+    """编码一个数据包，body 可以是 bytes、str 或 dict"""
+    if isinstance(body, dict):
+        body = json.dumps(body, ensure_ascii=False, separators=(',', ':'))
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return HEADER.pack(HEADER.size + len(body), HEADER.size, protover, op, 1) + body
+
+
+def decode_packets(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """拆分一帧里的所有数据包，压缩包递归解压，产出（操作码, 包体）"""
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        packet_len, header_len, protover, op, _ = HEADER.unpack_from(data, offset)
+        if packet_len < header_len:
+            raise ValueError(f"数据包长度异常: {packet_len}")
+        body = data[offset + header_len:offset + packet_len]
+        offset += packet_len
+
+        if op == OP_MESSAGE and protover == PROTO_ZLIB:
+            yield from decode_packets(zlib.decompress(body))
+        elif op == OP_MESSAGE and protover == PROTO_BROTLI:
+            if brotli is None:
+                raise RuntimeError("收到 brotli 压缩包，但未安装 brotli")
+            yield from decode_packets(brotli.decompress(body))
+        else:
+            yield op, body
+
+
+def danmu_msg_to_history(info: list) -> dict:
+    """把 DANMU_MSG 的 info 字段转换成 gethistory 接口的弹幕格式"""
+    meta, user_info = info[0], info[2]
+    face = ''
+    if len(meta) > 15 and isinstance(meta[15], dict):
+        face = meta[15].get('user', {}).get('base', {}).get('face', '')
+    return {
+        'timeline': int(meta[4] // 1000),
+        'uid': user_info[0],
+        'nickname': user_info[1],
+        'text': info[1],
+        'user': {'uid': user_info[0], 'base': {'face': face}},
+    }
+
+
+class LiveWebSocketClient:
+    """直播间弹幕 WebSocket 客户端
+
+    认证后按固定间隔发送心跳，解码出的 DANMU_MSG 交给 on_danmaku；
+    连接断开时按指数退避自动重连。
+    """
+
+    def __init__(self, room_id: int, on_danmaku: Callable[[dict], object], config, session=None,
+                 logger=None, record_path: str = ''):
+        self.room_id = room_id
+        self.on_danmaku = on_danmaku
+        self.config = config
+        self.session = session
+        self.logger = logger
+        self.record_path = record_path
+        self.messages = 0
+        self.reconnects = 0
+        self._ws = None
+        self._authenticated = False
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动客户端线程"""
+        if websocket is None:
+            raise RuntimeError("WebSocket 采集需要安装 websocket-client")
+        self._thread.start()
+
+    def stop(self):
+        """断开连接并停止重连"""
+        self._stop_event.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+    def _log(self, message: str):
+        if self.logger:
+            self.logger.log(message)
+
+    def _connect_info(self) -> Tuple[str, str]:
+        """获取连接地址和认证 token，配置了 BILIBILI_WS_URL 时直接使用"""
+        if self.config.BILIBILI_WS_URL:
+            return self.config.BILIBILI_WS_URL, ''
+        url = f"{self.config.BILIBILI_API_BASE}/xlive/web-room/v1/index/getDanmuInfo"
+        response = self.session.get(url, params={'id': self.room_id, 'type': 0},
+                                    headers=self.config.HEADERS, timeout=self.config.POLL_TIMEOUT)
+        data = response.json()
+        if data['code'] != 0:
+            raise ValueError(f"获取弹幕服务器失败: {data.get('message')}")
+        host = data['data']['host_list'][0]
+        return f"wss://{host['host']}:{host['wss_port']}/sub", data['data']['token']
+
+    def _run(self):
+        """连接主循环，断线后指数退避重连"""
+        delay = self.config.WS_RECONNECT_MIN
+        while not self._stop_event.is_set():
+            self._authenticated = False
+            try:
+                self._serve_connection()
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                # 认证成功过说明是正常连接后掉线，退避从头开始
+                if self._authenticated:
+                    delay = self.config.WS_RECONNECT_MIN
+                self._log(f"房间 {self.room_id} WebSocket 连接出错: {e}，{delay:.0f} 秒后重连")
+            finally:
+                self._ws = None
+            if self._stop_event.wait(delay):
+                break
+            self.reconnects += 1
+            delay = min(self.config.WS_RECONNECT_MAX, delay * 2)
+
+    def _serve_connection(self):
+        """建立一次连接，认证后收包直到断开"""
+        url, token = self._connect_info()
+        ws = websocket.create_connection(url, timeout=self.config.WS_HEARTBEAT_INTERVAL,
+                                         header=[f"User-Agent: {self.config.HEADERS['User-Agent']}"])
+        self._ws = ws
+        ws.send_binary(encode_packet(OP_AUTH, {
+            'uid': 0,
+            'roomid': self.room_id,
+            'protover': PROTO_BROTLI if brotli is not None else PROTO_ZLIB,
+            'platform': 'web',
+            'type': 2,
+            'key': token,
+        }))
+        self._log(f"房间 {self.room_id} 已连接弹幕服务器 {url}")
+
+        record = open(self.record_path, 'a', encoding='utf-8') if self.record_path else None
+        connected_at = time.monotonic()
+        next_heartbeat = connected_at
+        try:
+            while not self._stop_event.is_set():
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    ws.send_binary(encode_packet(OP_HEARTBEAT, '[object Object]'))
+                    next_heartbeat = now + self.config.WS_HEARTBEAT_INTERVAL
+                ws.settimeout(max(0.1, next_heartbeat - now))
+                try:
+                    frame = ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    continue
+                if not frame:
+                    raise ConnectionError("服务器关闭了连接")
+                if isinstance(frame, str):
+                    frame = frame.encode('utf-8')
+                if record:
+                    record.write(json.dumps({'t': round(time.monotonic() - connected_at, 3),
+                                             'frame': base64.b64encode(frame).decode('ascii')}) + '\n')
+                self._handle_frame(frame)
+        finally:
+            if record:
+                record.close()
+            ws.close()
+
+    def _handle_frame(self, frame: bytes):
+        """处理一帧数据"""
+        for op, body in decode_packets(frame):
+            if op == OP_AUTH_REPLY:
+                reply = json.loads(body or b'{}')
+                if reply.get('code', 0) != 0:
+                    raise ConnectionError(f"认证失败: {reply}")
+                self._authenticated = True
+            elif op == OP_MESSAGE:
+                event = json.loads(body)
+                # 带参数的指令形如 DANMU_MSG:4:0:2:2:2:0
+                if event.get('cmd', '').split(':', 1)[0] == 'DANMU_MSG':
+                    self.messages += 1
+                    self.on_danmaku(danmu_msg_to_history(event['info']))
+
+
+# ---------------------------------------------------------------- 本地替身服务器
+
+def synthetic_frames(count: int, per_frame: int = 20, compression: str = 'zlib',
+                     rate: float = 100.0) -> List[Tuple[float, bytes]]:
+    """生成 count 条 DANMU_MSG 的帧序列，rate 为每秒弹幕数"""
+    frames = []
+    now_ms = int(time.time() * 1000)
+    for start in range(0, count, per_frame):
+        packets = b''
+        for i in range(start, min(count, start + per_frame)):
+            uid = 10000 + i % 500
+            event = {'cmd': 'DANMU_MSG', 'info': [
+                [0, 1, 25, 16777215, now_ms + int(i * 1000 / rate), 0, 0, '', 0, 0, 0, '', 0, '{}', '{}',
+                 {'user': {'uid': uid, 'base': {'name': f'用户{uid}', 'face': f'https://i0.hdslb.com/face/{uid}.jpg'}}}],
+                f'第 {i} 条测试弹幕', [uid, f'用户{uid}', 0, 0, 0, 10000, 1, ''],
+            ]}
+            packets += encode_packet(OP_MESSAGE, event, PROTO_JSON)
+        if compression == 'brotli':
+            frame = encode_packet(OP_MESSAGE, brotli.compress(packets, quality=5), PROTO_BROTLI)
+        elif compression == 'zlib':
+            frame = encode_packet(OP_MESSAGE, zlib.compress(packets), PROTO_ZLIB)
+        else:
+            frame = packets
+        frames.append((start / rate, frame))
+    return frames
+
+
+def load_recording(path: str) -> List[Tuple[float, bytes]]:
+    """读取客户端录制的帧（每行 {"t": 秒, "frame": base64}）"""
+    frames = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                frames.append((item['t'], base64.b64decode(item['frame'])))
+    return frames
+
+
+def _ws_send(wfile, payload: bytes, opcode: int = 0x2):
+    """发送一个不加掩码的服务端帧"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    wfile.write(header + payload)
+    wfile.flush()
+
+
+def _ws_recv(rfile) -> Tuple[int, bytes]:
+    """读取一个客户端帧，返回（opcode, 解掩码后的内容）"""
+    head = rfile.read(2)
+    if len(head) < 2:
+        return 0x8, b''
+    opcode, length = head[0] & 0x0F, head[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', rfile.read(8))[0]
+    mask = rfile.read(4) if head[1] & 0x80 else b'\0\0\0\0'
+    data = rfile.read(length)
+    return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+
+
+class _ReplayHandler(socketserver.StreamRequestHandler):
+    """单个连接：握手、认证后按录制节奏回放帧，同时应答心跳"""
+
+    def handle(self):
+        key = ''
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.lower() == 'sec-websocket-key':
+                key = value.strip()
+        accept = base64.b64encode(hashlib.sha1((key + '258EAFA5-E914-47DA-95CA-C5AB0DC85B11').encode()).digest())
+        self.wfile.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                         b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        self.wfile.flush()
+
+        opcode, auth = _ws_recv(self.rfile)
+        if opcode == 0x8 or not any(op == OP_AUTH for op, _ in decode_packets(auth)):
+            return
+        lock = threading.Lock()
+        with lock:
+            _ws_send(self.wfile, encode_packet(OP_AUTH_REPLY, {'code': 0}))
+        closed = threading.Event()
+        threading.Thread(target=self._answer_heartbeats, args=(lock, closed), daemon=True).start()
+
+        server = self.server
+        started = time.monotonic()
+        try:
+            for offset, frame in server.frames:
+                if server.speed > 0:
+                    delay = started + offset / server.speed - time.monotonic()
+                    if delay > 0 and closed.wait(delay):
+                        return
+                if closed.is_set():
+                    return
+                with lock:
+                    _ws_send(self.wfile, frame)
+            closed.wait()
+        except OSError:
+            pass
+
+    def _answer_heartbeats(self, lock: threading.Lock, closed: threading.Event):
+        try:
+            while True:
+                opcode, payload = _ws_recv(self.rfile)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    with lock:
+                        _ws_send(self.wfile, payload, 0xA)
+                elif any(op == OP_HEARTBEAT for op, _ in decode_packets(payload)):
+                    with lock:
+                        _ws_send(self.wfile, encode_packet(OP_HEARTBEAT_REPLY, struct.pack('>I', 1)))
+        except OSError:
+            pass
+        finally:
+            closed.set()
+
+
+class ReplayServer(socketserver.ThreadingTCPServer):
+    """回放录制帧的本地弹幕服务器，speed 为 0 时不等待、尽快发送"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], frames: List[Tuple[float, bytes]], speed: float = 1.0):
+        super().__init__(address, _ReplayHandler)
+        self.frames = frames
+        self.speed = speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地弹幕 WebSocket 替身服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--replay', help="客户端录制的帧文件（WS_RECORD_PATH）")
+    parser.add_argument('--synthetic', type=int, default=1000, help="未指定 --replay 时生成的弹幕条数")
+    parser.add_argument('--rate', type=float, default=100.0, help="合成弹幕的每秒条数")
+    parser.add_argument('--compression', choices=['none', 'zlib', 'brotli'], default='zlib')
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速，0 表示尽快发送")
+    args = parser.parse_args()
+
+    if args.replay:
+        frames = load_recording(args.replay)
+    else:
+        frames = synthetic_frames(args.synthetic, compression=args.compression, rate=args.rate)
+    server = ReplayServer((args.host, args.port), frames, speed=args.speed)
+    print(f"弹幕替身服务器: ws://{args.host}:{args.port}/sub，共 {len(frames)} 帧")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""无界面采集
+
+只采集、去重、过滤和写归档，不导入 Flask、Flask-SocketIO、Werkzeug，也不启动 Web 服务；
+轮询模式下也不导入 bili_ws 和 websocket-client，INGEST_BACKEND=ws 时才在启动房间时导入。
+适合只负责存档的机器。复用 web.py 的 Config、FileManager、DanmakuManager 和 RoomScheduler，
+存储目录结构与 web.py 相同，之后用 web.py 或 serve.py 打开同一目录即可查询和回放：
+--rooms 只给一个房间时与 web.py 单房间模式（ROOM_ID）一样直接写在存储目录下，
+给多个房间时与 ROOM_IDS 一样每个房间写在 rooms/<房间号>/ 下。
+收到 SIGINT（Ctrl+C）或 SIGTERM 时停止轮询，刷完写入队列再退出。
+
+    python collector.py --rooms 3533884,21452505
+    python collector.py --rooms 3533884 --status-interval 30
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+from typing import Callable, List, Optional
+
+from keyword_filter import KeywordFilter
+from web import Config, CustomLogger, DanmakuManager, FileManager, RoomScheduler
+
+
+class Collector:
+    """无界面采集器，管理各房间的 DanmakuManager，不推送"""
+
+    def __init__(self, config: Config, base_path: str = '.', log_callback: Optional[Callable[[str], None]] = None):
+        self.config = config
+        self.logger = CustomLogger(log_callback, config.LOG_LEVEL)
+        file_manager = FileManager(base_path, logger=self.logger)
+        self.keyword_filter = KeywordFilter(config.KEYWORD_FILE, config.KEYWORD_ACTION, config.KEYWORD_RELOAD_INTERVAL,
+                                            logger=self.logger) if config.KEYWORD_FILE else None
+        self.managers: List[DanmakuManager] = [
+            DanmakuManager(config, file_manager.for_room(room_id) if config.multi_room else file_manager,
+                           None, logger=self.logger, room_id=room_id, keyword_filter=self.keyword_filter)
+            for room_id in config.room_ids()
+        ]
+        self.scheduler = RoomScheduler(config, self.managers, logger=self.logger)
+
+    def start(self):
+        if self.keyword_filter:
+            self.keyword_filter.start()
+        self.scheduler.start()
+
+    def stop(self):
+        """停止轮询并刷完所有房间的写入队列，可重复调用"""
+        self.scheduler.stop()
+        if self.keyword_filter:
+            self.keyword_filter.stop()
+
+    def status(self) -> List[dict]:
+        return [manager.status() for manager in self.managers]
+
+
+def parse_rooms(value: str) -> List[int]:
+    return [int(room_id) for room_id in value.split(',') if room_id.strip()]
+
+
+def build_config(rooms: Optional[List[int]], log_level: Optional[str]) -> Config:
+    """命令行参数转为 Config，只给一个房间时按单房间模式设置 ROOM_ID"""
+    overrides = {}
+    if rooms and len(rooms) == 1:
+        os.environ['ROOM_ID'] = str(rooms[0])
+        overrides['ROOM_IDS'] = []  # 不再读取环境变量 ROOM_IDS 或 rooms.json
+    elif rooms:
+        overrides['ROOM_IDS'] = rooms
+    if log_level:
+        overrides['LOG_LEVEL'] = log_level
+    return Config(**overrides)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="无界面弹幕采集")
+    parser.add_argument('--rooms', type=parse_rooms,
+                        help="房间号列表，逗号分隔，只有一个时按单房间模式存储；不给时与 web.py 一样读取 ROOM_IDS、rooms.json 或 ROOM_ID")
+    parser.add_argument('--data-dir', default='.', help="存储目录，与 web.py 的工作目录结构相同")
+    parser.add_argument('--log-level', help="日志级别，默认读取 LOG_LEVEL")
+    parser.add_argument('--status-interval', type=float, default=60, help="每隔多少秒输出一次各房间状态，0 为不输出")
+    args = parser.parse_args()
+
+    collector = Collector(build_config(args.rooms, args.log_level), base_path=args.data_dir)
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    collector.start()
+    collector.logger.log(f"无界面采集已启动，房间: {[manager.room_id for manager in collector.managers]}")
+    next_status = time.monotonic() + args.status_interval
+    # 主线程定时醒来，保证各平台上都能及时处理信号
+    while not stop_event.wait(1.0):
+        if args.status_interval > 0 and time.monotonic() >= next_status:
+            next_status += args.status_interval
+            for status in collector.status():
+                collector.logger.log(f"房间 {status['room']}: 已保存 {status['saved']} 条，文件 {status['file']}，"
+                                     f"待写入 {status['queue_depth']} 条，轮询间隔 {status['poll_interval']:.1f}s")
+
+    collector.logger.log("正在停止采集并刷完写入队列")
+    collector.stop()
+    collector.logger.log("采集已停止")
+
+
+if __name__ == '__main__':
+    main()
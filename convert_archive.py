@@ -0,0 +1,360 @@
+"""旧版文本归档批量转换
+
+cundang.py 和 web.py 写下的 danmaku_<日期>_<n>.txt（每行 [YYYY-MM-DD HH:MM:SS] 昵称: 内容）
+逐行流式解析，不把整个文件读进内存；按文件分给进程池并行处理，写入可选的输出：
+    binary  转成二进制分段（.dmk/.dmkd）和稀疏索引，写到 --output 目录，可直接作为 ARCHIVE_FORMAT=binary 的存储目录，
+            同一天的分段共用一个字典，所以按天分给进程
+    index   只为原文本分段生成稀疏索引（.txt.idx），/history、回放不必再首次扫描
+    sqlite  写入 SQLite 数据库 --output 的 danmaku 表，工作进程只解析，由主进程一个连接写入
+格式不对的行（比如弹幕里带换行）跳过并计数。昵称与内容从第一个 ': ' 切开。完成的文件记在进度文件里，
+中断后重新运行只处理没完成或之后又有追加的文件。结束时输出吞吐量报告。
+
+    python convert_archive.py danmaku_files --to binary --output danmaku_binary --workers 8
+    python convert_archive.py danmaku_files --to sqlite --output danmaku.db --report report.json
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from archive import BINARY_SUFFIX, TEXT_SUFFIX, BinarySegmentWriter, list_segments, segment_sort_key
+from archive_index import INDEX_SUFFIX, SegmentIndex
+
+LINE_PREFIX = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] ')
+SEPARATOR = ': '
+MAX_SAMPLES = 3  # 每个文件最多记录几行格式不对的样例
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> int:
+    """YYYY-MM-DD HH:MM:SS 转为时间线，同一秒只解析一次，日期不合法时抛出 ValueError"""
+    return int(time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S')))
+
+
+class LineParser:
+    """逐行解析文本归档
+
+    内容里出现 ': ' 很常见，昵称里基本不会有，所以一律从第一个 ': ' 切开，
+    一行有多个 ': ' 时只计入 ambiguous，方便在报告里核对。
+    """
+
+    def __init__(self):
+        self.malformed = 0
+        self.ambiguous = 0
+        self.samples: List[str] = []
+
+    def _reject(self, line: str):
+        self.malformed += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(line[:200])
+
+    def parse(self, line: str) -> Optional[Tuple[int, str, str]]:
+        """返回（时间线, 昵称, 内容），格式不对时返回 None"""
+        line = line.rstrip('\r\n')
+        match = LINE_PREFIX.match(line)
+        if not match or SEPARATOR not in line[match.end():]:
+            if line.strip():
+                self._reject(line)
+            return None
+        try:
+            timeline = parse_timestamp(match.group(1))
+        except ValueError:
+            self._reject(line)
+            return None
+
+        nickname, _, text = line[match.end():].partition(SEPARATOR)
+        if SEPARATOR in text:
+            self.ambiguous += 1
+        return timeline, nickname, text
+
+
+def iter_lines(path: Path, parser: LineParser) -> Iterator[Tuple[int, int, str, str]]:
+    """流式读取文本分段，产出（字节偏移, 时间线, 昵称, 内容）"""
+    with open(path, 'rb') as f:
+        offset = 0
+        for raw in f:
+            parsed = parser.parse(raw.decode('utf-8', errors='replace'))
+            if parsed:
+                yield (offset, *parsed)
+            offset += len(raw)
+
+
+class BinaryOutput:
+    """转成二进制分段，同时写出稀疏索引"""
+
+    def __init__(self, source: Path, target: str, every: int):
+        self.path = Path(target) / source.with_suffix(BINARY_SUFFIX).name
+        # 上次中断留下的半成品重新生成，当天的字典只追加，已有的字符串直接复用
+        for stale in (self.path, self.path.with_suffix(BINARY_SUFFIX + INDEX_SUFFIX)):
+            stale.unlink(missing_ok=True)
+        self.writer = BinarySegmentWriter(self.path)
+        self.index = SegmentIndex(self.path)
+        self.every = every
+
+    def write(self, offset: int, timeline: int, nickname: str, text: str):
+        self.index.add(timeline, self.writer.write(timeline, 0, nickname, text, ''), self.every)
+
+    def close(self) -> None:
+        self.writer.close()
+        self.index.save()
+
+
+class IndexOutput:
+    """为原文本分段生成稀疏索引"""
+
+    def __init__(self, source: Path, target: str, every: int):
+        self.index = SegmentIndex(source)
+        self.every = every
+
+    def write(self, offset: int, timeline: int, nickname: str, text: str):
+        self.index.add(timeline, offset, self.every)
+
+    def close(self) -> None:
+        self.index.save()
+
+
+class SqliteOutput:
+    """写入 SQLite，(source, offset) 为主键，重跑时覆盖
+
+    SQLite 同时只能有一个写事务，各进程分别写入只会互相等锁，甚至报 database is locked。
+    所以工作进程只把解析出的行带回来，由主进程用一个连接逐个文件写入，每个文件一个事务。
+    """
+
+    SCHEMA = '''CREATE TABLE IF NOT EXISTS danmaku (
+        source TEXT NOT NULL,
+        offset INTEGER NOT NULL,
+        timeline INTEGER NOT NULL,
+        uid INTEGER NOT NULL DEFAULT 0,
+        nickname TEXT NOT NULL,
+        text TEXT NOT NULL,
+        face TEXT NOT NULL DEFAULT '',
+        PRIMARY KEY (source, offset)
+    ) WITHOUT ROWID'''
+
+    def __init__(self, source: Path, target: str, every: int):
+        self.rows: List[tuple] = []
+
+    def write(self, offset: int, timeline: int, nickname: str, text: str):
+        self.rows.append((offset, timeline, nickname, text))
+
+    def close(self) -> List[tuple]:
+        """工作进程里调用，返回要带回主进程的行"""
+        return self.rows
+
+    @classmethod
+    def prepare(cls, target: str) -> sqlite3.Connection:
+        """在主进程里建表，返回之后写入用的连接，WAL 模式让写入时读者不被阻塞"""
+        conn = sqlite3.connect(target)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(cls.SCHEMA)
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def store(conn: sqlite3.Connection, source: str, rows: List[tuple]):
+        """在主进程里把一个文件的行写进一个事务，先删掉这个文件上次写入的"""
+        with conn:
+            conn.execute('DELETE FROM danmaku WHERE source = ?', (source,))
+            conn.executemany('INSERT INTO danmaku (source, offset, timeline, nickname, text) VALUES (?, ?, ?, ?, ?)',
+                             ((source, *row) for row in rows))
+
+    @staticmethod
+    def finish(conn: sqlite3.Connection):
+        with conn:
+            conn.execute('CREATE INDEX IF NOT EXISTS danmaku_timeline ON danmaku (timeline)')
+        conn.close()
+
+
+OUTPUTS = {
+    'binary': BinaryOutput,
+    'index': IndexOutput,
+    'sqlite': SqliteOutput,
+}
+
+
+def convert_file(source: str, output: str, target: str, every: int) -> dict:
+    """在工作进程里转换一个文件，返回统计，需要主进程写入的行放在 rows 里"""
+    path = Path(source)
+    started = time.perf_counter()
+    parser = LineParser()
+    sink = OUTPUTS[output](path, target, every)
+    records = 0
+    try:
+        for offset, timeline, nickname, text in iter_lines(path, parser):
+            sink.write(offset, timeline, nickname, text)
+            records += 1
+    finally:
+        rows = sink.close()
+    return {
+        'rows': rows,
+        'records': records,
+        'malformed': parser.malformed,
+        'ambiguous': parser.ambiguous,
+        'samples': parser.samples,
+        'seconds': round(time.perf_counter() - started, 4),
+    }
+
+
+def convert_group(sources: List[str], output: str, target: str, every: int) -> List[dict]:
+    """在工作进程里按顺序转换一组文件，某个文件出错时在对应位置返回 {'error': 原因}"""
+    results = []
+    for source in sources:
+        try:
+            results.append(convert_file(source, output, target, every))
+        except Exception as e:
+            results.append({'error': str(e)})
+    return results
+
+
+def file_signature(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_progress(path: Path) -> Dict[str, dict]:
+    """读取进度文件，每行一个已完成文件，后写的覆盖先写的，末尾写了一半的行忽略"""
+    done = {}
+    if not path.exists():
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            done[entry['file']] = entry
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="旧版文本归档批量转换")
+    parser.add_argument('source', type=Path, help="存放 danmaku_<日期>_<n>.txt 的目录")
+    parser.add_argument('--to', choices=sorted(OUTPUTS), default='binary', help="输出类型")
+    parser.add_argument('--output', help="binary 为输出目录，sqlite 为数据库文件，index 不需要")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--every', type=int, default=64, help="稀疏索引每隔多少条记一个检查点，与 INDEX_EVERY 一致")
+    parser.add_argument('--progress', type=Path, help="进度文件，默认放在输出旁边")
+    parser.add_argument('--restart', action='store_true', help="忽略已有进度，全部重新转换")
+    parser.add_argument('--report', type=Path, help="把吞吐量报告另存为 JSON")
+    args = parser.parse_args()
+
+    if args.to != 'index' and not args.output:
+        parser.error(f"--to {args.to} 需要 --output")
+    target = str(Path(args.output).resolve()) if args.output else ''
+    conn = None
+    if args.to == 'binary':
+        Path(target).mkdir(parents=True, exist_ok=True)
+    elif args.to == 'sqlite':
+        conn = SqliteOutput.prepare(target)
+    progress_path = args.progress or (
+        Path(target) / '.convert.progress' if args.to == 'binary'
+        else Path(target + '.progress') if args.to == 'sqlite'
+        else args.source / '.convert_index.progress')
+    if args.restart:
+        progress_path.unlink(missing_ok=True)
+
+    files = [path for path in list_segments(args.source) if path.suffix == TEXT_SUFFIX]
+    done = load_progress(progress_path)
+    todo = []
+    for path in files:
+        size, mtime_ns = file_signature(path)
+        entry = done.get(path.name)
+        # 仍在追加的当天文件大小会变，需要重新转换
+        if entry is None or entry.get('size') != size or entry.get('mtime_ns') != mtime_ns:
+            todo.append((path, size, mtime_ns))
+    # binary 同一天的分段共用一个字典，只能在一个进程里按顺序写
+    groups: Dict[str, list] = {}
+    for item in todo:
+        key = segment_sort_key(item[0])[0] if args.to == 'binary' else item[0].name
+        groups.setdefault(key, []).append(item)
+    for group in groups.values():
+        group.sort(key=lambda item: segment_sort_key(item[0]))
+    # 大的先开始，尾部不会剩一个大文件拖时间
+    batches = sorted(groups.values(), key=lambda group: sum(size for _, size, _ in group), reverse=True)
+    total_bytes = sum(size for _, size, _ in todo)
+    print(f"共 {len(files)} 个文本分段，已完成 {len(files) - len(todo)} 个，"
+          f"本次转换 {len(todo)} 个（{total_bytes / 1e6:.1f} MB），{args.workers} 个进程")
+
+    totals = {'files': 0, 'records': 0, 'malformed': 0, 'ambiguous': 0, 'bytes': 0, 'failed': 0}
+    samples: List[str] = []
+    started = time.perf_counter()
+    last_report = started
+    # 在途的任务数有上限，sqlite 带回的行不会在主进程里越积越多
+    max_pending = args.workers * 2
+    queued = iter(batches)
+    pending = {}
+    with open(progress_path, 'a', encoding='utf-8') as progress, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor:
+        while True:
+            for group in islice(queued, max_pending - len(pending)):
+                sources = [str(path) for path, _, _ in group]
+                pending[executor.submit(convert_group, sources, args.to, target, args.every)] = group
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                group = pending.pop(future)
+                try:
+                    results = future.result()
+                except Exception as e:
+                    results = [{'error': str(e)}] * len(group)
+                for (path, size, mtime_ns), stats in zip(group, results):
+                    try:
+                        if 'error' in stats:
+                            raise RuntimeError(stats['error'])
+                        if conn is not None:
+                            SqliteOutput.store(conn, path.name, stats['rows'])
+                    except Exception as e:
+                        totals['failed'] += 1
+                        print(f"转换 {path.name} 出错: {e}", file=sys.stderr)
+                        continue
+                    totals['files'] += 1
+                    totals['bytes'] += size
+                    for key in ('records', 'malformed', 'ambiguous'):
+                        totals[key] += stats[key]
+                    samples.extend(f"{path.name}: {line}"
+                                   for line in stats['samples'][:max(MAX_SAMPLES - len(samples), 0)])
+                    progress.write(json.dumps({'file': path.name, 'size': size, 'mtime_ns': mtime_ns,
+                                               'records': stats['records'], 'malformed': stats['malformed']},
+                                              ensure_ascii=False) + '\n')
+                    progress.flush()
+
+                    now = time.perf_counter()
+                    if now - last_report >= 2 or totals['files'] + totals['failed'] == len(todo):
+                        last_report = now
+                        elapsed = max(now - started, 1e-9)
+                        print(f"[{totals['files']}/{len(todo)}] {totals['records']} 条，"
+                              f"{totals['records'] / elapsed:.0f} 条/秒，{totals['bytes'] / elapsed / 1e6:.1f} MB/秒")
+
+    if conn is not None:
+        SqliteOutput.finish(conn)
+    elapsed = time.perf_counter() - started
+    report = {
+        **totals,
+        'output': args.to,
+        'workers': args.workers,
+        'seconds': round(elapsed, 3),
+        'records_per_second': round(totals['records'] / elapsed) if elapsed > 0 else 0,
+        'mb_per_second': round(totals['bytes'] / elapsed / 1e6, 2) if elapsed > 0 else 0,
+        'malformed_samples': samples,
+    }
+    print(f"完成：{totals['files']} 个文件，{totals['records']} 条弹幕，跳过 {totals['malformed']} 行格式不对的，"
+          f"{totals['ambiguous']} 行含多个 ': '，失败 {totals['failed']} 个文件；"
+          f"用时 {elapsed:.1f} 秒，{report['records_per_second']} 条/秒，{report['mb_per_second']} MB/秒")
+    for line in samples:
+        print(f"  格式不对: {line}")
+    if args.report:
+        args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    sys.exit(1 if totals['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
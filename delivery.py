@@ -0,0 +1,228 @@
+"""逐客户端推送队列
+
+Socket.IO 按房间推送时只是把数据包放进每个连接的 Engine.IO 发送队列，
+网络差的客户端（比如连着糟糕 Wi-Fi 的笔记本）收得慢，这个队列就无限增长，
+延迟越积越大，内存也跟着涨。这里给每个客户端一个有界的待发队列：
+推送方（BatchEmitter、StatsPusher）只把事件编码一次放进房间内每个客户端的队列，
+投递线程只在连接自己的发送队列基本清空后才放入下一个包，慢客户端积压超出上限时按溢出策略处理，
+不影响其它客户端，也不会拖慢采集。
+
+溢出策略：
+    drop_oldest  丢弃最旧的包
+    collapse     把积压的弹幕合并成一个 danmaku_batch，只保留最新 N 条
+    disconnect   断开连接，前端自动重连后从最新的弹幕开始接收
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from engineio import packet as eio_packet
+from socketio import packet as sio_packet
+
+import metrics
+
+POLICIES = ('drop_oldest', 'collapse', 'disconnect')
+
+
+class Outgoing:
+    """一个待发事件，编码结果在所有客户端之间共用"""
+
+    __slots__ = ('event', 'data', 'count', 'created', 'packets')
+
+    def __init__(self, event: str, data, packets: list, created: Optional[float] = None):
+        self.event = event
+        self.data = data
+        self.count = len(data) if event == 'danmaku_batch' else 1
+        self.created = created if created is not None else time.monotonic()
+        self.packets = packets
+
+    def messages(self) -> list:
+        return self.data if self.event == 'danmaku_batch' else [self.data]
+
+
+class ClientChannel:
+    """单个客户端的待发队列和投递统计"""
+
+    def __init__(self, sid: str, eio_sid: str):
+        self.sid = sid
+        self.eio_sid = eio_sid
+        self.pending: deque = deque()
+        self.sent = 0  # 已交给连接的条数
+        self.dropped = 0  # 因积压丢弃的条数
+        self.overflows = 0
+        self.connected_at = time.time()
+        self.closing = False
+
+    def lag(self, now: float) -> float:
+        """最旧的待发数据已经等了多久（秒）"""
+        return now - self.pending[0].created if self.pending else 0.0
+
+
+class DeliveryHub:
+    """按客户端排队投递，emit 的用法与 SocketIO.emit 相同，可直接交给 BatchEmitter、StatsPusher"""
+
+    TICK = 0.02  # 有积压但连接发送队列已满时的重试间隔（秒）
+
+    def __init__(self, socketio, max_pending: int = 200, policy: str = 'drop_oldest', collapse_keep: int = 100,
+                 max_in_flight: int = 4, namespace: str = '/', logger=None):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        self.server = socketio.server
+        self.max_pending = max_pending
+        self.policy = policy
+        self.collapse_keep = collapse_keep
+        self.max_in_flight = max_in_flight
+        self.namespace = namespace
+        self.logger = logger
+        self._dropped = metrics.DELIVERY_DROPPED.labels(policy)
+        self._channels: Dict[str, ClientChannel] = {}
+        self._cond = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='danmaku-delivery')
+
+    def start(self):
+        """启动投递线程"""
+        self._thread.start()
+
+    def stop(self):
+        """停止投递线程，未发出的数据随连接一起丢弃"""
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _log(self, message: str):
+        if self.logger:
+            self.logger.log(message)
+
+    def _encode(self, event: str, data) -> list:
+        """按 Socket.IO 协议编码成 Engine.IO 数据包"""
+        encoded = self.server.packet_class(sio_packet.EVENT, namespace=self.namespace, data=[event, data]).encode()
+        if not isinstance(encoded, list):
+            encoded = [encoded]
+        return [eio_packet.Packet(eio_packet.MESSAGE, part) for part in encoded]
+
+    def emit(self, event: str, data, to: Optional[str] = None):
+        """放入房间内每个客户端的待发队列，立即返回；to 为空时发给所有客户端"""
+        item = Outgoing(event, data, self._encode(event, data))
+        with self._cond:
+            for sid, eio_sid in self.server.manager.get_participants(self.namespace, to):
+                channel = self._channels.get(sid)
+                if channel is None:
+                    channel = self._channels[sid] = ClientChannel(sid, eio_sid)
+                if channel.closing:
+                    continue
+                channel.pending.append(item)
+                if len(channel.pending) > self.max_pending:
+                    self._overflow(channel)
+            self._cond.notify()
+
+    def register(self, sid: str):
+        """客户端连接时建立队列，还没收到推送的客户端也出现在统计里"""
+        eio_sid = self.server.manager.eio_sid_from_sid(sid, self.namespace)
+        if eio_sid is None:
+            return
+        with self._cond:
+            self._channels.setdefault(sid, ClientChannel(sid, eio_sid))
+
+    def unregister(self, sid: str):
+        """客户端断开时丢弃它的队列"""
+        with self._cond:
+            self._channels.pop(sid, None)
+
+    def _overflow(self, channel: ClientChannel):
+        """积压超出上限，按策略处理（持有锁时调用）"""
+        if self.policy == 'drop_oldest':
+            dropped = channel.pending.popleft().count
+        elif self.policy == 'collapse':
+            dropped = self._collapse(channel)
+        else:
+            dropped = sum(item.count for item in channel.pending)
+            channel.pending.clear()
+            channel.closing = True
+        channel.overflows += 1
+        channel.dropped += dropped
+        self._dropped.inc(dropped)
+
+    def _collapse(self, channel: ClientChannel) -> int:
+        """弹幕合并成一个批次只留最新 collapse_keep 条，其它事件每种只留最新一个，返回丢弃的条数"""
+        messages = []
+        latest_other: Dict[str, Outgoing] = {}
+        for item in channel.pending:
+            if item.event in ('danmaku', 'danmaku_batch'):
+                messages.extend((item.created, message) for message in item.messages())
+            else:
+                latest_other.pop(item.event, None)
+                latest_other[item.event] = item
+        kept = messages[-self.collapse_keep:] if self.collapse_keep > 0 else []
+        before = sum(item.count for item in channel.pending)
+        channel.pending = deque(latest_other.values())
+        if kept:
+            batch = [message for _, message in kept]
+            # 延迟按保留下来的最旧一条计算
+            channel.pending.append(Outgoing('danmaku_batch', batch, self._encode('danmaku_batch', batch), kept[0][0]))
+        return before - sum(item.count for item in channel.pending)
+
+    def _backlog(self, eio_sid: str) -> int:
+        """连接的 Engine.IO 发送队列里还有多少包没发出去"""
+        socket = self.server.eio.sockets.get(eio_sid)
+        if socket is None:
+            return self.max_in_flight  # 正在断开
+        return socket.queue.qsize()
+
+    def _run(self):
+        """投递主循环：只给发送队列有空位的连接放包，慢连接的积压留在自己的待发队列里"""
+        while not self._stop_event.is_set():
+            ready = []
+            closing = []
+            with self._cond:
+                if not self._channels or not any(channel.pending or channel.closing
+                                                 for channel in self._channels.values()):
+                    self._cond.wait(1.0)
+                for channel in list(self._channels.values()):
+                    if channel.closing:
+                        closing.append(self._channels.pop(channel.sid))
+                        continue
+                    free = self.max_in_flight - self._backlog(channel.eio_sid)
+                    while channel.pending and free > 0:
+                        item = channel.pending.popleft()
+                        channel.sent += item.count
+                        ready.append((channel.eio_sid, item))
+                        free -= 1
+
+            for eio_sid, item in ready:
+                for packet in item.packets:
+                    try:
+                        self.server.eio.send_packet(eio_sid, packet)
+                    except Exception:
+                        break  # 连接已关闭，由 disconnect 事件清理
+            for channel in closing:
+                self._log(f"客户端 {channel.sid} 积压超出 {self.max_pending} 个包，断开连接")
+                socket = self.server.eio.sockets.get(channel.eio_sid)
+                try:
+                    if socket is not None:
+                        socket.close(wait=False)  # 不等发送队列清空，否则会被卡住的客户端拖住
+                except Exception as e:
+                    self._log(f"断开客户端出错: {e}")
+            if not ready and not closing:
+                self._stop_event.wait(self.TICK)
+
+    def stats(self) -> List[dict]:
+        """每个客户端的积压和延迟，按延迟从大到小排列"""
+        now = time.monotonic()
+        with self._cond:
+            clients = [{
+                'sid': channel.sid,
+                'pending': len(channel.pending),
+                'pending_messages': sum(item.count for item in channel.pending),
+                'in_flight': self._backlog(channel.eio_sid),
+                'lag_seconds': round(channel.lag(now), 3),
+                'sent': channel.sent,
+                'dropped': channel.dropped,
+                'overflows': channel.overflows,
+                'connected_seconds': round(time.time() - channel.connected_at),
+            } for channel in self._channels.values()]
+        clients.sort(key=lambda client: client['lag_seconds'], reverse=True)
+        return clients
@@ -0,0 +1,163 @@
+"""Socket.IO 消息队列
+
+多个 Web 进程共同服务前端时，采集进程的推送要经过消息队列转发给每个进程。
+生产环境可以直接用 Redis（redis://）或 Kombu 支持的 AMQP 等（amqp://）；
+单机测试用这里的本地替身：fanout:// 指向一个极简的 TCP 广播服务器，
+每个连接发来的一行 JSON 会原样转发给其它所有连接。
+
+    python fanout_queue.py --port 6380
+"""
+import argparse
+import queue
+import socket
+import socketserver
+import threading
+import time
+from typing import Optional, Set
+from urllib.parse import urlparse
+
+import socketio
+
+DEFAULT_PORT = 6380
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """一个订阅/发布连接：读到的每一行广播给其它连接，写出由独立线程完成"""
+
+    def setup(self):
+        super().setup()
+        self.outbox: queue.Queue = queue.Queue(maxsize=self.server.max_pending)
+        self.closed = threading.Event()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        self.server.add(self)
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                self.server.broadcast(line, self)
+
+    def finish(self):
+        self.server.remove(self)
+        self.closed.set()
+        self.outbox.put(None)
+        super().finish()
+
+    def _write_loop(self):
+        while True:
+            line = self.outbox.get()
+            if line is None:
+                return
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def send(self, line: bytes):
+        """放入发送队列，慢消费者队列满时丢弃"""
+        try:
+            self.outbox.put_nowait(line)
+        except queue.Full:
+            self.server.dropped += 1
+
+
+class FanoutBroker(socketserver.ThreadingTCPServer):
+    """本地广播服务器"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = DEFAULT_PORT, max_pending: int = 10000):
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._clients: Set[_BrokerHandler] = set()
+        self._lock = threading.Lock()
+        super().__init__((host, port), _BrokerHandler)
+
+    def add(self, client: _BrokerHandler):
+        with self._lock:
+            self._clients.add(client)
+
+    def remove(self, client: _BrokerHandler):
+        with self._lock:
+            self._clients.discard(client)
+
+    def broadcast(self, line: bytes, sender: Optional[_BrokerHandler] = None):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            if client is not sender:
+                client.send(line)
+
+
+class LocalFanoutManager(socketio.PubSubManager):
+    """接 fanout:// 本地广播服务器的 Socket.IO 客户端管理器"""
+
+    name = 'fanout'
+
+    def __init__(self, url: str = f'fanout://127.0.0.1:{DEFAULT_PORT}', channel: str = 'socketio',
+                 write_only: bool = False, logger=None):
+        parsed = urlparse(url)
+        self.address = (parsed.hostname or '127.0.0.1', parsed.port or DEFAULT_PORT)
+        self._publisher: Optional[socket.socket] = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        line = (self.json.dumps({'channel': self.channel, 'data': data}) + '\n').encode('utf-8')
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = socket.create_connection(self.address, timeout=5)
+                    self._publisher.sendall(line)
+                    return
+                except OSError as e:
+                    self._publisher = None
+                    if attempt:
+                        self._get_logger().error(f"推送到广播服务器失败: {e}")
+
+    def _listen(self):
+        retry = 1
+        while True:
+            try:
+                with socket.create_connection(self.address) as conn:
+                    retry = 1
+                    for line in conn.makefile('rb'):
+                        message = self.json.loads(line)
+                        if message.get('channel') == self.channel:
+                            yield message['data']
+            except OSError as e:
+                self._get_logger().error(f"连接广播服务器失败，{retry} 秒后重试: {e}")
+            time.sleep(retry)
+            retry = min(retry * 2, 30)
+
+
+def make_client_manager(url: str, channel: str = 'socketio', write_only: bool = False):
+    """按地址选择 Socket.IO 消息队列：fanout:// 本地替身，redis:// Redis，其它交给 Kombu"""
+    scheme = urlparse(url).scheme
+    if scheme == 'fanout':
+        return LocalFanoutManager(url, channel=channel, write_only=write_only)
+    if scheme in ('redis', 'rediss', 'unix'):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO 本地广播服务器")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    broker = FanoutBroker(args.host, args.port)
+    print(f"广播服务器: fanout://{args.host}:{args.port}")
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""屏蔽词过滤
+
+把词表建成 Aho-Corasick 自动机，每条弹幕只扫一遍，耗时与屏蔽词数量无关。
+词表文件每行一个词，可以用制表符隔开写上处理方式，没写的用默认处理方式，# 开头的行为注释：
+    广告
+    加群\tdrop
+    剧透\ttag
+
+处理方式：
+    drop  丢弃，不存档也不推送
+    mask  命中的部分替换成 *
+    tag   原样保留，推送时带上 tags 字段，由前端决定如何显示
+
+后台线程定时检查词表文件的修改时间，变化后在该线程里重建自动机，
+建好后整体替换引用，采集线程始终拿到一个完整的自动机，不需要加锁，也不用重启。
+"""
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+ACTIONS = ('drop', 'mask', 'tag')
+
+
+class Automaton:
+    """Aho-Corasick 自动机，建好后只读"""
+
+    __slots__ = ('goto', 'fail', 'outputs', 'size')
+
+    def __init__(self, patterns: Dict[str, str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        # 每个状态结束的所有词（长度, 处理方式, 词），已沿失败链合并
+        self.outputs: List[Tuple[Tuple[int, str, str], ...]] = [()]
+        for word, action in patterns.items():
+            node = 0
+            for char in word:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.outputs.append(())
+                node = child
+            self.outputs[node] = ((len(word), action, word),)
+        self.size = len(patterns)
+
+        self.fail = [0] * len(self.goto)
+        pending = deque(self.goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for char, child in self.goto[node].items():
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.outputs[child] += self.outputs[self.fail[child]]
+                pending.append(child)
+
+    def search(self, text: str) -> List[Tuple[int, int, str, str]]:
+        """返回所有命中（起点, 终点, 处理方式, 词），遇到 drop 立即返回"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        hits = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, action, word in outputs[node]:
+                hits.append((end - length, end, action, word))
+                if action == 'drop':
+                    return hits
+        return hits
+
+
+def load_patterns(path: Path, default_action: str) -> Dict[str, str]:
+    """读取词表，词统一转成小写"""
+    patterns = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            word, _, action = line.partition('\t')
+            word = word.strip().lower()
+            action = action.strip().lower() or default_action
+            if word and action in ACTIONS:
+                patterns[word] = action
+    return patterns
+
+
+class KeywordFilter:
+    """屏蔽词过滤器，多个房间共用一个，词表文件变化后自动重新加载"""
+
+    def __init__(self, path: str, default_action: str = 'mask', reload_interval: float = 2.0,
+                 mask_char: str = '*', logger=None):
+        if default_action not in ACTIONS:
+            raise ValueError(f"未知的处理方式: {default_action}")
+        self.path = Path(path)
+        self.default_action = default_action
+        self.reload_interval = reload_interval
+        self.mask_char = mask_char
+        self.logger = logger
+        self.automaton = Automaton({})
+        self._signature: Optional[Tuple[int, int]] = None
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='keyword-filter')
+        self.reload()
+
+    def start(self):
+        """启动词表监视线程"""
+        if self.reload_interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _log(self, message: str):
+        if self.logger:
+            self.logger.log(message)
+
+    def reload(self) -> bool:
+        """词表文件有变化时重建自动机并替换，返回是否替换了"""
+        try:
+            stat = self.path.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature:
+            return False
+        try:
+            patterns = load_patterns(self.path, self.default_action) if signature else {}
+            automaton = Automaton(patterns)
+        except Exception as e:
+            self._log(f"加载屏蔽词表 {self.path} 出错，继续使用旧词表: {e}")
+            return False
+        self._signature = signature
+        self.automaton = automaton  # 整体替换引用，正在过滤的弹幕用完旧的自动机
+        metrics.FILTER_PATTERNS.labels().set(automaton.size)
+        self._log(f"已加载屏蔽词表 {self.path}，共 {automaton.size} 个词")
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.reload_interval):
+            self.reload()
+
+    def check(self, text: str) -> Tuple[Optional[str], Tuple[str, ...], List[Tuple[int, int, str, str]]]:
+        """过滤一条弹幕内容，返回（处理后的内容，命中 drop 时为 None；tag 命中的词；全部命中）"""
+        automaton = self.automaton
+        if not automaton.size:
+            return text, (), []
+        lowered = text.lower()
+        # 极少数字符转小写后长度会变，这时按原文匹配，保证下标对得上
+        hits = automaton.search(lowered if len(lowered) == len(text) else text)
+        if not hits:
+            return text, (), []
+        if hits[-1][2] == 'drop':
+            return None, (), hits
+        masked = None
+        tags = []
+        for start, end, action, word in hits:
+            if action == 'mask':
+                if masked is None:
+                    masked = list(text)
+                masked[start:end] = self.mask_char * (end - start)
+            elif word not in tags:
+                tags.append(word)
+        return (''.join(masked) if masked is not None else text), tuple(tags), hits
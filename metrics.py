@@ -0,0 +1,248 @@
+"""进程内指标，按 Prometheus 文本格式输出
+
+计数器和直方图的子项按标签值缓存，热路径上只有一次加锁加法；
+队列长度这类瞬时值用 GaugeFunc 在抓取时现算，平时没有开销。
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values) -> object:
+        """按标签值取子项，同一组标签只创建一次"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def set(self, value: float):
+        self.value = value
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class GaugeFunc(_Metric):
+    """抓取时调用函数求值的瞬时值，函数返回 {标签值元组: 数值}"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str],
+                 func: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, help_text, labelnames)
+        self.func = func
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in sorted(self.func().items()):
+            values = tuple(str(value) for value in values)
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        position = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> dict:
+        """条数、总和、均值，以及分位数所在分桶的上界"""
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        count = sum(counts)
+        result = {'count': count, 'sum': total, 'mean': total / count if count else 0.0}
+        for q in quantiles:
+            target, cumulative = q * count, 0
+            bound = 0.0
+            for bound, bucket in zip(self.bounds + (float('inf'),), counts):
+                cumulative += bucket
+                if count and cumulative >= target:
+                    break
+            result[f"p{q * 100:g}"] = bound
+        return result
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """计时一段代码，单位秒"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """注册指标，同名指标已存在时返回已有的那个"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_func(self, name: str, help_text: str, labelnames: Sequence[str],
+                   func: Callable[[], Dict[Tuple[str, ...], float]]) -> GaugeFunc:
+        """抓取时求值的指标，重复注册时用新函数替换旧的"""
+        metric = GaugeFunc(name, help_text, labelnames, func)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+POLL_SECONDS = REGISTRY.histogram('danmaku_poll_seconds', 'gethistory 请求耗时', ['room'])
+JSON_DECODE_SECONDS = REGISTRY.histogram('danmaku_json_decode_seconds', 'gethistory 响应 JSON 解析耗时', ['room'])
+POLL_ERRORS = REGISTRY.counter('danmaku_poll_errors_total', '轮询出错次数', ['room'])
+MESSAGES = REGISTRY.counter('danmaku_messages_total', '收到的弹幕条数，result 为 new 或 duplicate', ['room', 'result'])
+DEDUP_SECONDS = REGISTRY.histogram('danmaku_dedup_seconds', '单条弹幕去重耗时', ['room'])
+STORE_SECONDS = REGISTRY.histogram('danmaku_store_seconds', '单条弹幕放入写入队列的耗时', ['room'])
+EMIT_SECONDS = REGISTRY.histogram('danmaku_emit_seconds', '单条弹幕放入推送队列的耗时', ['room'])
+WRITE_BATCH_SECONDS = REGISTRY.histogram('danmaku_write_batch_seconds', '写入线程写一批弹幕的耗时（含刷盘）', ['room'])
+FLUSH_SECONDS = REGISTRY.histogram('danmaku_flush_seconds', '写入线程每批刷盘（分段、索引、去重日志）的耗时', ['room'])
+WRITE_BATCH_SIZE = REGISTRY.histogram('danmaku_write_batch_size', '每批写入的弹幕条数', ['room'],
+                                      buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+EMIT_FLUSH_SECONDS = REGISTRY.histogram('danmaku_emit_flush_seconds', '批量推送一次的耗时')
+CONNECTED_CLIENTS = REGISTRY.gauge('danmaku_connected_clients', '当前连接的 Socket.IO 客户端数')
+DELIVERY_DROPPED = REGISTRY.counter('danmaku_delivery_dropped_total', '慢客户端积压超出上限时丢弃的弹幕条数', ['policy'])
+FILTER_SECONDS = REGISTRY.histogram('danmaku_filter_seconds', '单条弹幕屏蔽词过滤耗时', ['room'])
+FILTER_ACTIONS = REGISTRY.counter('danmaku_filter_actions_total', '命中屏蔽词的弹幕条数，action 为 drop、mask 或 tag', ['room', 'action'])
+FILTER_PATTERNS = REGISTRY.gauge('danmaku_filter_patterns', '当前生效的屏蔽词个数')
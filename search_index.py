@@ -0,0 +1,384 @@
+"""归档弹幕的增量全文索引
+
+弹幕以中文为主，按小写后的字符二元组（末尾补 \\0，单字查询也能命中）建立倒排表，
+倒排项为 (分段号 << 40) | 记录偏移。新写入的弹幕先进内存，攒够 run_size 条倒排项
+后写成一个不可变的 run 文件；run 文件超过 merge_factor 个时在后台线程把最新的几个合并，写入线程不等合并。
+查询只把各 run 的词表放在内存里，倒排表通过 mmap 从新到旧逐条解码、边读边求交，
+调用方拿够条数就停，候选记录回到归档中核对原文。合并掉的 run 等正在读它的查询结束后才关闭删除。
+state.json 记录已写入 run 的最后一条记录，启动后写入线程在两批写入之间从那里一小段一小段地补建，
+一直追到归档末尾，之后新弹幕直接进索引。
+
+run 文件布局：
+    DSI2 | 词条数 u32 | 倒排区起始 u64
+    词表：按词排序，每项 varint 词长 + 词 + varint 倒排区内偏移 + varint 条数
+    倒排区：每个词的倒排项降序（从新到旧），第一项原值，之后 varint 差值编码
+"""
+import bisect
+import heapq
+import json
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from archive import decode_varint, encode_varint, iter_segment, list_segments
+
+MAGIC = b'DSI2'
+HEADER = struct.Struct('>4sIQ')
+OFFSET_BITS = 40
+OFFSET_MASK = (1 << OFFSET_BITS) - 1
+
+
+def ngrams(text: str) -> Set[str]:
+    """文本的字符二元组集合"""
+    text = text.casefold() + '\0'
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _encode_postings(postings: List[int]) -> bytes:
+    """升序倒排表按从新到旧写出"""
+    out = bytearray()
+    previous = None
+    for value in reversed(postings):
+        out += encode_varint(value if previous is None else previous - value)
+        previous = value
+    return bytes(out)
+
+
+def _unique(postings: Iterable[int]) -> Iterator[int]:
+    """去掉有序流里相邻的重复项"""
+    previous = None
+    for posting in postings:
+        if posting != previous:
+            yield posting
+            previous = posting
+
+
+def _intersect(streams: List[Iterator[int]]) -> Iterator[int]:
+    """多个降序流逐条求交，谁领先就让谁往后跳"""
+    if len(streams) == 1:
+        yield from streams[0]
+        return
+    try:
+        heads = [next(stream) for stream in streams]
+        while True:
+            target = min(heads)
+            for i, stream in enumerate(streams):
+                while heads[i] > target:
+                    heads[i] = next(stream)
+            if max(heads) == target:
+                yield target
+                heads = [next(stream) for stream in streams]
+    except StopIteration:
+        return
+
+
+def _write_run(path: Path, terms: Dict[str, List[int]]):
+    """把 词 -> 升序倒排表 写成 run 文件"""
+    table = bytearray()
+    blob = bytearray()
+    for term in sorted(terms):
+        postings = terms[term]
+        encoded = term.encode('utf-8')
+        table += encode_varint(len(encoded)) + encoded + encode_varint(len(blob)) + encode_varint(len(postings))
+        blob += _encode_postings(postings)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(terms), HEADER.size + len(table)))
+        f.write(table)
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+
+class _Run:
+    """一个只读 run 文件：词表常驻内存，倒排表按需从 mmap 解码
+
+    readers 和 retired 由 SearchIndex 在锁内维护：合并后 retired 置位，readers 归零时才关闭删除。
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.terms: List[str] = []
+        self.locations: List[Tuple[int, int]] = []
+        self.readers = 0
+        self.retired = False
+        with open(path, 'rb') as f:
+            magic, term_count, self.postings_start = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} 不是弹幕索引文件")
+            table = f.read(self.postings_start - HEADER.size)
+            self._file = open(path, 'rb')
+        pos = 0
+        for _ in range(term_count):
+            length, pos = decode_varint(table, pos)
+            self.terms.append(table[pos:pos + length].decode('utf-8'))
+            pos += length
+            offset, pos = decode_varint(table, pos)
+            count, pos = decode_varint(table, pos)
+            self.locations.append((offset, count))
+        self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def iter_postings(self, term: str) -> Iterator[int]:
+        """从新到旧逐条产出 term 的倒排项"""
+        position = bisect.bisect_left(self.terms, term)
+        if position == len(self.terms) or self.terms[position] != term:
+            return iter(())
+        return self._iter_descending(*self.locations[position])
+
+    def prefix_terms(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + '\U0010ffff')
+        return self.terms[start:end]
+
+    def _iter_descending(self, offset: int, count: int) -> Iterator[int]:
+        pos = self.postings_start + offset
+        value = None
+        for _ in range(count):
+            delta, pos = decode_varint(self._buf, pos)
+            value = delta if value is None else value - delta
+            yield value
+
+    def items(self) -> Iterator[Tuple[str, List[int]]]:
+        """按词产出升序倒排表，供合并使用"""
+        for term, location in zip(self.terms, self.locations):
+            postings = list(self._iter_descending(*location))
+            postings.reverse()
+            yield term, postings
+
+    def close(self):
+        self._buf.close()
+        self._file.close()
+
+
+class SearchIndex:
+    """一个存储目录的全文索引
+
+    写入线程调用 catch_up_step/add/flush/close，查询线程调用 candidates，合并在单独的线程里进行，
+    内存部分和 run 列表用锁保护。
+    """
+
+    STATE_FILE = 'state.json'
+    SEGMENTS_FILE = 'segments.txt'
+
+    def __init__(self, folder: Path, storage_folder: Path, run_size: int = 200000, merge_factor: int = 8):
+        self.folder = folder
+        self.storage_folder = storage_folder
+        self.run_size = run_size
+        self.merge_factor = merge_factor
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()  # 写入线程和合并线程都会写 state.json
+        self._merging: Optional[threading.Thread] = None
+        self._memory: Dict[str, List[int]] = {}
+        self._memory_postings = 0
+        self._last: Optional[Tuple[str, int]] = None  # 已添加的最后一条（分段文件名, 偏移）
+        self.caught_up = False  # 补建是否已追到归档末尾，之前写入线程不直接 add 新弹幕
+        self.caught_up_added = 0
+
+        self._segment_names: List[str] = []
+        self._segment_ids: Dict[str, int] = {}
+        segments_path = self.folder / self.SEGMENTS_FILE
+        if segments_path.exists():
+            for name in segments_path.read_text(encoding='utf-8').splitlines():
+                if name:
+                    self._segment_ids[name] = len(self._segment_names)
+                    self._segment_names.append(name)
+
+        state = {'runs': [], 'next_run': 0, 'last': None}
+        state_path = self.folder / self.STATE_FILE
+        if state_path.exists():
+            state = json.loads(state_path.read_text(encoding='utf-8'))
+        self._next_run = state['next_run']
+        self._durable_last = tuple(state['last']) if state['last'] else None
+        self._runs = [_Run(self.folder / name) for name in state['runs'] if (self.folder / name).exists()]
+
+    # ------------------------------------------------------------ 写入
+
+    def _segment_id(self, name: str) -> int:
+        segment_id = self._segment_ids.get(name)
+        if segment_id is None:
+            segment_id = len(self._segment_names)
+            self._segment_ids[name] = segment_id
+            self._segment_names.append(name)
+            with open(self.folder / self.SEGMENTS_FILE, 'a', encoding='utf-8') as f:
+                f.write(f"{name}\n")
+        return segment_id
+
+    def add(self, segment_path: Path, offset: int, text: str):
+        """索引一条刚写入归档的弹幕"""
+        posting = (self._segment_id(segment_path.name) << OFFSET_BITS) | offset
+        terms = ngrams(text)
+        with self._lock:
+            for term in terms:
+                self._memory.setdefault(term, []).append(posting)
+            self._memory_postings += len(terms)
+            self._last = (segment_path.name, offset)
+
+    def catch_up_step(self, budget: int = 2000) -> int:
+        """从上次补建到的位置往后补建最多 budget 条，读到归档末尾时把 caught_up 置位，返回本次补建条数
+
+        只在写入线程调用：归档只由这个线程追加，读到末尾就说明已经落盘的弹幕都进了索引。
+        """
+        segments = list_segments(self.storage_folder)
+        names = [path.name for path in segments]
+        start, min_offset = 0, -1
+        cursor = self._last or self._durable_last
+        if cursor and cursor[0] in names:
+            start = names.index(cursor[0])
+            min_offset = cursor[1]
+        added = 0
+        for position, path in enumerate(segments[start:]):
+            for record in iter_segment(path, max(min_offset, 0) if position == 0 else 0):
+                if position == 0 and record.offset <= min_offset:
+                    continue
+                self.add(path, record.offset, record.text)
+                added += 1
+                if added >= budget:
+                    self.caught_up_added += added
+                    self.flush()
+                    return added
+        self.caught_up_added += added
+        self.caught_up = True
+        self.flush()
+        return added
+
+    def catch_up(self) -> int:
+        """一次补建到归档末尾，返回补建条数"""
+        added = 0
+        while not self.caught_up:
+            added += self.catch_up_step()
+        return added
+
+    def flush(self, force: bool = False):
+        """内存倒排项足够多（或 force）时写出新的 run，并视情况合并"""
+        with self._lock:
+            if not self._memory or (not force and self._memory_postings < self.run_size):
+                return
+            memory, self._memory = self._memory, {}
+            self._memory_postings = 0
+            last = self._last
+        path = self._new_run_path()
+        _write_run(path, memory)
+        run = _Run(path)
+        with self._lock:
+            self._runs.append(run)
+            self._durable_last = last
+            merge = len(self._runs) > self.merge_factor and not (self._merging and self._merging.is_alive())
+            if merge:
+                self._merging = threading.Thread(target=self._merge_loop, daemon=True, name='search-merge')
+        self._save_state()
+        if merge:
+            self._merging.start()
+
+    def _new_run_path(self) -> Path:
+        with self._lock:
+            number = self._next_run
+            self._next_run += 1
+        return self.folder / f"run_{number:06d}.sidx"
+
+    def _merge_loop(self):
+        """合并线程：合并期间写入线程又写出了新的 run，就接着合并，直到不超过 merge_factor 个"""
+        while len(self._runs) > self.merge_factor:
+            self._merge_newest()
+
+    def _wait_merge(self):
+        merging = self._merging
+        if merging and merging.is_alive():
+            merging.join()
+
+    def _merge_newest(self):
+        """把最新的 merge_factor 个 run 合并成一个，旧的大 run 保持不动"""
+        with self._lock:
+            victims = self._runs[-self.merge_factor:]
+        merged: Dict[str, List[int]] = {}
+        iterators = [run.items() for run in victims]
+        # 各 run 按时间先后排列，同一个词的倒排表按 run 顺序拼接后仍然有序
+        for term, _, postings in heapq.merge(*[
+            ((term, index, postings) for term, postings in iterator)
+            for index, iterator in enumerate(iterators)
+        ]):
+            merged.setdefault(term, []).extend(postings)
+        path = self._new_run_path()
+        _write_run(path, merged)
+        run = _Run(path)
+        with self._lock:
+            # 合并期间写入线程只会在末尾追加更新的 run，被合并的几个仍然连在一起
+            first = self._runs.index(victims[0])
+            self._runs = self._runs[:first] + [run] + self._runs[first + len(victims):]
+            for victim in victims:
+                victim.retired = True
+            idle = [victim for victim in victims if victim.readers == 0]
+        self._save_state()
+        # 还有查询在读的 run 由最后一个读者释放时删除
+        for victim in idle:
+            self._dispose(victim)
+
+    @staticmethod
+    def _dispose(run: _Run):
+        run.close()
+        run.path.unlink(missing_ok=True)
+
+    def _release(self, runs: List[_Run]):
+        with self._lock:
+            for run in runs:
+                run.readers -= 1
+            idle = [run for run in runs if run.retired and run.readers == 0]
+        for run in idle:
+            self._dispose(run)
+
+    def _save_state(self):
+        with self._state_lock:
+            with self._lock:
+                state = {
+                    'runs': [run.path.name for run in self._runs],
+                    'next_run': self._next_run,
+                    'last': list(self._durable_last) if self._durable_last else None,
+                }
+            tmp_path = self.folder / (self.STATE_FILE + '.tmp')
+            tmp_path.write_text(json.dumps(state), encoding='utf-8')
+            os.replace(tmp_path, self.folder / self.STATE_FILE)
+
+    def close(self):
+        """写出内存中剩余的倒排项，等进行中的合并结束"""
+        self.flush(force=True)
+        self._wait_merge()
+
+    # ------------------------------------------------------------ 查询
+
+    def candidates(self, query: str) -> Iterator[Tuple[Path, int]]:
+        """从新到旧逐条产出可能包含 query 的记录（分段路径, 偏移）
+
+        倒排表边读边合并求交，调用方拿够条数就可以停（用完请 close，尽早释放 run）。
+        """
+        query = query.casefold()
+        if not query:
+            return
+        single = len(query) == 1
+        terms = None if single else sorted(term for term in ngrams(query) if term[1] != '\0')
+        with self._lock:
+            runs = list(self._runs)
+            for run in runs:
+                run.readers += 1
+            # 内存部分有 run_size 上限，复制涉及的词
+            if single:
+                memory = {term: list(postings) for term, postings in self._memory.items() if term[0] == query}
+            else:
+                memory = {term: list(self._memory.get(term, ())) for term in terms}
+        try:
+            if single:
+                # 单字：所有以它开头的二元组取并集
+                streams = [reversed(postings) for postings in memory.values()]
+                for run in runs:
+                    streams.extend(run.iter_postings(term) for term in run.prefix_terms(query))
+                postings = _unique(heapq.merge(*streams, reverse=True))
+            else:
+                postings = _intersect([
+                    heapq.merge(reversed(memory[term]), *(run.iter_postings(term) for run in runs), reverse=True)
+                    for term in terms
+                ])
+            for posting in postings:
+                yield self.storage_folder / self._segment_names[posting >> OFFSET_BITS], posting & OFFSET_MASK
+        finally:
+            self._release(runs)
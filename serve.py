@@ -0,0 +1,156 @@
+"""生产模式启动
+
+一个采集进程 + 多个 Web 进程，经 Socket.IO 消息队列连在一起：
+    collector  唯一负责采集、写归档，推送写进消息队列；/history、/search 等接口也在这里
+    web        gevent/eventlet 事件循环服务前端，从消息队列接收推送，共用一个端口（SO_REUSEPORT）
+未指定 --queue 时启动本地替身广播服务器（fanout_queue.py），单机即可运行。
+最近弹幕缓冲只在采集进程里，Web 进程连接时不发送 danmaku_snapshot，断线重连也不补发，
+覆盖层刷新后要等新弹幕到来才有内容；需要快照和续传时用 web.py 单进程运行（role=all）：
+
+    python serve.py --workers 4 --port 5000 --api-port 5001
+    python serve.py --queue redis://127.0.0.1:6379/0 --server eventlet
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    """多个 Web 进程共用同一个端口，由内核分配连接"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def run_web(args):
+    """Web 进程：先打猴子补丁再导入 web"""
+    if args.server == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    else:
+        import eventlet
+        eventlet.monkey_patch()
+    os.environ['ASYNC_MODE'] = args.server
+    import web
+
+    app, _ = web.create_app(role='web')
+    sock = _listen(args.host, args.port)
+    print(f"Web 进程 {os.getpid()} 监听 {args.host}:{args.port}（{args.server}）")
+    if args.server == 'gevent':
+        from gevent import pywsgi
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+            server = pywsgi.WSGIServer(sock, app, handler_class=WebSocketHandler, log=None)
+        except ImportError:
+            server = pywsgi.WSGIServer(sock, app, log=None)  # WebSocket 由 simple-websocket 提供
+        server.serve_forever()
+    else:
+        import eventlet
+        import eventlet.wsgi
+        eventlet.wsgi.server(sock, app, log_output=False)  # 打过补丁后 sock 已是绿色套接字
+
+
+def run_collector(args):
+    """采集进程：采集保持普通线程模型，接口用多线程 WSGI 服务器"""
+    from werkzeug.serving import make_server
+    os.environ['ASYNC_MODE'] = 'threading'
+    import web
+
+    app, _ = web.create_app(role='collector')
+    server = make_server(args.host, args.api_port, app, threaded=True)
+    # SIGTERM 时正常退出，atexit 里停采集并刷完写入队列
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"采集进程 {os.getpid()} 接口监听 {args.host}:{args.api_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def supervise(args):
+    """启动并看护各个子进程，退出时先停 Web 进程，再停采集进程，最后停广播服务器"""
+    env = dict(os.environ)
+    env['SOCKETIO_MESSAGE_QUEUE'] = args.queue or f"fanout://127.0.0.1:{args.broker_port}"
+    if args.workers > 1:
+        env['SOCKETIO_WEBSOCKET_ONLY'] = '1'
+    common = ['--host', args.host, '--port', str(args.port), '--api-port', str(args.api_port),
+              '--server', args.server]
+    commands = {}
+    if not args.queue:
+        commands['broker'] = [sys.executable, str(ROOT / 'fanout_queue.py'), '--port', str(args.broker_port)]
+    commands['collector'] = [sys.executable, str(ROOT / 'serve.py'), 'collector', *common]
+    for i in range(args.workers):
+        commands[f'web-{i}'] = [sys.executable, str(ROOT / 'serve.py'), 'web', *common]
+
+    processes = {}
+
+    def spawn(name):
+        processes[name] = subprocess.Popen(commands[name], cwd=args.cwd, env=env)
+
+    for name in commands:
+        spawn(name)
+        if name == 'broker':
+            time.sleep(0.5)  # 等广播服务器开始监听
+
+    stopping = False
+
+    def shutdown(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    print(f"已启动 {args.workers} 个 Web 进程：http://{args.host}:{args.port}，接口：http://{args.host}:{args.api_port}")
+
+    while not stopping:
+        time.sleep(1)
+        for name, process in list(processes.items()):
+            if process.poll() is not None and not stopping:
+                print(f"{name} 已退出（{process.returncode}），重新启动")
+                spawn(name)
+
+    order = [name for name in processes if name.startswith('web-')] + ['collector', 'broker']
+    for name in order:
+        process = processes.get(name)
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="弹幕服务生产模式")
+    parser.add_argument('role', nargs='?', default='supervise', choices=['supervise', 'collector', 'web'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Web 进程数")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000, help="前端端口，所有 Web 进程共用")
+    parser.add_argument('--api-port', type=int, default=5001, help="采集进程的接口端口")
+    parser.add_argument('--server', choices=['gevent', 'eventlet'], default='gevent')
+    parser.add_argument('--queue', help="Socket.IO 消息队列地址，默认启动本地替身广播服务器")
+    parser.add_argument('--broker-port', type=int, default=6380)
+    parser.add_argument('--cwd', default=os.getcwd(), help="数据目录")
+    args = parser.parse_args()
+
+    if args.role == 'web':
+        run_web(args)
+    elif args.role == 'collector':
+        run_collector(args)
+    else:
+        supervise(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import random
+from collections import Counter
+
+from analytics import SpaceSaving
+
+
+def test_space_saving_bounds_and_heavy_hitters():
+    rng = random.Random(7)
+    # 少数热词加大量长尾，容量远小于不同键的数量，顶替频繁发生
+    stream = [f"热词{rng.randrange(5)}" if rng.random() < 0.3 else f"长尾{rng.randrange(5000)}"
+              for _ in range(20000)]
+    summary = SpaceSaving(50)
+    for key in stream:
+        summary.add(key, label=key.upper())
+    truth = Counter(stream)
+
+    assert len(summary.counts) == 50
+    assert sum(summary.counts.values()) == len(stream)
+    for key, count in summary.counts.items():
+        assert count - summary.errors[key] <= truth[key] <= count
+    # 出现次数超过 N / capacity 的键一定在跟踪之列
+    assert {key for key, count in truth.items() if count > len(stream) / 50} <= set(summary.counts)
+    assert [item['key'] for item in summary.top(5)] == [key for key, _ in truth.most_common(5)]
+    assert set(summary.labels) <= set(summary.counts)
+
+
+def test_space_saving_evicts_current_minimum():
+    summary = SpaceSaving(2)
+    for key in ['a', 'a', 'a', 'b', 'b']:
+        summary.add(key)
+    summary.add('c')  # 顶替计数最小的 b，继承它的计数
+    assert summary.counts == {'a': 3, 'c': 3}
+    assert summary.errors == {'a': 0, 'c': 2}
+    summary.add('a')
+    summary.add('d')  # a 的堆项已经过时，应当顶替 c
+    assert summary.counts == {'a': 4, 'd': 4}
@@ -0,0 +1,61 @@
+from archive import BinarySegmentWriter, iter_segment, load_dictionary
+
+FACE = 'https://i0.hdslb.com/bfs/face/{:040x}.jpg'
+
+
+def test_binary_round_trip(tmp_path):
+    path = tmp_path / 'danmaku_2024-01-01_1.dmk'
+    rows = [(1700000000, 12, '观众甲', '第一条', FACE.format(12)),
+            (1700000005, 34, '观众乙', '内容里有: 冒号\n和换行', FACE.format(34)),
+            (1699999990, 12, '观众甲', '', FACE.format(12)),  # 时间线倒退
+            (1700000300, 0, 'u', 'x' * 300, '')]
+    writer = BinarySegmentWriter(path)
+    offsets = [writer.write(*row) for row in rows[:2]]
+    writer.close()
+    # 重新打开时接着上一条的时间线写
+    writer = BinarySegmentWriter(path)
+    offsets += [writer.write(*row) for row in rows[2:]]
+    writer.close()
+
+    records = list(iter_segment(path))
+    assert [(r.timeline, r.uid, r.nickname, r.text, r.face) for r in records] == rows
+    assert [r.offset for r in records] == offsets
+    # 从中间的检查点开始读
+    assert [r.text for r in iter_segment(path, offsets[2], rows[2][0])] == ['', 'x' * 300]
+    assert [r.timeline for r in iter_segment(path, offsets[2], rows[2][0])] == [1699999990, 1700000300]
+
+
+def test_segments_of_a_day_share_dictionary(tmp_path):
+    for number in (1, 2):
+        writer = BinarySegmentWriter(tmp_path / f"danmaku_2024-01-01_{number}.dmk")
+        for uid in range(10):
+            writer.write(1700000000 + uid, uid, f"观众{uid}", f"第 {number} 段", FACE.format(uid))
+        writer.close()
+    BinarySegmentWriter(tmp_path / 'danmaku_2024-01-02_1.dmk').close()
+
+    assert sorted(path.name for path in tmp_path.glob('*.dmkd')) == ['danmaku_2024-01-01.dmkd',
+                                                                       'danmaku_2024-01-02.dmkd']
+    assert len(load_dictionary(tmp_path / 'danmaku_2024-01-01.dmkd')) == 20
+    second = list(iter_segment(tmp_path / 'danmaku_2024-01-01_2.dmk'))
+    assert [(r.nickname, r.face) for r in second] == [(f"观众{uid}", FACE.format(uid)) for uid in range(10)]
+
+
+def test_truncated_tail_is_dropped_on_reopen(tmp_path):
+    path = tmp_path / 'danmaku_2024-01-01_1.dmk'
+    writer = BinarySegmentWriter(path)
+    writer.write(1700000000, 1, '甲', '完整', FACE.format(1))
+    writer.write(1700000001, 2, '乙', '写了一半', FACE.format(2))
+    writer.close()
+    # 模拟异常退出：记录和字典都只落盘了一部分
+    with open(path, 'r+b') as f:
+        f.truncate(path.stat().st_size - 3)
+    dictionary = tmp_path / 'danmaku_2024-01-01.dmkd'
+    with open(dictionary, 'r+b') as f:
+        f.truncate(dictionary.stat().st_size - 5)
+
+    assert [r.text for r in iter_segment(path)] == ['完整']
+    writer = BinarySegmentWriter(path)
+    writer.write(1700000002, 3, '丙', '续写', FACE.format(3))
+    writer.close()
+    assert [(r.timeline, r.nickname, r.text) for r in iter_segment(path)] == [
+        (1700000000, '甲', '完整'), (1700000002, '丙', '续写')]
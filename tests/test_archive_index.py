@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+import archive_index
+from archive import BinarySegmentWriter, TextSegmentWriter
+from archive_index import ArchiveIndex
+from web import parse_limit
+
+
+def write_segment(path, timelines):
+    writer = (BinarySegmentWriter if path.suffix == '.dmk' else TextSegmentWriter)(path)
+    for number, timeline in enumerate(timelines):
+        writer.write(timeline, number, 'u', f"弹幕 {number}", '')
+    writer.close()
+
+
+def test_query_skips_late_records_instead_of_stopping(tmp_path):
+    # 同一批里先收到的弹幕时间线可能更晚
+    write_segment(tmp_path / 'danmaku_2024-01-01_1.txt', [100, 101, 105, 102, 103, 110, 104])
+    index = ArchiveIndex(tmp_path, every=2)
+
+    assert [record.timeline for record in index.query(100, 104)] == [100, 101, 102, 103, 104]
+    assert [record.timeline for record in index.query(100, 104, limit=3)] == [100, 101, 102]
+
+
+@pytest.mark.parametrize('suffix', ['.txt', '.dmk'])
+def test_seek_does_not_skip_earlier_late_records(tmp_path, suffix):
+    # 103 写在 101、102 之前，按检查点时间线二分会从 101 处开始读，漏掉 103
+    write_segment(tmp_path / f"danmaku_2024-01-01_1{suffix}", [100, 103, 101, 102, 104])
+    index = ArchiveIndex(tmp_path, every=2)
+
+    assert [record.timeline for record in index.query(102, 104)] == [103, 102, 104]
+    # 重新读 .idx 也一样
+    assert [record.timeline for record in ArchiveIndex(tmp_path, every=2).query(102, 104)] == [103, 102, 104]
+
+
+def test_plan_does_not_stop_at_later_segment(tmp_path):
+    write_segment(tmp_path / 'danmaku_2024-01-01_1.txt', [300, 301])
+    write_segment(tmp_path / 'danmaku_2024-01-01_2.txt', [100, 302])
+    index = ArchiveIndex(tmp_path)
+
+    assert [record.timeline for record in index.query(100, 200)] == [100]
+
+
+def test_legacy_scan_does_not_block_writer(tmp_path, monkeypatch):
+    legacy = tmp_path / 'danmaku_2024-01-01_1.txt'
+    write_segment(legacy, range(100, 200))
+    live = tmp_path / 'danmaku_2024-01-01_2.txt'
+    index = ArchiveIndex(tmp_path, every=8)
+
+    scanning, release = threading.Event(), threading.Event()
+    original = archive_index.iter_segment
+
+    def slow_iter_segment(path, *args):
+        if path == legacy and not args:
+            scanning.set()
+            release.wait(5)
+        return original(path, *args)
+
+    monkeypatch.setattr(archive_index, 'iter_segment', slow_iter_segment)
+    results = []
+    query = threading.Thread(target=lambda: results.extend(index.query(150, 300)))
+    query.start()
+    assert scanning.wait(5)
+
+    # 查询线程扫描旧分段期间，写入线程照常登记和记录新分段
+    def write_live():
+        index.track(live)
+        write_segment(live, [250])
+        index.record(live, 250, 0)
+
+    writer = threading.Thread(target=write_live)
+    writer.start()
+    writer.join(2)
+    assert not writer.is_alive()
+
+    release.set()
+    query.join(5)
+    assert [record.timeline for record in results] == list(range(150, 200)) + [250]
+    assert legacy.with_suffix('.txt.idx').exists()
+    assert index._segments[legacy].count == 100
+    assert index._segments[live].count == 1
+
+
+def test_limit_must_be_positive():
+    assert parse_limit(None, 1000, 5000) == 1000
+    assert parse_limit('20', 1000, 5000) == 20
+    assert parse_limit('99999', 1000, 5000) == 5000
+    for value in ('0', '-3', 'abc'):
+        with pytest.raises(ValueError):
+            parse_limit(value, 1000, 5000)
+
+
+def test_invalid_date_line_is_skipped(tmp_path):
+    write_segment(tmp_path / 'danmaku_2024-01-01_1.txt', [100, 101])
+    with open(tmp_path / 'danmaku_2024-01-01_1.txt', 'a', encoding='utf-8') as f:
+        f.write('[2024-13-45 25:61:00] 手改过的: 一行\n')
+    write_segment(tmp_path / 'danmaku_2024-01-01_2.txt', [102])
+
+    assert [record.text for record in ArchiveIndex(tmp_path, every=1).query(0, 200)] == ['弹幕 0', '弹幕 1', '弹幕 0']
@@ -0,0 +1,129 @@
+"""头像缓存：内存和磁盘两级 LRU、ETag、同一头像并发请求只回源一次、缩图"""
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+from avatar_cache import AvatarCache, avatar_name, proxied_avatar_url
+
+UPSTREAM = 'https://i0.hdslb.com/bfs/face/'
+
+
+class FakeResponse:
+    def __init__(self, content: bytes, status: int = 200):
+        self.content = content
+        self.status = status
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise RuntimeError(f"HTTP {self.status}")
+
+
+class FakeSession:
+    """按文件名返回固定内容，记录请求的地址；gate 不为空时等它放行，模拟慢上游"""
+
+    def __init__(self, size: int = 100, gate: threading.Event = None):
+        self.size = size
+        self.gate = gate
+        self.urls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, timeout=None):
+        with self._lock:
+            self.urls.append(url)
+        if self.gate is not None:
+            self.gate.wait(5)
+        name = url[len(UPSTREAM):].split('@', 1)[0]
+        if name.startswith('missing'):
+            return FakeResponse(b'', 404)
+        return FakeResponse(name.encode('utf-8').ljust(self.size, b'.'))
+
+
+def make_cache(folder, session, **kwargs) -> AvatarCache:
+    cache = AvatarCache(folder, UPSTREAM, session=session, **kwargs)
+    cache._pillow = None  # 原样缓存上游内容，大小可控
+    return cache
+
+
+def test_proxied_url():
+    face = 'https://i0.hdslb.com/bfs/face/abc123.jpg@48w_48h.webp?x=1'
+    assert avatar_name(face) == 'abc123.jpg'
+    assert proxied_avatar_url(face) == '/avatar/abc123.jpg'
+    assert proxied_avatar_url('https://example.com/a.jpg') == 'https://example.com/a.jpg'
+    assert avatar_name('https://i0.hdslb.com/bfs/face/../secret.jpg') is None
+
+
+def test_memory_and_disk_lru(tmp_path):
+    session = FakeSession(size=100)
+    cache = make_cache(tmp_path, session, memory_items=2, max_bytes=250)
+    for name in ('a.jpg', 'b.jpg', 'a.jpg', 'c.jpg'):
+        cache.get(name)
+    assert cache.hits['memory'] == 1
+    # 磁盘上限 250 字节只放得下两个，最久没用的 b 被淘汰；a 刚用过，留下
+    assert cache.stats()['disk_items'] == 2
+    assert session.urls[-1].startswith(UPSTREAM + 'c.jpg@')  # 没有 Pillow 时让 CDN 缩图
+
+    cache.get('a.jpg')
+    assert cache.hits['memory'] == 2
+    cache.get('b.jpg')
+    assert cache.hits['fetch'] == 4
+
+    # 重启后按修改时间恢复磁盘 LRU，内存里没有的从磁盘读
+    reopened = make_cache(tmp_path, session, memory_items=2, max_bytes=250)
+    assert reopened.get('b.jpg')[0].startswith(b'b.jpg')
+    assert reopened.hits == {'memory': 0, 'disk': 1, 'fetch': 0, 'error': 0}
+
+
+def test_etag_follows_content(tmp_path):
+    cache = make_cache(tmp_path, FakeSession())
+    data, etag = cache.get('a.jpg')
+    assert etag == AvatarCache.etag(data)
+    assert make_cache(tmp_path, FakeSession()).get('a.jpg')[1] == etag
+    assert cache.get('b.jpg')[1] != etag
+
+
+def test_concurrent_requests_fetch_once(tmp_path):
+    gate = threading.Event()
+    session = FakeSession(gate=gate)
+    cache = make_cache(tmp_path, session)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('a.jpg'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while not session.urls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(session.urls) == 1
+    assert len(results) == 8 and len(set(results)) == 1
+
+
+def test_upstream_error_is_not_cached(tmp_path):
+    session = FakeSession()
+    cache = make_cache(tmp_path, session)
+    assert cache.get('missing.jpg') is None
+    assert cache.get('missing.jpg') is None
+    assert len(session.urls) == 2
+    assert cache.stats()['error'] == 2
+
+
+def test_thumbnail_with_pillow(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    out = BytesIO()
+    Image.new('RGB', (256, 256), (200, 30, 30)).save(out, 'PNG')
+
+    class PngSession(FakeSession):
+        def get(self, url, timeout=None):
+            self.urls.append(url)
+            return FakeResponse(out.getvalue())
+
+    session = PngSession()
+    cache = AvatarCache(tmp_path, UPSTREAM, size=48, session=session)
+    data, _ = cache.get('a.png')
+    assert session.urls == [UPSTREAM + 'a.png']  # 本地缩图时取原图
+    with Image.open(BytesIO(data)) as image:
+        assert image.size == (48, 48)
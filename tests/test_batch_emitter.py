@@ -0,0 +1,74 @@
+"""批量推送：一个 tick 内每个房间只发一次 danmaku_batch，停止时发完剩下的"""
+import threading
+import time
+
+from web import BatchEmitter, Config, CustomLogger
+
+
+class RecordingSocketIO:
+    def __init__(self, failing_room: str = None):
+        self.failing_room = failing_room
+        self.events = []
+        self._lock = threading.Lock()
+
+    def emit(self, event, data, to=None):
+        if to == self.failing_room:
+            raise RuntimeError("连接已断开")
+        with self._lock:
+            self.events.append((event, data, to))
+
+
+def make_emitter(socketio, interval: float) -> BatchEmitter:
+    return BatchEmitter(socketio, Config(ROOM_IDS=[1], EMIT_BATCH_INTERVAL=interval),
+                        logger=CustomLogger(level='CRITICAL'))
+
+
+def test_batches_per_room_per_tick():
+    socketio = RecordingSocketIO()
+    emitter = make_emitter(socketio, 0.05)
+    for number in range(6):
+        emitter.emit({'text': number}, f"room_{number % 2}")
+    emitter.start()  # 先放好再启动，保证都在同一个 tick 里
+    try:
+        deadline = time.monotonic() + 5
+        while len(socketio.events) < 2:
+            assert time.monotonic() < deadline, "没有按 tick 推送"
+            time.sleep(0.01)
+    finally:
+        emitter.stop()
+
+    assert sorted(socketio.events, key=lambda event: event[2]) == [
+        ('danmaku_batch', [{'text': 0}, {'text': 2}, {'text': 4}], 'room_0'),
+        ('danmaku_batch', [{'text': 1}, {'text': 3}, {'text': 5}], 'room_1'),
+    ]
+    assert emitter.pending_count() == 0
+
+
+def test_stop_flushes_pending():
+    socketio = RecordingSocketIO()
+    emitter = make_emitter(socketio, 60)
+    emitter.start()
+    emitter.emit({'text': 'a'}, 'room_0')
+    assert emitter.pending_count() == 1
+    emitter.stop()
+    assert socketio.events == [('danmaku_batch', [{'text': 'a'}], 'room_0')]
+
+
+def test_zero_interval_emits_each_message():
+    socketio = RecordingSocketIO()
+    emitter = make_emitter(socketio, 0)
+    emitter.start()
+    emitter.emit({'text': 'a'}, 'room_0')
+    emitter.emit({'text': 'b'}, 'room_0')
+    assert socketio.events == [('danmaku', {'text': 'a'}, 'room_0'), ('danmaku', {'text': 'b'}, 'room_0')]
+    emitter.stop()
+
+
+def test_failing_room_does_not_block_others():
+    socketio = RecordingSocketIO(failing_room='room_0')
+    emitter = make_emitter(socketio, 60)
+    emitter.emit({'text': 'a'}, 'room_0')
+    emitter.emit({'text': 'b'}, 'room_1')
+    emitter.flush()
+    assert socketio.events == [('danmaku_batch', [{'text': 'b'}], 'room_1')]
+    assert emitter.pending_count() == 0
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_poll_backend_does_not_import_web_or_websocket_stack():
+    code = ("import sys; import collector; "
+            "print(sorted(m for m in ('flask', 'flask_socketio', 'werkzeug', 'bili_ws', 'websocket') "
+            "if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_single_room_uses_web_layout(tmp_path, monkeypatch):
+    from collector import Collector, build_config
+
+    monkeypatch.setenv('ROOM_ID', '1')  # 测试结束后恢复
+    monkeypatch.setenv('ROOM_IDS', '7,8')
+    single = Collector(build_config([21452505], None), base_path=str(tmp_path / 'single'))
+    multi = Collector(build_config([21452505, 3533884], None), base_path=str(tmp_path / 'multi'))
+    try:
+        assert [manager.room_id for manager in single.managers] == [21452505]
+        assert single.managers[0].file_manager.storage_folder == tmp_path / 'single' / 'danmaku_files'
+        assert [manager.file_manager.storage_folder for manager in multi.managers] == [
+            tmp_path / 'multi' / 'rooms' / str(room_id) / 'danmaku_files' for room_id in (21452505, 3533884)]
+    finally:
+        single.stop()
+        multi.stop()
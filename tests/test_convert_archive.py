@@ -0,0 +1,62 @@
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from archive import iter_segment, load_dictionary
+from convert_archive import LineParser, parse_timestamp
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_split_at_first_separator():
+    parser = LineParser()
+    # 先出现过以 'a: b' 为前缀的两段行，也不会把它当成昵称
+    assert parser.parse('[2024-05-01 20:00:00] a: b\n')[1:] == ('a', 'b')
+    assert parser.parse('[2024-05-01 20:00:01] a: b: c\n')[1:] == ('a', 'b: c')
+    assert parser.ambiguous == 1
+    assert parser.parse('[2024-05-01 20:00:02] 没有分隔符\n') is None
+    assert parser.malformed == 1
+
+
+def test_sqlite_output_written_by_parent(tmp_path):
+    source = tmp_path / 'danmaku_files'
+    source.mkdir()
+    for number in range(1, 7):
+        lines = [f"[2024-05-01 20:{minute:02d}:00] 观众{minute}: 第 {number} 个文件: {minute}\n"
+                 for minute in range(50)]
+        (source / f"danmaku_2024-05-01_{number}.txt").write_text(''.join(lines), encoding='utf-8')
+    database = tmp_path / 'danmaku.db'
+
+    for _ in range(2):  # 重跑覆盖，不会重复
+        subprocess.run([sys.executable, str(ROOT / 'convert_archive.py'), str(source), '--to', 'sqlite',
+                        '--output', str(database), '--workers', '3', '--restart'],
+                       check=True, capture_output=True)
+
+    with sqlite3.connect(database) as conn:
+        assert conn.execute('SELECT COUNT(*), COUNT(DISTINCT source) FROM danmaku').fetchone() == (300, 6)
+        row = conn.execute("SELECT timeline, nickname, text FROM danmaku "
+                           "WHERE source = 'danmaku_2024-05-01_3.txt' ORDER BY offset LIMIT 1").fetchone()
+    assert row == (parse_timestamp('2024-05-01 20:00:00'), '观众0', '第 3 个文件: 0')
+
+
+def test_binary_output_shares_dictionary_per_day(tmp_path):
+    source = tmp_path / 'danmaku_files'
+    source.mkdir()
+    for day in (1, 2):
+        for number in range(1, 4):
+            lines = [f"[2024-05-0{day} 20:{minute:02d}:00] 观众{minute % 5}: 第 {number} 个文件\n"
+                     for minute in range(20)]
+            (source / f"danmaku_2024-05-0{day}_{number}.txt").write_text(''.join(lines), encoding='utf-8')
+    output = tmp_path / 'danmaku_binary'
+
+    subprocess.run([sys.executable, str(ROOT / 'convert_archive.py'), str(source), '--to', 'binary',
+                    '--output', str(output), '--workers', '3'], check=True, capture_output=True)
+
+    assert sorted(path.name for path in output.glob('*.dmkd')) == ['danmaku_2024-05-01.dmkd',
+                                                                  'danmaku_2024-05-02.dmkd']
+    assert load_dictionary(output / 'danmaku_2024-05-01.dmkd') == ['观众0', '', '观众1', '观众2', '观众3', '观众4']
+    records = list(iter_segment(output / 'danmaku_2024-05-02_3.dmk'))
+    assert [(record.nickname, record.text) for record in records[:2]] == [('观众0', '第 3 个文件'),
+                                                                          ('观众1', '第 3 个文件')]
+    assert records[0].timeline == parse_timestamp('2024-05-02 20:00:00')
@@ -0,0 +1,95 @@
+"""同一秒内的弹幕不再因时间戳相同被当作重复；冷清房间里的旧弹幕不会被重复存储"""
+from datetime import datetime
+
+from archive import iter_segment
+from web import Config, CustomLogger, DanmakuManager, DedupJournal, DedupWindow, FileManager, make_dedup_key
+
+ROOM_ID = 1
+
+
+def message(uid: int, text: str, timeline: str = '2024-05-01 20:00:00') -> dict:
+    return {'timeline': timeline, 'uid': uid, 'nickname': f"观众{uid}", 'text': text, 'user': {}}
+
+
+def test_window_keeps_same_second_messages_from_different_users():
+    window = DedupWindow(max_keys=100)
+    assert window.add(make_dedup_key(1714564800, 1, '666'))
+    assert window.add(make_dedup_key(1714564800, 2, '666'))
+    assert window.add(make_dedup_key(1714564800, 1, '哈哈'))
+    assert not window.add(make_dedup_key(1714564800, 1, '666'))
+
+
+def test_manager_stores_both_and_drops_exact_resend(tmp_path):
+    logger = CustomLogger(level='INFO')
+    manager = DanmakuManager(Config(ROOM_IDS=[ROOM_ID]), FileManager(tmp_path, logger=logger), None,
+                             logger=logger, room_id=ROOM_ID)
+    manager.start()
+    try:
+        assert manager._process_single_danmaku(message(1, '主播加油'))
+        assert manager._process_single_danmaku(message(2, '主播加油'))
+        assert not manager._process_single_danmaku(message(1, '主播加油'))
+    finally:
+        manager.stop()  # 刷完写入队列
+
+    stored = [record for path in FileManager(tmp_path, logger=logger).list_segments()
+              for record in iter_segment(path)]
+    assert [(record.nickname, record.text) for record in stored] == [('观众1', '主播加油'), ('观众2', '主播加油')]
+
+
+def test_journal_compaction_counts_loaded_lines_and_keeps_only_written_keys(tmp_path):
+    config = Config(ROOM_IDS=[ROOM_ID], DEDUP_COMPACT_MIN_LINES=5, DEDUP_COMPACT_RATIO=2.0)
+    logger = CustomLogger(level='INFO')
+    file_manager = FileManager(tmp_path, logger=logger)
+    key = make_dedup_key(1714564800, 1, '666')
+    journal = DedupJournal(config, file_manager, logger=logger)
+    journal.append([key] * 10)  # 重复行，存活的只有一个键
+    journal.close()
+
+    # 重启后读回的 10 行也算进压缩阈值
+    restarted = DedupJournal(config, file_manager, logger=logger)
+    assert restarted.load() == [key] * 10
+    fresh = make_dedup_key(1714564801, 2, '好耶')
+    restarted.append([fresh])
+    restarted.maybe_compact()
+    restarted.close()
+
+    lines = (file_manager.set_folder / restarted._today_path().name).read_text(encoding='utf-8').split()
+    assert lines == [key, fresh]
+
+
+class SlowRoomSession:
+    """模拟冷清的房间：每次轮询多一条弹幕，间隔 720 秒，gethistory 总是返回最近 10 条"""
+
+    def __init__(self):
+        self.history = []
+
+    def post(self):
+        number = len(self.history)
+        timeline = datetime.fromtimestamp(1714564800 + number * 720).strftime('%Y-%m-%d %H:%M:%S')
+        self.history.append(message(number, f"第 {number} 条", timeline))
+
+    def get(self, url, **kwargs):
+        history = self.history[-10:]
+        return type('Response', (), {'json': lambda _: {'code': 0, 'data': {'room': history}}})()
+
+
+def test_slow_room_old_history_is_not_stored_again(tmp_path):
+    logger = CustomLogger(level='INFO')
+    manager = DanmakuManager(Config(ROOM_IDS=[ROOM_ID]), FileManager(tmp_path, logger=logger), None,
+                             logger=logger, room_id=ROOM_ID)
+    session = SlowRoomSession()
+    manager.session = session
+    manager.start()
+    try:
+        for _ in range(10):
+            session.post()
+        assert manager._fetch_and_process_danmaku()[:2] == (10, 10)
+        for _ in range(50):
+            session.post()
+            assert manager._fetch_and_process_danmaku()[:2] == (10, 1)
+    finally:
+        manager.stop()
+
+    stored = [record.text for path in FileManager(tmp_path, logger=logger).list_segments()
+              for record in iter_segment(path)]
+    assert stored == [f"第 {number} 条" for number in range(60)]
@@ -0,0 +1,141 @@
+"""逐客户端推送队列：三种溢出策略、发送队列在途上限、慢客户端不拖累其它客户端"""
+import queue
+import time
+
+from socketio import packet as sio_packet
+
+from delivery import DeliveryHub
+
+
+class FakeSocket:
+    """Engine.IO 连接，drain 为假时包留在发送队列里，模拟收得慢的客户端"""
+
+    def __init__(self, drain: bool):
+        self.drain = drain
+        self.queue = queue.Queue()
+        self.received = []
+        self.closed = False
+
+    def close(self, wait: bool = True):
+        self.closed = True
+
+
+class FakeEngine:
+    def __init__(self):
+        self.sockets = {}
+
+    def send_packet(self, eio_sid: str, packet):
+        socket = self.sockets[eio_sid]
+        event, data = sio_packet.Packet(encoded_packet=packet.data).data
+        socket.received.append((event, data))
+        if not socket.drain:
+            socket.queue.put(packet)
+
+
+class FakeManager:
+    def __init__(self):
+        self.clients = {}
+
+    def get_participants(self, namespace: str, room):
+        return list(self.clients.items())
+
+    def eio_sid_from_sid(self, sid: str, namespace: str):
+        return self.clients.get(sid)
+
+
+class FakeServer:
+    packet_class = sio_packet.Packet
+
+    def __init__(self):
+        self.manager = FakeManager()
+        self.eio = FakeEngine()
+
+
+class FakeSocketIO:
+    def __init__(self):
+        self.server = FakeServer()
+
+    def connect(self, sid: str, drain: bool = True) -> FakeSocket:
+        self.server.manager.clients[sid] = f"eio-{sid}"
+        socket = self.server.eio.sockets[f"eio-{sid}"] = FakeSocket(drain)
+        return socket
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def pending_events(hub: DeliveryHub, sid: str) -> list:
+    return [(item.event, item.data) for item in hub._channels[sid].pending]
+
+
+def test_drop_oldest_keeps_newest_packets():
+    socketio = FakeSocketIO()
+    socketio.connect('a')
+    hub = DeliveryHub(socketio, max_pending=3, policy='drop_oldest')
+    for number in range(5):
+        hub.emit('danmaku', {'text': number})
+
+    assert pending_events(hub, 'a') == [('danmaku', {'text': number}) for number in (2, 3, 4)]
+    assert hub.stats()[0]['dropped'] == 2
+    assert hub.stats()[0]['overflows'] == 2
+
+
+def test_collapse_merges_backlog_into_one_batch():
+    socketio = FakeSocketIO()
+    socketio.connect('a')
+    hub = DeliveryHub(socketio, max_pending=3, policy='collapse', collapse_keep=2)
+    hub.emit('danmaku', {'text': 1})
+    hub.emit('stats', {'version': 1})
+    hub.emit('danmaku_batch', [{'text': 2}, {'text': 3}])
+    hub.emit('stats', {'version': 2})
+
+    # 其它事件只留最新一个，弹幕只留最新 collapse_keep 条
+    assert pending_events(hub, 'a') == [('stats', {'version': 2}),
+                                        ('danmaku_batch', [{'text': 2}, {'text': 3}])]
+    client = hub.stats()[0]
+    assert (client['dropped'], client['pending_messages']) == (2, 3)
+
+
+def test_disconnect_closes_only_the_slow_client():
+    socketio = FakeSocketIO()
+    slow = socketio.connect('slow', drain=False)
+    fast = socketio.connect('fast')
+    hub = DeliveryHub(socketio, max_pending=2, policy='disconnect', max_in_flight=1)
+    hub.start()
+    try:
+        for number in range(4):
+            hub.emit('danmaku', {'text': number})
+            wait_until(lambda: len(fast.received) == number + 1)  # 快客户端跟得上，不会积压
+        wait_until(lambda: slow.closed)
+        assert [data['text'] for _, data in fast.received] == [0, 1, 2, 3]
+        assert 'slow' not in [client['sid'] for client in hub.stats()]
+    finally:
+        hub.stop()
+
+
+def test_in_flight_limit_holds_backlog_per_client():
+    socketio = FakeSocketIO()
+    slow = socketio.connect('slow', drain=False)
+    fast = socketio.connect('fast')
+    hub = DeliveryHub(socketio, max_pending=20, max_in_flight=2)
+    hub.start()
+    try:
+        for number in range(10):
+            hub.emit('danmaku', {'text': number})
+            wait_until(lambda: len(fast.received) == number + 1)
+        wait_until(lambda: len(slow.received) == 2)
+        time.sleep(DeliveryHub.TICK * 3)
+        # 慢客户端的发送队列满了，其余的留在它自己的待发队列里
+        assert len(slow.received) == 2
+        assert {client['sid']: client['pending'] for client in hub.stats()} == {'slow': 8, 'fast': 0}
+
+        while not slow.queue.empty():
+            slow.queue.get()
+        wait_until(lambda: len(slow.received) == 4)
+        assert [data['text'] for _, data in slow.received] == [0, 1, 2, 3]
+    finally:
+        hub.stop()
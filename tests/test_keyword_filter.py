@@ -0,0 +1,66 @@
+"""屏蔽词过滤：重叠命中、打码、丢弃和标记、大小写、词表热加载"""
+import time
+
+from keyword_filter import Automaton, KeywordFilter
+
+
+def make_filter(tmp_path, content: str, default_action: str = 'mask', **kwargs) -> KeywordFilter:
+    path = tmp_path / 'keywords.txt'
+    path.write_text(content, encoding='utf-8')
+    return KeywordFilter(str(path), default_action, **kwargs)
+
+
+def test_overlapping_and_nested_matches():
+    automaton = Automaton({'abc': 'mask', 'bcd': 'mask', 'c': 'tag', 'abcde': 'mask'})
+    assert sorted(automaton.search('xabcdex')) == [(1, 4, 'mask', 'abc'), (1, 6, 'mask', 'abcde'),
+                                                  (2, 5, 'mask', 'bcd'), (3, 4, 'tag', 'c')]
+    assert automaton.search('ab bd') == []
+
+
+def test_mask_covers_overlapping_hits(tmp_path):
+    keyword_filter = make_filter(tmp_path, '加群\n群号\n')
+    assert keyword_filter.check('快加群号123')[0] == '快***123'
+    assert keyword_filter.check('主播加油')[0] == '主播加油'
+
+
+def test_drop_and_tag(tmp_path):
+    keyword_filter = make_filter(tmp_path, '# 注释\n广告\tdrop\n剧透\ttag\n结局\ttag\n无效\tunknown\n')
+    text, tags, hits = keyword_filter.check('剧透预警：广告位招租')
+    assert text is None and hits[-1][2:] == ('drop', '广告')
+
+    text, tags, _ = keyword_filter.check('剧透：结局是剧透')
+    assert text == '剧透：结局是剧透'  # tag 不改内容
+    assert tags == ('剧透', '结局')
+    assert keyword_filter.check('无效的处理方式被忽略')[1:] == ((), [])
+
+
+def test_case_insensitive_but_keeps_original_case(tmp_path):
+    keyword_filter = make_filter(tmp_path, 'QQ群\n')
+    assert keyword_filter.check('加qQ群啊 QQ')[0] == '加***啊 QQ'
+    # 'İ' 转小写后变成两个字符，按原文匹配，下标仍然对得上
+    assert keyword_filter.check('İ qq群')[0] == 'İ ***'
+
+
+def test_hot_reload(tmp_path):
+    keyword_filter = make_filter(tmp_path, '广告\n', reload_interval=0.05)
+    keyword_filter.start()
+    path = keyword_filter.path
+    try:
+        assert keyword_filter.check('广告剧透')[0] == '**剧透'
+
+        path.write_text('广告\n剧透\tdrop\n', encoding='utf-8')
+        deadline = time.monotonic() + 5
+        while keyword_filter.check('广告剧透')[0] is not None:
+            assert time.monotonic() < deadline, "词表没有重新加载"
+            time.sleep(0.02)
+
+        # 词表写坏时继续用旧的
+        path.write_bytes(b'\xff\xfe broken\n')
+        assert not keyword_filter.reload()
+        assert keyword_filter.check('剧透')[0] is None
+
+        path.unlink()
+        assert keyword_filter.reload()
+        assert keyword_filter.check('广告剧透') == ('广告剧透', (), [])
+    finally:
+        keyword_filter.stop()
@@ -0,0 +1,53 @@
+"""轮询跟不上时按时间线密度估算丢失条数，对照 bench/stub_server.py 实际产生的条数"""
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bench'))
+
+import stub_server  # noqa: E402
+from web import AdaptivePollInterval, Config, CustomLogger, DanmakuManager, FileManager  # noqa: E402
+
+
+class StubSession:
+    """直接调用替身服务器的弹幕源，不走网络"""
+
+    def __init__(self, history: stub_server.SyntheticHistory):
+        self.history = history
+
+    def get(self, url, **kwargs):
+        batch = self.history.next_batch()
+        return SimpleNamespace(json=lambda: {'code': 0, 'data': {'room': batch}})
+
+
+def test_estimated_lost_tracks_stub_when_polling_falls_behind(tmp_path, monkeypatch):
+    clock = [1714564800.0]
+    monkeypatch.setattr(stub_server, 'time', SimpleNamespace(
+        time=lambda: clock[0], strftime=time.strftime, localtime=time.localtime))
+    history = stub_server.SyntheticHistory(rate=50, window=10)
+    logger = CustomLogger(level='INFO')
+    manager = DanmakuManager(Config(ROOM_IDS=[1]), FileManager(tmp_path, logger=logger), None,
+                             logger=logger, room_id=1, session=StubSession(history))
+    manager.start()
+    stored = 0
+    try:
+        for _ in range(300):
+            clock[0] += 1.03  # 每秒 50 条，约每秒轮询一次只能拿到 10 条
+            returned, new, span = manager._fetch_and_process_danmaku()
+            manager.poll_interval.update(returned, new, 0.0, span)
+            stored += new
+    finally:
+        manager.stop()
+
+    lost = history.produced - stored
+    stats = manager.poll_interval.stats()
+    assert lost > 10000 and stats['gaps'] >= 290
+    assert 0.85 * lost <= stats['estimated_lost'] <= 1.15 * lost
+
+
+def test_partial_history_is_not_a_gap():
+    interval = AdaptivePollInterval(Config(ROOM_IDS=[1]))
+    interval.update(3, 3, 0.0, (100, 105))
+    interval.update(4, 4, 0.0, (200, 300))  # 没返回满，说明接口缓冲里的都拿到了
+    assert interval.gaps == 0 and interval.estimated_lost == 0
@@ -0,0 +1,33 @@
+import time
+from types import SimpleNamespace
+
+from archive import TextSegmentWriter
+from archive_index import ArchiveIndex
+from web import Config, ReplaySource
+
+
+class RecordingEmitter:
+    def __init__(self):
+        self.sent = []
+
+    def emit(self, payload, room):
+        self.sent.append((room, payload['text']))
+
+
+def test_seek_before_play_replays_to_now(tmp_path):
+    now = int(time.time())
+    writer = TextSegmentWriter(tmp_path / 'danmaku_2024-05-01_1.txt')
+    for number, timeline in enumerate([now - 120, now - 60, now - 60, now - 30]):
+        writer.write(timeline, number, f"观众{number}", f"弹幕 {number}", '')
+    writer.close()
+    emitter = RecordingEmitter()
+    manager = SimpleNamespace(room_id=1, config=Config(ROOM_IDS=[1]), emitter=emitter,
+                              writer=SimpleNamespace(index=ArchiveIndex(tmp_path)))
+    replay = ReplaySource(manager)
+    replay.speed = 1000
+
+    replay.seek(now - 90)  # 没有先 play
+    replay._thread.join(5)
+
+    assert replay.end_timeline >= now
+    assert emitter.sent == [('replay:1', '弹幕 1'), ('replay:1', '弹幕 2'), ('replay:1', '弹幕 3')]
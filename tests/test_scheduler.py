@@ -0,0 +1,92 @@
+"""多房间调度：共用连接池、各房间按自己的间隔轮询、慢房间不拖累其它房间、停止时等轮询结束"""
+import threading
+import time
+
+from web import Config, CustomLogger, RoomScheduler
+
+
+class FakeManager:
+    """只实现调度器用到的接口，poll_once 记录调用并返回下次间隔"""
+
+    def __init__(self, room_id: int, interval: float, duration: float = 0.0, polling: bool = True):
+        self.room_id = room_id
+        self.interval = interval
+        self.duration = duration
+        self.polling = polling
+        self.session = None
+        self.polls = []
+        self.started = self.stopped = False
+        self.running = 0
+        self.finished = 0
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        assert self.running == 0, "还有进行中的轮询就停止了房间"
+        self.stopped = True
+
+    def poll_once(self) -> float:
+        self.running += 1
+        self.polls.append(time.monotonic())
+        time.sleep(self.duration)
+        self.running -= 1
+        self.finished += 1
+        return self.interval
+
+
+def run_scheduler(managers, seconds: float, workers: int = 4) -> RoomScheduler:
+    scheduler = RoomScheduler(Config(ROOM_IDS=[1], POLL_WORKERS=workers), managers,
+                              logger=CustomLogger(level='WARNING'))
+    scheduler.start()
+    time.sleep(seconds)
+    scheduler.stop()
+    return scheduler
+
+
+def test_rooms_share_session_and_poll_at_own_interval():
+    fast, slow, ws = FakeManager(1, 0.05), FakeManager(2, 10), FakeManager(3, 0.05, polling=False)
+    scheduler = run_scheduler([fast, slow, ws], 0.5)
+
+    assert fast.session is slow.session is ws.session is scheduler.session
+    assert len(fast.polls) >= 5
+    assert len(slow.polls) == 1
+    assert ws.polls == []  # WebSocket 采集的房间不轮询
+    assert all(manager.started and manager.stopped for manager in (fast, slow, ws))
+
+
+def test_slow_room_does_not_delay_others():
+    stuck, fast = FakeManager(1, 0.05, duration=0.6), FakeManager(2, 0.05)
+    run_scheduler([stuck, fast], 0.4, workers=2)
+
+    # 第一个房间还卡在第一次轮询时，另一个房间照常轮询
+    assert len(stuck.polls) == 1
+    assert len(fast.polls) >= 4
+    assert stuck.finished == 1  # stop 等进行中的轮询结束
+
+
+def test_polls_run_concurrently_up_to_workers():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    class CountingManager(FakeManager):
+        def poll_once(self) -> float:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            try:
+                return super().poll_once()
+            finally:
+                with lock:
+                    active[0] -= 1
+
+    managers = [CountingManager(room_id, 0.01, duration=0.1) for room_id in range(5)]
+    run_scheduler(managers, 0.3, workers=3)
+    assert peak[0] == 3
+
+
+def test_stop_is_idempotent():
+    scheduler = RoomScheduler(Config(ROOM_IDS=[1]), [FakeManager(1, 0.05)], logger=CustomLogger(level='WARNING'))
+    scheduler.start()
+    scheduler.stop()
+    scheduler.stop()
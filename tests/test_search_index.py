@@ -0,0 +1,92 @@
+"""全文索引：从新到旧流式求交、后台合并不打断正在读的查询、分步补建"""
+from pathlib import Path
+
+from archive import TextSegmentWriter
+from search_index import SearchIndex
+
+WORDS = ['主播加油', '哈哈哈', '前方高能', '主播好强', '加油加油', '下次一定']
+
+
+def write_archive(folder: Path, count: int, per_segment: int = 50) -> list:
+    """写 count 条弹幕，返回 [(分段路径, 偏移, 内容)]"""
+    folder.mkdir(parents=True, exist_ok=True)
+    records = []
+    writer = None
+    for i in range(count):
+        if i % per_segment == 0:
+            if writer:
+                writer.close()
+            writer = TextSegmentWriter(folder / f"danmaku_2024-05-01_{i // per_segment + 1}.txt")
+        text = f"{WORDS[i % len(WORDS)]} {i}"
+        records.append((writer._file.name, writer.write(1714564800 + i, i, f"观众{i}", text, ''), text))
+    writer.close()
+    return [(Path(name), offset, text) for name, offset, text in records]
+
+
+def build(index: SearchIndex, step: int = 20):
+    """分小步补建，每步之后视情况写出 run，得到多个 run，等后台合并结束"""
+    while not index.caught_up:
+        index.catch_up_step(step)
+    index._wait_merge()
+
+
+def expected(records: list, query: str) -> list:
+    return [(path, offset) for path, offset, text in reversed(records) if query in text]
+
+
+def test_candidates_stream_newest_first_across_runs(tmp_path):
+    records = write_archive(tmp_path / 'danmaku_files', 300)
+    index = SearchIndex(tmp_path / 'search', tmp_path / 'danmaku_files', run_size=200, merge_factor=3)
+    build(index)
+    assert 1 < len(index._runs) <= index.merge_factor and index._memory  # 合并过，既有 run 也有内存部分
+
+    for query in ('主播', '加油', '高能', '主'):
+        assert list(index.candidates(query)) == expected(records, query)
+    # 拿够就停
+    candidates = index.candidates('加油')
+    assert [next(candidates) for _ in range(3)] == expected(records, '加油')[:3]
+    candidates.close()
+    assert all(run.readers == 0 for run in index._runs)
+
+
+def test_merge_waits_for_running_query(tmp_path):
+    records = write_archive(tmp_path / 'danmaku_files', 200)
+    index = SearchIndex(tmp_path / 'search', tmp_path / 'danmaku_files', run_size=100, merge_factor=100)
+    build(index)
+    index.flush(force=True)
+    old_runs = list(index._runs)
+    assert len(old_runs) > 1
+
+    candidates = index.candidates('主播')
+    first = next(candidates)
+    index.merge_factor = len(old_runs)
+    index._merge_newest()  # 查询进行中，旧 run 全部被合并替换
+    assert not any(run in index._runs for run in old_runs)
+    assert all(run.path.exists() for run in old_runs)  # 还有读者，先不删
+
+    assert [first] + list(candidates) == expected(records, '主播')
+    assert not any(run.path.exists() for run in old_runs)
+    assert list(index.candidates('主播')) == expected(records, '主播')
+
+
+def test_catch_up_runs_in_steps(tmp_path):
+    records = write_archive(tmp_path / 'danmaku_files', 120)
+    index = SearchIndex(tmp_path / 'search', tmp_path / 'danmaku_files')
+    assert index.catch_up_step(50) == 50
+    assert not index.caught_up
+    assert index.catch_up_step(50) == 50
+    assert index.catch_up_step(50) == 20
+    assert index.caught_up
+    assert list(index.candidates('高能')) == expected(records, '高能')
+
+
+def test_catch_up_skips_invalid_date_line(tmp_path):
+    records = write_archive(tmp_path / 'danmaku_files', 60, per_segment=30)
+    with open(records[0][0], 'a', encoding='utf-8') as f:
+        f.write('[2024-02-30 20:00:00] 手改过的: 主播加油\n')
+    index = SearchIndex(tmp_path / 'search', tmp_path / 'danmaku_files', run_size=200)
+    build(index)
+
+    assert index.caught_up_added == 60
+    assert list(index.candidates('主播加油')) == expected(records, '主播加油')
+    index.close()
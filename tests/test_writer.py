@@ -0,0 +1,63 @@
+"""后台写入线程：按条数或时间间隔刷盘，停止时写完队列里剩下的弹幕"""
+import time
+
+from archive import iter_segment, list_segments
+from web import Config, CustomLogger, DanmakuRecord, DanmakuWriter, DedupJournal, FileManager
+
+
+def make_writer(tmp_path, **overrides):
+    config = Config(ROOM_IDS=[1], **overrides)
+    logger = CustomLogger(level='WARNING')
+    file_manager = FileManager(tmp_path, logger=logger)
+    journal = DedupJournal(config, file_manager, logger=logger)
+    return DanmakuWriter(config, file_manager, journal, logger=logger), file_manager
+
+
+def record(number: int) -> DanmakuRecord:
+    return DanmakuRecord(1714564800 + number, '', number, f"观众{number}", f"弹幕 {number}", '')
+
+
+def stored(file_manager: FileManager) -> list:
+    return [item.text for path in list_segments(file_manager.storage_folder) for item in iter_segment(path)]
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_flush_by_batch_size_and_interval(tmp_path):
+    writer, file_manager = make_writer(tmp_path, WRITER_BATCH_SIZE=5, WRITER_FLUSH_INTERVAL=1.0)
+    writer.start()
+    try:
+        for number in range(5):
+            writer.put(record(number))
+        # 攒够一批立即写入，不等刷盘间隔
+        wait_until(lambda: len(stored(file_manager)) == 5, timeout=0.8)
+
+        writer.put(record(5))
+        time.sleep(0.2)
+        assert len(stored(file_manager)) == 5  # 不足一批，等到刷盘间隔
+        wait_until(lambda: len(stored(file_manager)) == 6)
+    finally:
+        writer.close()
+
+
+def test_close_drains_queue(tmp_path):
+    writer, file_manager = make_writer(tmp_path, WRITER_BATCH_SIZE=1000, WRITER_FLUSH_INTERVAL=60,
+                                       MAX_DANMAKU_PER_FILE=100)
+    writer.start()
+    for number in range(350):
+        writer.put(record(number))
+    writer.close()
+    writer.close()  # 可重复调用
+
+    assert stored(file_manager) == [f"弹幕 {number}" for number in range(350)]
+    assert len(list_segments(file_manager.storage_folder)) == 4
+    assert file_manager.read_counter_file() == (4, 350)
+    # 去重键在弹幕落盘之后记录，重启后能恢复
+    reopened = DedupJournal(writer.config, file_manager)
+    assert len(reopened.load()) == 350
+    reopened.close()
@@ -1,15 +1,37 @@
-from flask import Flask, render_template, jsonify
-from flask_socketio import SocketIO, emit
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import threading
 import time
 import os
+import queue
+import atexit
 import logging
+import sys
+import zlib
+from collections import deque
+from contextlib import closing
+from functools import lru_cache
+from itertools import groupby, islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
-from dataclasses import dataclass
-from typing import Set, Dict, Optional, Callable
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Set, Dict, Iterator, List, Optional, Callable, Tuple, Union
+
+from archive import SEGMENT_WRITERS, format_timeline, list_segments
+import metrics
+from analytics import RoomAnalytics
+from archive_index import ArchiveIndex
+from avatar_cache import AVATAR_NAME, AvatarCache, proxied_avatar_url, sniff_content_type
+from search_index import SearchIndex
+from keyword_filter import KeywordFilter
+
+if TYPE_CHECKING:  # Web 相关依赖在 create_app 里才导入，无界面采集（collector.py）不加载
+    from flask import Flask
+    from flask_socketio import SocketIO
+    from delivery import DeliveryHub
+    from bili_ws import LiveWebSocketClient  # 只有 INGEST_BACKEND=ws 时才在 start 里导入
 
 
 @dataclass
@@ -17,8 +39,67 @@ class Config:
     """应用配置类"""
     SECRET_KEY: str = 'secret!'
     DEFAULT_ROOM_ID: int = 3533884
+    ROOM_IDS: List[int] = None  # 多房间模式的房间列表，留空时读取环境变量 ROOM_IDS 或 ROOMS_FILE
+    ROOMS_FILE: str = 'rooms.json'  # 多房间配置文件，内容为房间号列表
+    POLL_WORKERS: int = 8  # 并发轮询的线程数
+    POLL_INTERVAL: float = 5.0  # 初始轮询间隔（秒）
+    POLL_MIN_INTERVAL: float = 1.0  # 轮询间隔下限
+    POLL_MAX_INTERVAL: float = 30.0  # 轮询间隔上限，空闲或出错时退避到此为止
+    POLL_BACKOFF: float = 2.0  # 空闲或出错时间隔放大的倍数
+    POLL_TARGET_FILL: float = 0.5  # 期望每次轮询时历史接口缓冲填满的比例
+    POLL_TIMEOUT: float = 10.0  # 单次请求超时
+    HISTORY_CAPACITY: int = 10  # gethistory 每次最多返回的弹幕条数
     MAX_DANMAKU_PER_FILE: int = 1000
-    BILIBILI_API_BASE: str = "https://api.live.bilibili.com"
+    # 归档格式：text 为 danmaku_*.txt 文本行，binary 为紧凑二进制分段 danmaku_*.dmk
+    ARCHIVE_FORMAT: str = field(default_factory=lambda: os.environ.get('ARCHIVE_FORMAT', 'text'))
+    INDEX_EVERY: int = 64  # 稀疏索引每隔多少条弹幕记一个检查点
+    HISTORY_MAX_LIMIT: int = 10000  # /history 单次最多返回的条数
+    SEARCH_RUN_SIZE: int = 200000  # 全文索引内存中攒够多少倒排项写出一个 run 文件
+    SEARCH_MERGE_FACTOR: int = 8  # run 文件超过多少个时合并最新的几个
+    SEARCH_MAX_LIMIT: int = 1000  # /search 单次最多返回的条数
+    SEARCH_CATCH_UP_STEP: int = 2000  # 启动后补建全文索引时，两批写入之间最多补建多少条
+    WRITER_QUEUE_SIZE: int = 10000  # 写入队列上限，满时采集线程阻塞等待
+    WRITER_BATCH_SIZE: int = 200  # 攒够多少条弹幕刷一次盘
+    WRITER_FLUSH_INTERVAL: float = 1.0  # 最长多少秒刷一次盘
+    DEDUP_WINDOW_SIZE: int = 20000  # 去重窗口最多保留多少个键
+    DEDUP_COMPACT_MIN_LINES: int = 10000  # 去重日志至少多少行才考虑压缩
+    DEDUP_COMPACT_RATIO: float = 2.0  # 日志行数超过存活键数的多少倍时压缩
+    BILIBILI_API_BASE: str = field(default_factory=lambda: os.environ.get('BILIBILI_API_BASE', "https://api.live.bilibili.com"))
+    # 采集方式：poll 轮询 gethistory，ws 连接直播间弹幕 WebSocket
+    INGEST_BACKEND: str = field(default_factory=lambda: os.environ.get('INGEST_BACKEND', 'poll'))
+    # 指定弹幕 WebSocket 地址（如本地替身服务器 ws://127.0.0.1:7777/sub），留空则向接口查询
+    BILIBILI_WS_URL: str = field(default_factory=lambda: os.environ.get('BILIBILI_WS_URL', ''))
+    EMIT_BATCH_INTERVAL: float = 0.08  # 合并推送的间隔（秒），为 0 时逐条发送 danmaku 事件
+    RECENT_BUFFER_SIZE: int = 200  # 每个房间在内存中保留最近多少条弹幕，新连接的客户端先收到这些，为 0 时不保留
+    DELIVERY_QUEUE_SIZE: int = 200  # 每个客户端最多积压的推送包数，为 0 时不排队、直接按房间推送
+    DELIVERY_POLICY: str = 'drop_oldest'  # 积压超出时的处理：drop_oldest 丢最旧的、collapse 合并成最新 N 条、disconnect 断开
+    DELIVERY_COLLAPSE_KEEP: int = 100  # collapse 时保留的最新弹幕条数
+    DELIVERY_MAX_IN_FLIGHT: int = 4  # 连接发送队列里最多放几个包，其余留在待发队列里计算延迟
+    KEYWORD_FILE: str = field(default_factory=lambda: os.environ.get('KEYWORD_FILE', 'keywords.txt'))  # 屏蔽词表，文件不存在时不过滤，之后创建也会自动加载
+    KEYWORD_ACTION: str = 'mask'  # 词表里没写处理方式的词的默认处理：drop 丢弃、mask 打码、tag 标记
+    KEYWORD_RELOAD_INTERVAL: float = 2.0  # 检查词表文件是否变化的间隔（秒），为 0 时只在启动时加载
+    STATS_WINDOW_MINUTES: int = 60  # 实时统计保留最近多少分钟的分钟桶
+    STATS_TOP_K: int = 20  # 热词和话痨榜的条数
+    STATS_PUSH_INTERVAL: float = 0  # 通过 Socket.IO 推送 stats 事件的间隔（秒），为 0 时不推送
+    LOG_LEVEL: str = field(default_factory=lambda: os.environ.get('LOG_LEVEL', 'DEBUG'))  # 日志级别，逐条弹幕日志为 DEBUG，负载高时设为 INFO
+    # Socket.IO 运行方式：threading（开发服务器）、eventlet 或 gevent（生产模式，见 serve.py）
+    ASYNC_MODE: str = field(default_factory=lambda: os.environ.get('ASYNC_MODE', 'threading'))
+    # Socket.IO 消息队列，多个 Web 进程时由采集进程经队列推送：redis://、amqp:// 或本地替身 fanout://
+    SOCKETIO_MESSAGE_QUEUE: str = field(default_factory=lambda: os.environ.get('SOCKETIO_MESSAGE_QUEUE', ''))
+    SOCKETIO_CHANNEL: str = 'danmaku'  # 消息队列里使用的频道名
+    AVATAR_PROXY: bool = True  # 推送的头像地址改为本地 /avatar/ 代理
+    # 头像上游地址，测试时可指向替身服务器（bench/stub_server.py）
+    AVATAR_UPSTREAM: str = field(default_factory=lambda: os.environ.get('AVATAR_UPSTREAM', 'https://i0.hdslb.com/bfs/face/'))
+    AVATAR_SIZE: int = 64  # 缩略图边长（像素），前端显示 30px，留出高分屏的余量
+    AVATAR_CACHE_BYTES: int = 64 * 1024 * 1024  # 磁盘缓存上限（字节）
+    AVATAR_MEMORY_ITEMS: int = 512  # 内存中保留的缩略图个数
+    AVATAR_MAX_AGE: int = 86400  # 浏览器缓存时间（秒）
+    # 只用 WebSocket 传输，多个进程共用一个端口（SO_REUSEPORT）时没有粘性会话，长轮询无法工作
+    SOCKETIO_WEBSOCKET_ONLY: bool = field(default_factory=lambda: os.environ.get('SOCKETIO_WEBSOCKET_ONLY') == '1')
+    WS_RECORD_PATH: str = ''  # 录制收到的原始帧，供 bili_ws.py 回放
+    WS_HEARTBEAT_INTERVAL: float = 30.0
+    WS_RECONNECT_MIN: float = 1.0
+    WS_RECONNECT_MAX: float = 60.0
     HEADERS: Dict[str, str] = None
 
     def __post_init__(self):
@@ -26,20 +107,52 @@ class Config:
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                           '(KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        if self.ROOM_IDS is None:
+            self.ROOM_IDS = self._load_room_ids()
+
+    def _load_room_ids(self) -> List[int]:
+        """读取多房间配置"""
+        env_rooms = os.environ.get('ROOM_IDS', '')
+        if env_rooms.strip():
+            return [int(room_id) for room_id in env_rooms.split(',') if room_id.strip()]
+        rooms_file = Path(self.ROOMS_FILE)
+        if rooms_file.exists():
+            return [int(room_id) for room_id in json.loads(rooms_file.read_text(encoding='utf-8'))]
+        return []
+
+    @property
+    def multi_room(self) -> bool:
+        """是否为多房间模式"""
+        return bool(self.ROOM_IDS)
+
+    def room_ids(self) -> List[int]:
+        """需要采集的房间列表，单房间模式沿用环境变量 ROOM_ID"""
+        if self.multi_room:
+            return list(self.ROOM_IDS)
+        return [int(os.environ.get('ROOM_ID', str(self.DEFAULT_ROOM_ID)))]
 
 
 class CustomLogger:
-    """自定义日志处理类"""
+    """自定义日志处理类，低于 level 的消息直接丢弃"""
 
-    def __init__(self, callback: Optional[Callable[[str], None]] = None):
+    def __init__(self, callback: Optional[Callable[[str], None]] = None, level='DEBUG'):
         self.callback = callback
+        self.level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+        if not isinstance(self.level, int):
+            raise ValueError(f"未知的日志级别: {level}")
 
-    def log(self, message: str):
+    def log(self, message: str, level: int = logging.INFO):
         """输出日志消息"""
+        if level < self.level:
+            return
         print(message)  # 保持控制台输出
         if self.callback:
             self.callback(message)
 
+    def debug(self, message: str):
+        """输出逐条弹幕这类高频日志"""
+        self.log(message, logging.DEBUG)
+
 
 class FileManager:
     """文件管理类"""
@@ -48,6 +161,8 @@ class FileManager:
         self.base_path = Path(base_path)
         self.storage_folder = self.base_path / 'danmaku_files'
         self.set_folder = self.base_path / 'time_set'
+        self.search_folder = self.base_path / 'search'
+        self.avatar_folder = self.base_path / 'avatars'
         self.time_file = self.base_path / 'time' / 'time.txt'
         self.counter_file = self.base_path / 'file.txt'
         self.logger = logger or CustomLogger()
@@ -55,6 +170,18 @@ class FileManager:
         # 创建必要的目录
         self._create_directories()
 
+    def for_room(self, room_id: int) -> 'FileManager':
+        """多房间模式下每个房间独立的存储目录"""
+        return FileManager(self.base_path / 'rooms' / str(room_id), logger=self.logger)
+
+    def segment_path(self, date: str, file_counter: int, suffix: str) -> Path:
+        """分段文件路径"""
+        return self.storage_folder / f"danmaku_{date}_{file_counter}{suffix}"
+
+    def list_segments(self) -> List[Path]:
+        """按写入顺序列出所有分段"""
+        return list_segments(self.storage_folder)
+
     def _create_directories(self):
         """创建所需的目录结构"""
         for path in [self.storage_folder, self.set_folder, self.time_file.parent]:
@@ -80,127 +207,1114 @@ class FileManager:
         try:
             with open(self.counter_file, 'w') as f:
                 f.write(f"{file_counter}\n{danmaku_count}")
-            self.logger.log(f"更新计数器文件：文件计数={file_counter}, 弹幕计数={danmaku_count}")
+            self.logger.debug(f"更新计数器文件：文件计数={file_counter}, 弹幕计数={danmaku_count}")
             return file_counter, danmaku_count
         except Exception as e:
             self.logger.log(f"写入计数器文件出错: {e}")
             return 1, 0
 
-    def save_danmaku_set(self, danmaku_set: Set[int]):
-        """保存弹幕集合"""
-        filename = self.set_folder / f"{datetime.now().strftime('%Y-%m-%d')}.txt"
+
+def live_socket_room(room_id: int) -> str:
+    """直播弹幕推送的 Socket.IO 房间名"""
+    return f"room:{room_id}"
+
+
+def replay_socket_room(room_id: int) -> str:
+    """归档回放推送的 Socket.IO 房间名"""
+    return f"replay:{room_id}"
+
+
+def make_dedup_key(timeline: int, uid: int, text: str) -> str:
+    """生成弹幕去重键：时间线 + 用户 + 文本哈希"""
+    return f"{timeline}:{uid}:{zlib.crc32(text.encode('utf-8')):08x}"
+
+
+@lru_cache(maxsize=4096)
+def parse_timeline(timeline: str) -> int:
+    """解析 gethistory 的时间字符串，同一秒的弹幕只解析一次"""
+    return int(time.mktime(time.strptime(timeline, '%Y-%m-%d %H:%M:%S')))
+
+
+class DanmakuRecord:
+    """归一化后的一条弹幕，原始消息只解析一次，后续各阶段都用它"""
+
+    __slots__ = ('timeline', 'time', 'uid', 'nickname', 'text', 'face', 'key', 'tags')
+
+    def __init__(self, timeline: int, time_str: str, uid: int, nickname: str, text: str, face: str):
+        self.timeline = timeline
+        self.time = time_str
+        self.uid = uid
+        self.nickname = nickname
+        self.text = text
+        self.face = face
+        self.key = make_dedup_key(timeline, uid, text)
+        self.tags = ()  # 命中的 tag 类屏蔽词
+
+    @classmethod
+    def from_message(cls, msg: dict) -> 'DanmakuRecord':
+        """从 gethistory 格式的消息构造（WebSocket 采集也转换成这个格式）"""
+        timeline = msg['timeline']
+        if isinstance(timeline, str):
+            # gethistory 的时间字符串与归档格式相同，直接复用
+            time_str, timeline = timeline, parse_timeline(timeline)
+        else:
+            time_str = format_timeline(timeline)
+        user = msg.get('user') or {}
+        return cls(timeline, time_str, msg.get('uid') or user.get('uid', 0), msg['nickname'], msg['text'],
+                   (user.get('base') or {}).get('face', ''))
+
+    def payload(self, room_id: int) -> dict:
+        """推送给前端的数据"""
+        payload = {
+            'id': self.key,
+            'username': self.nickname,
+            'text': self.text,
+            'time': self.time,
+            'avatar': self.face,
+            'room': room_id
+        }
+        if self.tags:
+            payload['tags'] = list(self.tags)
+        return payload
+
+
+class DedupWindow:
+    """有界去重窗口类
+
+    环形缓冲记录键的先后顺序，哈希集合负责查重；只按条数淘汰最早的键。
+    不按时间淘汰：gethistory 总是返回最近 10 条，冷清的房间里这些弹幕可能已是很久以前的，
+    按时间淘汰后下一次轮询会把它们当成新弹幕重复存储。
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._order: deque = deque()
+        self._keys: Set[str] = set()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str) -> bool:
+        """加入新键，已存在时返回 False"""
+        if key in self._keys:
+            return False
+        self._order.append(key)
+        self._keys.add(key)
+        while len(self._order) > self.max_keys:
+            self._keys.discard(self._order.popleft())
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        """按加入顺序遍历窗口内的键"""
+        return iter(self._order)
+
+
+class RecentMessages:
+    """房间最近弹幕的环形缓冲
+
+    每条推送的弹幕带一个游标（实例标识:序号），客户端重连时带上最后收到的游标，
+    只补发之后的部分；游标来自重启前的进程或已被挤出缓冲时补发全部。
+    """
+
+    def __init__(self, size: int):
+        self.epoch = f"{time.time_ns():x}"
+        self._items: deque = deque(maxlen=size)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, payload: dict):
+        """记录一条推送内容，并写入它的游标"""
+        with self._lock:
+            self._seq += 1
+            payload['cursor'] = f"{self.epoch}:{self._seq}"
+            self._items.append(payload)
+
+    def since(self, cursor: Optional[str] = None) -> Tuple[List[dict], str]:
+        """返回游标之后的弹幕和当前最新的游标"""
+        epoch, _, value = (cursor or '').partition(':')
+        seen = int(value) if epoch == self.epoch and value.isdigit() else 0
+        with self._lock:
+            # 序号连续，缓冲里第一条的序号是 _seq - len + 1
+            skip = max(0, seen - (self._seq - len(self._items)))
+            return list(islice(self._items, skip, None)), f"{self.epoch}:{self._seq}"
+
+
+class DedupJournal:
+    """去重日志类
+
+    每天一个 time_set/<日期>.txt，只追加已经落盘的弹幕键，
+    行数膨胀到一定程度后再整体压缩重写，启动时直接读回。
+    压缩只用日志自己记下的键（与去重窗口同样淘汰），不会写进还在写入队列里的弹幕。
+    """
+
+    def __init__(self, config: Config, file_manager: FileManager, logger: Optional[CustomLogger] = None):
+        self.config = config
+        self.folder = file_manager.set_folder
+        self.logger = logger or CustomLogger()
+        self._file = None
+        self._filename: Optional[Path] = None
+        self._lines = 0
+        self._written = DedupWindow(config.DEDUP_WINDOW_SIZE)
+        self._loaded: Tuple[Optional[Path], int] = (None, 0)  # load 读过的文件和行数，打开它追加时接着计数
+
+    def _today_path(self) -> Path:
+        """当天的日志文件路径"""
+        return self.folder / f"{datetime.now().strftime('%Y-%m-%d')}.txt"
+
+    def load(self) -> List[str]:
+        """按写入顺序读取当天已记录的弹幕键"""
+        filename = self._today_path()
+        keys: List[str] = []
+        if not filename.exists():
+            return keys
+        lines = 0
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                for timeline in danmaku_set:
-                    f.write(f"{timeline}\n")
-            self.logger.log(f"已保存弹幕集合到 {filename}")
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    # 旧版只记录时间线，无法还原组合键，直接跳过
+                    if line.count(':') == 2:
+                        keys.append(line)
+                        self._written.add(line)
+                    lines += 1
+            self._loaded = (filename, lines)
+            self.logger.log(f"从 {filename} 加载 {len(keys)} 条弹幕记录")
         except Exception as e:
-            self.logger.log(f"保存弹幕集合出错: {e}")
+            self.logger.log(f"加载弹幕集合出错: {e}")
+        return keys
+
+    def append(self, keys):
+        """追加新弹幕键，跨天时自动切换文件"""
+        if not keys:
+            return
+        filename = self._today_path()
+        if filename != self._filename:
+            self.close()
+            self._file = open(filename, 'a', encoding='utf-8')
+            self._filename = filename
+            self._lines = self._loaded[1] if filename == self._loaded[0] else 0
+        self._file.write(''.join(f"{key}\n" for key in keys))
+        self._lines += len(keys)
+        for key in keys:
+            self._written.add(key)
+
+    def flush(self):
+        """刷盘"""
+        if self._file:
+            self._file.flush()
+
+    def maybe_compact(self):
+        """日志行数远超已落盘的存活键数时压缩重写"""
+        if self._filename is None:
+            return
+        threshold = max(self.config.DEDUP_COMPACT_MIN_LINES,
+                        int(len(self._written) * self.config.DEDUP_COMPACT_RATIO))
+        if self._lines <= threshold:
+            return
+
+        live_keys = list(self._written)
+        filename = self._filename
+        tmp_filename = filename.with_suffix('.tmp')
+        try:
+            self.close()
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                f.write(''.join(f"{key}\n" for key in live_keys))
+            os.replace(tmp_filename, filename)
+            self.logger.log(f"已压缩弹幕集合 {filename}：{len(live_keys)} 条")
+        except Exception as e:
+            self.logger.log(f"压缩弹幕集合出错: {e}")
+        self._file = open(filename, 'a', encoding='utf-8')
+        self._filename = filename
+        self._lines = len(live_keys)
+
+    def close(self):
+        """关闭日志文件"""
+        if self._file:
+            try:
+                self._file.close()
+            except Exception as e:
+                self.logger.log(f"关闭弹幕集合文件出错: {e}")
+            self._file = None
+            self._filename = None
+
+
+class DanmakuWriter:
+    """弹幕后台写入类
+
+    采集线程只负责把弹幕放进有界队列，由独立线程保持分段文件打开，
+    按条数或时间间隔批量写入并刷盘。
+    """
+
+    _STOP = object()
+
+    def __init__(self, config: Config, file_manager: FileManager, journal: DedupJournal,
+                 logger: Optional[CustomLogger] = None, room_id: Optional[int] = None):
+        self.config = config
+        self.file_manager = file_manager
+        self.journal = journal
+        self.logger = logger or CustomLogger()
+        self._write_seconds = metrics.WRITE_BATCH_SECONDS.labels(room_id)
+        self._flush_seconds = metrics.FLUSH_SECONDS.labels(room_id)
+        self._batch_size = metrics.WRITE_BATCH_SIZE.labels(room_id)
+        self.queue: queue.Queue = queue.Queue(maxsize=config.WRITER_QUEUE_SIZE)
+        self.file_counter, self.danmaku_count = self.file_manager.read_counter_file()
+        self.segment_writer_class = SEGMENT_WRITERS[config.ARCHIVE_FORMAT]
+        self.index = ArchiveIndex(file_manager.storage_folder, config.INDEX_EVERY)
+        self.search = SearchIndex(file_manager.search_folder, file_manager.storage_folder,
+                                  config.SEARCH_RUN_SIZE, config.SEARCH_MERGE_FACTOR)
+        self._segment = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动写入线程"""
+        self._thread.start()
+
+    def put(self, record: DanmakuRecord):
+        """放入一条待写入的弹幕，队列满时阻塞"""
+        self.queue.put(record)
+
+    def close(self):
+        """写完队列中剩余的弹幕并关闭文件"""
+        if not self._thread.is_alive():
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        """写入线程主循环"""
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self.search.caught_up:
+                # 全文索引在两批写入之间一小段一小段地补建，写入队列不会因此堆满
+                self._catch_up_search()
+                timeout = 0.0
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                break
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.config.WRITER_FLUSH_INTERVAL
+
+            if pending and (len(pending) >= self.config.WRITER_BATCH_SIZE
+                            or time.monotonic() >= deadline):
+                self._write_batch(pending)
+                pending = []
+                deadline = None
+
+        self._write_batch(pending)
+        self._close_segment()
+        self.journal.close()
+        self.search.close()
+
+    @property
+    def current_path(self) -> Optional[Path]:
+        """正在写入的分段文件，还没写过时为 None"""
+        segment = self._segment
+        return segment.path if segment else None
+
+    def _segment_path(self, date: str) -> Path:
+        """当前分段文件路径"""
+        return self.file_manager.segment_path(date, self.file_counter, self.segment_writer_class.suffix)
+
+    def _catch_up_search(self):
+        """补建一小段全文索引，还没补建到的新弹幕由之后的补建从归档里读到"""
+        try:
+            self.search.catch_up_step(self.config.SEARCH_CATCH_UP_STEP)
+        except Exception as e:
+            self.logger.log(f"补建全文索引出错，跳过补建: {e}")
+            self.search.caught_up = True
+            return
+        if self.search.caught_up and self.search.caught_up_added:
+            self.logger.log(f"全文索引已补建 {self.search.caught_up_added} 条弹幕")
+
+    def _write_batch(self, batch):
+        """批量写入弹幕，按 MAX_DANMAKU_PER_FILE 轮换文件"""
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            date = datetime.now().strftime('%Y-%m-%d')  # 一批只取一次日期
+            for record in batch:
+                filename = self._segment_path(date)
+                if self._segment is None or filename != self._segment.path:
+                    self._close_segment()
+                    # 先登记再写入，查询线程在锁外补建旧分段索引时不会和新写入的内容混在一起
+                    self.index.track(filename)
+                    self._segment = self.segment_writer_class(filename)
+                offset = self._segment.write(record.timeline, record.uid, record.nickname, record.text, record.face)
+                self.index.record(self._segment.path, record.timeline, offset)
+                if self.search.caught_up:
+                    self.search.add(self._segment.path, offset, record.text)
+
+                self.danmaku_count += 1
+                if self.danmaku_count % self.config.MAX_DANMAKU_PER_FILE == 0:
+                    self.file_counter += 1
+            with self._flush_seconds.time():
+                self._segment.flush()
+                self.index.flush()
+                self.search.flush()
+
+                # 弹幕落盘之后再记录去重键，崩溃时宁可重复也不丢
+                self.journal.append([record.key for record in batch])
+                self.journal.flush()
+            self.journal.maybe_compact()
+
+            self.file_manager._write_counter_file(self.file_counter, self.danmaku_count)
+        except Exception as e:
+            self.logger.log(f"批量保存弹幕出错: {e}")
+        self._write_seconds.observe(time.perf_counter() - started)
+        self._batch_size.observe(len(batch))
+
+    def _close_segment(self):
+        """关闭当前分段文件"""
+        if self._segment:
+            try:
+                self._segment.close()
+            except Exception as e:
+                self.logger.log(f"关闭弹幕文件出错: {e}")
+            self._segment = None
+
+
+class BatchEmitter:
+    """弹幕批量推送类
+
+    在一个 tick 内按 Socket.IO 房间收集弹幕，到点后每个房间只发送一次
+    danmaku_batch 事件（内容为弹幕数组），减少序列化次数和 WebSocket 帧数。
+    socketio 也可以是 DeliveryHub，由它按客户端排队投递。
+    """
+
+    def __init__(self, socketio: Union['SocketIO', 'DeliveryHub'], config: Config, logger: Optional[CustomLogger] = None):
+        self.socketio = socketio
+        self.interval = config.EMIT_BATCH_INTERVAL
+        self.logger = logger or CustomLogger()
+        self._pending: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动推送线程"""
+        if self.interval > 0 and not self._thread.is_alive():
+            self._thread.start()
+
+    def stop(self):
+        """停止推送线程并发出剩余弹幕"""
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def emit(self, payload: dict, room: str):
+        """加入待推送队列，未开启合并时直接发送"""
+        if self.interval <= 0:
+            self.socketio.emit('danmaku', payload, to=room)
+            return
+        with self._lock:
+            self._pending.setdefault(room, []).append(payload)
+
+    def flush(self):
+        """发出所有房间的待推送弹幕"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with metrics.EMIT_FLUSH_SECONDS.labels().time():
+            for room, batch in pending.items():
+                try:
+                    self.socketio.emit('danmaku_batch', batch, to=room)
+                except Exception as e:
+                    self.logger.log(f"推送弹幕出错: {e}")
+
+    def pending_count(self) -> int:
+        """等待推送的弹幕条数"""
+        with self._lock:
+            return sum(len(batch) for batch in self._pending.values())
+
+    def _run(self):
+        """按固定间隔推送"""
+        while not self._stop_event.wait(self.interval):
+            self.flush()
+
+
+class AdaptivePollInterval:
+    """自适应轮询间隔类
+
+    用指数滑动平均估计新弹幕速率，让每次轮询时历史接口缓冲大约填到
+    POLL_TARGET_FILL；返回满 HISTORY_CAPACITY 条且没有任何见过的弹幕说明中间可能漏了，
+    立即收紧间隔并估算丢失条数；房间空闲或出错时指数退避。
+
+    轮询得到的新弹幕数被 HISTORY_CAPACITY 封顶，恰恰在跟不上时低估速率，不能用来估算丢失。
+    估算改用弹幕自带的时间线：连续疑似漏弹幕的一段（从上一次有重叠的轮询起）累计
+    各批内相邻弹幕的条数和时间线跨度，比值就是不受封顶影响的弹幕密度，秒级精度的误差在多批之间抵消；
+    这一段丢失条数约为 密度 × 时间线前进的秒数 - 这一段拿到的条数。
+    这一段跨度累计不到一秒时改用全部轮询的长期密度，再没有时退回按轮询速率估算。
+    """
+
+    ALPHA = 0.3
+    DENSITY_DECAY = 0.99  # 长期密度累加的衰减系数，约以最近 100 批为准
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.interval = config.POLL_INTERVAL
+        self.rate = 0.0  # 每秒新弹幕数
+        self.polls = 0
+        self.errors = 0
+        self.gaps = 0
+        self.last_latency = 0.0
+        self._last_poll: Optional[float] = None
+        self._newest: Optional[int] = None  # 见过的最新时间线
+        self._density = [0.0, 0.0]  # 长期的（相邻弹幕条数, 时间线跨度）
+        self._episode: Optional[List[float]] = None  # 进行中的一段：（相邻条数, 跨度, 前进秒数, 拿到条数）
+        self._lost = 0.0  # 已结束各段的估算丢失条数
+
+    @property
+    def estimated_lost(self) -> float:
+        return self._lost + (self._episode_lost() if self._episode else 0.0)
+
+    def update(self, returned: int, new: int, latency: float, span: Optional[Tuple[int, int]] = None) -> float:
+        """根据本次轮询结果计算下次间隔，span 为本批弹幕的（最早, 最晚）时间线"""
+        now = time.monotonic()
+        elapsed = now - self._last_poll if self._last_poll is not None else self.interval
+        self._last_poll = now
+        self.last_latency = latency
+
+        current_rate = new / max(elapsed, 1e-3)
+        self.rate = current_rate if self.polls == 0 else self.ALPHA * current_rate + (1 - self.ALPHA) * self.rate
+        gap = self.polls > 0 and returned >= self.config.HISTORY_CAPACITY and new == returned
+        self.polls += 1
+        pairs, width = (returned - 1, span[1] - span[0]) if span is not None and returned > 1 else (0, 0)
+        self._density = [self._density[0] * self.DENSITY_DECAY + pairs, self._density[1] * self.DENSITY_DECAY + width]
+
+        if gap:
+            self.gaps += 1
+            covered = max(span[1] - self._newest, 0) if span is not None and self._newest is not None else elapsed
+            episode = self._episode or [0.0, 0.0, 0.0, 0.0]
+            self._episode = [episode[0] + pairs, episode[1] + width, episode[2] + covered, episode[3] + returned]
+            self.interval = self.interval / self.config.POLL_BACKOFF
+        else:
+            if self._episode:
+                self._lost += self._episode_lost()
+                self._episode = None
+            if new == 0:
+                self.interval = self.interval * self.config.POLL_BACKOFF
+            else:
+                self.interval = self.config.HISTORY_CAPACITY * self.config.POLL_TARGET_FILL / self.rate
+        self.interval = min(self.config.POLL_MAX_INTERVAL, max(self.config.POLL_MIN_INTERVAL, self.interval))
+        if span is not None:
+            self._newest = span[1] if self._newest is None else max(self._newest, span[1])
+        return self.interval
+
+    def _episode_lost(self) -> float:
+        """估算进行中这一段疑似漏弹幕丢了多少条"""
+        pairs, width, covered, returned = self._episode
+        if width >= 1:
+            density = pairs / width
+        elif self._density[1] >= 1:
+            density = self._density[0] / self._density[1]
+        else:
+            density = self.rate
+        return max(0.0, density * covered - returned)
+
+    def fail(self) -> float:
+        """轮询出错时退避"""
+        self.errors += 1
+        self.interval = min(self.config.POLL_MAX_INTERVAL, self.interval * self.config.POLL_BACKOFF)
+        return self.interval
+
+    def stats(self) -> Dict[str, float]:
+        """轮询统计"""
+        return {
+            'interval': round(self.interval, 3),
+            'rate_per_minute': round(self.rate * 60, 2),
+            'polls': self.polls,
+            'errors': self.errors,
+            'gaps': self.gaps,
+            'estimated_lost': round(self.estimated_lost),
+            'last_latency': round(self.last_latency, 4),
+        }
 
 
 class DanmakuManager:
     """弹幕管理类"""
 
-    def __init__(self, config: Config, file_manager: FileManager, socketio: SocketIO,
-                 logger: Optional[CustomLogger] = None):
+    def __init__(self, config: Config, file_manager: FileManager, socketio: Optional['SocketIO'],
+                 logger: Optional[CustomLogger] = None, room_id: Optional[int] = None,
+                 session: Optional[requests.Session] = None, emitter: Optional[BatchEmitter] = None,
+                 keyword_filter: Optional[KeywordFilter] = None):
         self.config = config
         self.file_manager = file_manager
         self.socketio = socketio
         self.logger = logger or CustomLogger()
-        self.room_id = int(os.environ.get('ROOM_ID', str(config.DEFAULT_ROOM_ID)))
-        self.danmaku_set: Set[int] = set()
-        self.file_counter, self.danmaku_count = self.file_manager.read_counter_file()
+        self.room_id = room_id or int(os.environ.get('ROOM_ID', str(config.DEFAULT_ROOM_ID)))
+        self.socket_room = live_socket_room(self.room_id)
+        self.session = session or requests.Session()
+        self.poll_interval = AdaptivePollInterval(config)
+        self.ws_client: Optional['LiveWebSocketClient'] = None
+        # 未传入共享的推送器时自己创建一个，并随自身启停；socketio 为 None 时（无界面采集）只存档不推送
+        self._owns_emitter = emitter is None and socketio is not None
+        self.emitter = emitter or (BatchEmitter(socketio, config, logger=self.logger) if socketio is not None else None)
+        self.journal = DedupJournal(config, file_manager, logger=self.logger)
+        self.dedup = DedupWindow(config.DEDUP_WINDOW_SIZE)
+        for key in self.journal.load():
+            self.dedup.add(key)
+        self.writer = DanmakuWriter(config, file_manager, self.journal, logger=self.logger,
+                                    room_id=self.room_id)
+        self.analytics = RoomAnalytics(config.STATS_WINDOW_MINUTES, config.STATS_TOP_K)
+        self.recent = (RecentMessages(config.RECENT_BUFFER_SIZE)
+                       if config.RECENT_BUFFER_SIZE > 0 and self.emitter is not None else None)
+        self.keyword_filter = keyword_filter
+        # 指标子项按房间缓存，热路径上不再查标签
+        self._poll_seconds = metrics.POLL_SECONDS.labels(self.room_id)
+        self._json_seconds = metrics.JSON_DECODE_SECONDS.labels(self.room_id)
+        self._poll_errors = metrics.POLL_ERRORS.labels(self.room_id)
+        self._new_messages = metrics.MESSAGES.labels(self.room_id, 'new')
+        self._duplicate_messages = metrics.MESSAGES.labels(self.room_id, 'duplicate')
+        self._dedup_seconds = metrics.DEDUP_SECONDS.labels(self.room_id)
+        self._store_seconds = metrics.STORE_SECONDS.labels(self.room_id)
+        self._emit_seconds = metrics.EMIT_SECONDS.labels(self.room_id)
+        self._filter_seconds = metrics.FILTER_SECONDS.labels(self.room_id)
+        self._filter_actions = {action: metrics.FILTER_ACTIONS.labels(self.room_id, action)
+                                for action in ('drop', 'mask', 'tag')}
         self.logger.log(f"初始化弹幕管理器，房间ID: {self.room_id}")
 
+    @property
+    def polling(self) -> bool:
+        """是否通过轮询 gethistory 采集"""
+        return self.config.INGEST_BACKEND != 'ws'
+
     def start(self):
-        """启动弹幕处理"""
-        threading.Thread(target=self._handle_danmaku, daemon=True).start()
+        """启动弹幕处理，轮询模式由 RoomScheduler 驱动"""
+        self.writer.start()
+        if self._owns_emitter:
+            self.emitter.start()
+        if not self.polling:
+            from bili_ws import LiveWebSocketClient
+            self.ws_client = LiveWebSocketClient(self.room_id, self._process_single_danmaku, self.config,
+                                                 session=self.session, logger=self.logger,
+                                                 record_path=self.config.WS_RECORD_PATH)
+            self.ws_client.start()
         self.logger.log(f"开始监听房间 {self.room_id} 的弹幕")
 
-    def _handle_danmaku(self):
-        """处理弹幕的主循环"""
-        while True:
-            try:
-                self._fetch_and_process_danmaku()
-                self.logger.log("少女读取中......")
-                time.sleep(5)
-            except Exception as e:
-                self.logger.log(f"弹幕处理出错: {e}")
-                time.sleep(10)
+    def stop(self):
+        """停止弹幕处理并刷完待写入的弹幕"""
+        if self.ws_client:
+            self.ws_client.stop()
+        self.writer.close()
+        if self._owns_emitter:
+            self.emitter.stop()
+        self.logger.log(f"已停止监听房间 {self.room_id} 的弹幕")
 
-    def _fetch_and_process_danmaku(self):
-        """获取并处理弹幕"""
+    def status(self) -> dict:
+        """运行状态，直接读内存里的计数，供同进程的图形界面显示"""
+        current_path = self.writer.current_path
+        return {
+            'room': self.room_id,
+            'saved': self.writer.danmaku_count,
+            'file': current_path.name if current_path else None,
+            'queue_depth': self.writer.queue.qsize(),
+            'poll_latency': self.poll_interval.last_latency,
+            'poll_interval': self.poll_interval.interval,
+            'poll_errors': self.poll_interval.errors,
+        }
+
+    def poll_once(self) -> float:
+        """轮询一次，返回距下次轮询的秒数"""
+        started = time.perf_counter()
+        try:
+            returned, new, span = self._fetch_and_process_danmaku()
+            self.logger.debug("少女读取中......")
+            return self.poll_interval.update(returned, new, time.perf_counter() - started, span)
+        except Exception as e:
+            self._poll_errors.inc()
+            self.logger.log(f"房间 {self.room_id} 弹幕处理出错: {e}")
+            return self.poll_interval.fail()
+
+    def _fetch_and_process_danmaku(self) -> tuple[int, int, Optional[Tuple[int, int]]]:
+        """获取并处理弹幕，返回（本次返回条数, 新弹幕条数, 本批（最早, 最晚）时间线）"""
         url = f"{self.config.BILIBILI_API_BASE}/xlive/web-room/v1/dM/gethistory"
         params = {'roomid': self.room_id, 'csrf_token': ''}
 
-        response = requests.get(url, params=params, headers=self.config.HEADERS)
-        data = response.json()
+        with self._poll_seconds.time():
+            response = self.session.get(url, params=params, headers=self.config.HEADERS,
+                                        timeout=self.config.POLL_TIMEOUT)
+        with self._json_seconds.time():
+            data = response.json()
 
-        if data['code'] == 0:
-            for msg in data['data']['room']:
-                self._process_single_danmaku(msg)
+        if data['code'] != 0:
+            raise ValueError(f"接口返回错误码 {data['code']}: {data.get('message')}")
+        records = [DanmakuRecord.from_message(msg) for msg in data['data']['room']]
+        new = sum(1 for record in records if self._process_record(record))
+        timelines = [record.timeline for record in records]
+        return len(records), new, (min(timelines), max(timelines)) if timelines else None
 
-    def _process_single_danmaku(self, msg):
-        """处理单条弹幕"""
-        timeline = self._parse_timeline(msg['timeline'])
-        if timeline not in self.danmaku_set:
-            self.danmaku_set.add(timeline)
-            self._store_danmaku(msg, timeline)
-            self._emit_danmaku(msg, timeline)
+    def _process_single_danmaku(self, msg) -> bool:
+        """处理单条弹幕，返回是否为新弹幕"""
+        return self._process_record(DanmakuRecord.from_message(msg))
 
-    def _parse_timeline(self, timeline) -> int:
-        """解析时间戳"""
-        if isinstance(timeline, str):
-            return int(time.mktime(time.strptime(timeline, '%Y-%m-%d %H:%M:%S')))
-        return timeline
+    def _process_record(self, record: DanmakuRecord) -> bool:
+        started = time.perf_counter()
+        is_new = self.dedup.add(record.key)
+        self._dedup_seconds.observe(time.perf_counter() - started)
+        if not is_new:
+            self._duplicate_messages.inc()
+            return False
+        self._new_messages.inc()
+        # 去重之后再过滤，重复的弹幕不必再扫一遍
+        if self.keyword_filter and not self._filter_danmaku(record):
+            return True
+        stored = time.perf_counter()
+        self._store_danmaku(record)
+        emitted = time.perf_counter()
+        self._store_seconds.observe(emitted - stored)
+        if self.emitter is not None:
+            self._emit_danmaku(record)
+            self._emit_seconds.observe(time.perf_counter() - emitted)
+        self.analytics.add(record)
+        return True
+
+    def _filter_danmaku(self, record: DanmakuRecord) -> bool:
+        """屏蔽词过滤，打码直接改写内容，返回是否保留"""
+        started = time.perf_counter()
+        text, tags, _ = self.keyword_filter.check(record.text)
+        self._filter_seconds.observe(time.perf_counter() - started)
+        if text is None:
+            self._filter_actions['drop'].inc()
+            if self.logger.level <= logging.DEBUG:
+                self.logger.debug(f"屏蔽弹幕: [{record.time}] {record.nickname}: {record.text}")
+            return False
+        if text is not record.text:
+            record.text = text
+            self._filter_actions['mask'].inc()
+        if tags:
+            record.tags = tags
+            self._filter_actions['tag'].inc()
+        return True
 
-    def _store_danmaku(self, msg, timeline):
+    def _store_danmaku(self, record: DanmakuRecord):
         """存储弹幕"""
-        timeline_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeline))
-        danmaku_text = f"[{timeline_str}] {msg['nickname']}: {msg['text']}"
+        self.writer.put(record)
+        if self.logger.level <= logging.DEBUG:
+            self.logger.debug(f"已保存弹幕: [{record.time}] {record.nickname}: {record.text}")
 
-        filename = self.file_manager.storage_folder / f"danmaku_{datetime.now().strftime('%Y-%m-%d')}_{self.file_counter}.txt"
+    def _emit_danmaku(self, record: DanmakuRecord):
+        """发送弹幕到客户端"""
+        payload = record.payload(self.room_id)
+        if self.config.AVATAR_PROXY:
+            payload['avatar'] = proxied_avatar_url(record.face, self.config.AVATAR_UPSTREAM)
+        if self.recent is not None:
+            self.recent.append(payload)
+        self.emitter.emit(payload, self.socket_room)
 
-        try:
-            with open(filename, 'a', encoding='utf-8') as f:
-                f.write(f"{danmaku_text}\n")
 
-            self.danmaku_count += 1
-            if self.danmaku_count % self.config.MAX_DANMAKU_PER_FILE == 0:
-                self.file_counter += 1
+class ReplaySource:
+    """归档回放类
 
-            self.file_manager._write_counter_file(self.file_counter, self.danmaku_count)
-            self.file_manager.save_danmaku_set(self.danmaku_set)
+    通过稀疏索引从指定时间流式读取归档，按原始的相对时间（可加速）重新推送，
+    推送到 replay:<房间号>，和直播弹幕共用批量推送器。同一秒内的多条弹幕在这一秒内均匀铺开。
+    """
 
-            self.logger.log(f"已保存弹幕: {danmaku_text}")
+    def __init__(self, manager: DanmakuManager, logger: Optional[CustomLogger] = None):
+        self.manager = manager
+        self.logger = logger or CustomLogger()
+        self.socket_room = replay_socket_room(manager.room_id)
+        self.speed = 1.0
+        self.start_timeline = 0
+        self.end_timeline = 0
+        self.position: Optional[int] = None
+        self.emitted = 0
+        self._generation = 0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def play(self, start: int, end: int, speed: float = 1.0):
+        """从 start 开始回放到 end，已在回放时先停止"""
+        if speed <= 0:
+            raise ValueError("speed 必须大于 0")
+        with self._lock:
+            self._stop_locked()
+            self._generation += 1
+            self.start_timeline, self.end_timeline, self.speed = start, end, speed
+            self.position = None
+            self.emitted = 0
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._generation, self._stop_event),
+                                            daemon=True)
+            self._thread.start()
+        self.logger.log(f"房间 {self.manager.room_id} 开始回放: {format_timeline(start)} 起，{speed} 倍速")
+
+    def seek(self, timeline: int):
+        """跳到指定时间继续回放，速度和结束时间不变；还没开始过回放时与 /replay/start 一样回放到当前时间"""
+        with self._lock:
+            end = self.end_timeline if self._generation else int(time.time())
+        self.play(timeline, end, self.speed)
+
+    def stop(self):
+        """停止回放"""
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def status(self) -> dict:
+        return {
+            'running': self.running,
+            'from': self.start_timeline,
+            'to': self.end_timeline,
+            'speed': self.speed,
+            'position': self.position,
+            'emitted': self.emitted,
+        }
+
+    def _run(self, generation: int, stop_event: threading.Event):
+        """回放线程，按墙钟时间对齐每条弹幕的发送时刻"""
+        started = time.monotonic()
+        base = None  # 从第一条弹幕开始计时，跳过起点之前的空白
+        records = self.manager.writer.index.query(self.start_timeline, self.end_timeline, sys.maxsize)
+        try:
+            for timeline, group in groupby(records, key=lambda record: record.timeline):
+                group = list(group)
+                if base is None:
+                    base = timeline
+                for i, record in enumerate(group):
+                    relative = timeline - base + i / len(group)
+                    delay = started + relative / self.speed - time.monotonic()
+                    if delay > 0 and stop_event.wait(delay):
+                        return
+                    if stop_event.is_set():
+                        return
+                    self.manager.emitter.emit({
+                        'id': f"replay{generation}:{make_dedup_key(record.timeline, record.uid, record.text)}",
+                        'username': record.nickname,
+                        'text': record.text,
+                        'time': format_timeline(record.timeline),
+                        'avatar': (proxied_avatar_url(record.face, self.manager.config.AVATAR_UPSTREAM)
+                                   if self.manager.config.AVATAR_PROXY else record.face),
+                        'room': self.manager.room_id,
+                        'replay': True,
+                    }, self.socket_room)
+                    self.emitted += 1
+                self.position = timeline
+            self.logger.log(f"房间 {self.manager.room_id} 回放结束，共 {self.emitted} 条")
         except Exception as e:
-            self.logger.log(f"保存弹幕出错: {e}")
+            self.logger.log(f"房间 {self.manager.room_id} 回放出错: {e}")
 
-    def _emit_danmaku(self, msg, timeline):
-        """发送弹幕到客户端"""
-        timeline_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timeline))
-        self.socketio.emit('danmaku', {
-            'username': msg['nickname'],
-            'text': msg['text'],
-            'time': timeline_str,
-            'avatar': msg['user']['base']['face']
-        })
 
+class StatsPusher:
+    """定时把各房间的实时统计作为 stats 事件推送给订阅该房间的客户端"""
+
+    def __init__(self, socketio: Union['SocketIO', 'DeliveryHub'], config: Config, managers: List[DanmakuManager],
+                 logger: Optional[CustomLogger] = None):
+        self.socketio = socketio
+        self.interval = config.STATS_PUSH_INTERVAL
+        self.managers = managers
+        self.logger = logger or CustomLogger()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            for manager in self.managers:
+                try:
+                    stats = manager.analytics.snapshot()
+                    stats['room'] = manager.room_id
+                    self.socketio.emit('stats', stats, to=manager.socket_room)
+                except Exception as e:
+                    self.logger.log(f"推送统计出错: {e}")
+
+
+class RoomScheduler:
+    """多房间轮询调度类
+
+    所有房间共用一个 requests.Session 连接池，
+    由调度线程把到期的房间交给线程池并发轮询。
+    """
+
+    def __init__(self, config: Config, managers: List[DanmakuManager], logger: Optional[CustomLogger] = None):
+        self.config = config
+        self.managers = managers
+        self.logger = logger or CustomLogger()
+        self.session = requests.Session()
+        self.session.headers.update(config.HEADERS)
+        # 长连接复用，避免每次轮询都重新握手 TLS
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.POLL_WORKERS, pool_block=False)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        for manager in managers:
+            manager.session = self.session
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(config.POLL_WORKERS, len(managers))),
+                                           thread_name_prefix='danmaku-poll')
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动所有房间并开始调度"""
+        for manager in self.managers:
+            manager.start()
+        self._thread.start()
+
+    def stop(self):
+        """停止调度，等待进行中的轮询结束后刷完所有房间的写入队列"""
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.executor.shutdown(wait=True)
+        for manager in self.managers:
+            manager.stop()
+        self.session.close()
+
+    def _run(self):
+        """调度主循环"""
+        polled = [manager for manager in self.managers if manager.polling]
+        next_poll = {manager.room_id: 0.0 for manager in polled}
+        in_flight = {}
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for manager in polled:
+                if manager.room_id not in in_flight and next_poll[manager.room_id] <= now:
+                    in_flight[manager.room_id] = self.executor.submit(manager.poll_once)
+
+            idle = [next_poll[room_id] - now for room_id in next_poll if room_id not in in_flight]
+            timeout = max(0.05, min(idle)) if idle else 1.0
+            if in_flight:
+                wait(list(in_flight.values()), timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                self._stop_event.wait(timeout)
+
+            now = time.monotonic()
+            for room_id, future in list(in_flight.items()):
+                if future.done():
+                    next_poll[room_id] = now + future.result()
+                    del in_flight[room_id]
+
+
+def parse_time_param(value: str) -> int:
+    """解析查询参数里的时间：时间戳、YYYY-MM-DD HH:MM[:SS] 或当天的 HH:MM[:SS]"""
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            pass
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            parsed = datetime.strptime(value, fmt).time()
+            return int(datetime.combine(datetime.now().date(), parsed).timestamp())
+        except ValueError:
+            pass
+    raise ValueError(f"无法解析时间: {value}")
+
+
+def parse_limit(value: Optional[str], default: int, maximum: int) -> int:
+    """解析查询参数里的条数上限，超过 maximum 时取 maximum，小于 1 视为参数错误"""
+    limit = int(value) if value is not None else default
+    if limit < 1:
+        raise ValueError(f"limit 必须大于 0: {limit}")
+    return min(limit, maximum)
+
+
+def register_api_routes(app: 'Flask', config: Config, managers: List[DanmakuManager],
+                        replays: Dict[int, ReplaySource]):
+    """注册读取归档和采集状态的接口，只在负责采集的进程里提供"""
+    from flask import Response, jsonify, request
+
+    @app.route('/history')
+    def get_history():
+        # /history?from=20:00&to=20:15&limit=500&room=<房间号>，逐行返回 JSON（NDJSON）
+        try:
+            start = parse_time_param(request.args.get('from', '0'))
+            end = parse_time_param(request.args['to']) if 'to' in request.args else int(time.time())
+            limit = parse_limit(request.args.get('limit'), 1000, config.HISTORY_MAX_LIMIT)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        room = request.args.get('room')
+        targets = [manager for manager in managers if room is None or str(manager.room_id) == room]
+        if not targets:
+            return jsonify({'error': f"未知房间: {room}"}), 404
+
+        def generate():
+            remaining = limit
+            for manager in targets:
+                for record in manager.writer.index.query(start, end, remaining):
+                    yield json.dumps({
+                        'room': manager.room_id,
+                        'timeline': record.timeline,
+                        'time': format_timeline(record.timeline),
+                        'uid': record.uid,
+                        'username': record.nickname,
+                        'text': record.text,
+                        'avatar': record.face,
+                    }, ensure_ascii=False) + '\n'
+                    remaining -= 1
+                if remaining <= 0:
+                    break
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    @app.route('/search')
+    def search_danmaku():
+        # /search?q=关键词&limit=100&room=<房间号>，从新到旧返回包含关键词的弹幕
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': '缺少参数 q'}), 400
+        try:
+            limit = parse_limit(request.args.get('limit'), 100, config.SEARCH_MAX_LIMIT)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        room = request.args.get('room')
+        needle = query.casefold()
+        results = []
+        for manager in managers:
+            if room is not None and str(manager.room_id) != room:
+                continue
+            found = 0
+            # 候选从新到旧逐条读出，本房间核对到 limit 条就停，不再读更旧的倒排项
+            with closing(manager.writer.search.candidates(query)) as candidates:
+                for path, offset in candidates:
+                    record = manager.writer.index.read_at(path, offset)
+                    # 二元组命中不代表连续出现，回到原文核对
+                    if record is None or needle not in record.text.casefold():
+                        continue
+                    results.append({
+                        'room': manager.room_id,
+                        'timeline': record.timeline,
+                        'time': format_timeline(record.timeline),
+                        'uid': record.uid,
+                        'username': record.nickname,
+                        'text': record.text,
+                        'avatar': record.face,
+                    })
+                    found += 1
+                    if found >= limit:
+                        break
+        results.sort(key=lambda item: item['timeline'], reverse=True)
+        return jsonify({'query': query, 'results': results[:limit]})
+
+    def _replay_targets() -> List[ReplaySource]:
+        room = request.values.get('room')
+        return [replay for room_id, replay in replays.items() if room is None or str(room_id) == room]
+
+    @app.route('/replay/start', methods=['POST'])
+    def start_replay():
+        # /replay/start?from=20:00&to=21:00&speed=10&room=<房间号>，覆盖层地址加 ?replay=1 接收
+        try:
+            start = parse_time_param(request.values['from'])
+            end = parse_time_param(request.values['to']) if 'to' in request.values else int(time.time())
+            speed = float(request.values.get('speed', 1.0))
+            targets = _replay_targets()
+            for replay in targets:
+                replay.play(start, end, speed)
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': f"参数错误: {e}"}), 400
+        return jsonify({str(replay.manager.room_id): replay.status() for replay in targets})
+
+    @app.route('/replay/seek', methods=['POST'])
+    def seek_replay():
+        try:
+            timeline = parse_time_param(request.values['at'])
+        except (KeyError, ValueError) as e:
+            return jsonify({'error': f"参数错误: {e}"}), 400
+        targets = _replay_targets()
+        for replay in targets:
+            replay.seek(timeline)
+        return jsonify({str(replay.manager.room_id): replay.status() for replay in targets})
+
+    @app.route('/replay/stop', methods=['POST'])
+    def stop_replay():
+        targets = _replay_targets()
+        for replay in targets:
+            replay.stop()
+        return jsonify({str(replay.manager.room_id): replay.status() for replay in targets})
+
+    @app.route('/replay/status')
+    def get_replay_status():
+        return jsonify({str(replay.manager.room_id): replay.status() for replay in _replay_targets()})
+
+    @app.route('/stats')
+    def get_stats():
+        # /stats?room=<房间号>，每个房间的分钟弹幕数、独立发言人数（估算）、热词和话痨榜
+        room = request.args.get('room')
+        return jsonify({str(manager.room_id): manager.analytics.snapshot()
+                        for manager in managers if room is None or str(manager.room_id) == room})
+
+    @app.route('/poll-stats')
+    def get_poll_stats():
+        return jsonify({str(manager.room_id): manager.poll_interval.stats() for manager in managers})
+
+
+def _delivery_backlog(clients: List[dict]) -> Dict[Tuple[str, ...], float]:
+    return {
+        ('pending_messages',): sum(client['pending_messages'] for client in clients),
+        ('max_lag_seconds',): max((client['lag_seconds'] for client in clients), default=0.0),
+    }
+
+
+def create_app(log_callback: Optional[Callable[[str], None]] = None, role: str = 'all') -> tuple['Flask', 'SocketIO']:
+    """创建Flask应用
+
+    role 为 all 时采集和服务前端都在本进程；collector 只采集并经消息队列推送（同时提供接口），
+    web 不采集，只从消息队列接收推送并服务前端，可以起多个；最近弹幕缓冲在采集进程里，
+    web 进程连接时不发送 danmaku_snapshot，断线重连也不按 since 补发。
+    """
+    if role not in ('all', 'collector', 'web'):
+        raise ValueError(f"未知的进程角色: {role}")
+    from flask import Flask, Response, redirect, render_template, jsonify, request
+    from flask_socketio import SocketIO, join_room
+    from delivery import DeliveryHub
+    from fanout_queue import make_client_manager
 
-def create_app(log_callback: Optional[Callable[[str], None]] = None) -> tuple[Flask, SocketIO]:
-    """创建Flask应用"""
     app = Flask(__name__)
     config = Config()
     app.config['SECRET_KEY'] = config.SECRET_KEY
 
-    socketio = SocketIO(app, async_mode='threading')
-    logger = CustomLogger(log_callback)
+    socketio_options = {}
+    if config.SOCKETIO_MESSAGE_QUEUE:
+        socketio_options['client_manager'] = make_client_manager(
+            config.SOCKETIO_MESSAGE_QUEUE, config.SOCKETIO_CHANNEL, write_only=role == 'collector')
+    transports = ['websocket'] if config.SOCKETIO_WEBSOCKET_ONLY else ['polling', 'websocket']
+    socketio = SocketIO(app, async_mode=config.ASYNC_MODE, transports=transports, **socketio_options)
+    logger = CustomLogger(log_callback, config.LOG_LEVEL)
     file_manager = FileManager(logger=logger)
-    danmaku_manager = DanmakuManager(config, file_manager, socketio, logger=logger)
+    # 客户端连在本进程、推送也在本进程时，按客户端排队投递；多进程时推送经消息队列转发，由各 Web 进程发出
+    delivery = None
+    if role == 'all' and config.DELIVERY_QUEUE_SIZE > 0 and not config.SOCKETIO_MESSAGE_QUEUE:
+        delivery = DeliveryHub(socketio, config.DELIVERY_QUEUE_SIZE, config.DELIVERY_POLICY,
+                               config.DELIVERY_COLLAPSE_KEEP, config.DELIVERY_MAX_IN_FLIGHT, logger=logger)
 
     @app.route('/')
     def index():
-        return render_template('index.html')
+        return render_template('index.html', transports=transports)
 
     @app.route('/start-time')
     def get_start_time():
@@ -211,20 +1325,193 @@ def create_app(log_callback: Optional[Callable[[str], None]] = None) -> tuple[Fl
             start_time = float(file_manager.time_file.read_text().strip())
         return jsonify({'start_time': start_time})
 
+    avatar_cache = AvatarCache(file_manager.avatar_folder, config.AVATAR_UPSTREAM, config.AVATAR_SIZE,
+                               config.AVATAR_CACHE_BYTES, config.AVATAR_MEMORY_ITEMS, config.POLL_TIMEOUT,
+                               logger=logger)
+    metrics.REGISTRY.gauge_func('danmaku_avatar_cache', '头像缓存命中、回源、出错次数和缓存占用', ['kind'],
+                                lambda: {(kind,): value for kind, value in avatar_cache.stats().items()})
+
+    @app.route('/avatar/<path:name>')
+    def get_avatar(name):
+        if not AVATAR_NAME.match(name):
+            return jsonify({'error': '头像不存在'}), 404
+        cached = avatar_cache.get(name)
+        if cached is None:
+            return redirect(config.AVATAR_UPSTREAM + name)  # 上游出错时退回原图
+        data, etag = cached
+        response = Response(data, content_type=sniff_content_type(data))
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = config.AVATAR_MAX_AGE
+        return response.make_conditional(request)
+
+    @app.route('/metrics')
+    def get_metrics():
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    @app.route('/clients')
+    def get_clients():
+        # 每个客户端的积压和延迟，未启用逐客户端队列时 clients 为空
+        return jsonify({
+            'policy': config.DELIVERY_POLICY if delivery else None,
+            'clients': delivery.stats() if delivery else [],
+        })
+
+    recent_buffers: Dict[int, RecentMessages] = {}  # 采集组件创建后填入，Web 进程里为空
+
     @socketio.on('connect')
-    def handle_connect():
-        logger.log('客户端已连接')
+    def handle_connect(auth=None):
+        # 带 ?room=<房间号> 的客户端只订阅该房间，否则订阅全部房间；带 ?replay=1 时改为接收回放
+        room = request.args.get('room')
+        replay = request.args.get('replay') == '1'
+        subscribed = [room_id for room_id in config.room_ids() if room is None or str(room_id) == room]
+        for room_id in subscribed:
+            join_room(replay_socket_room(room_id) if replay else live_socket_room(room_id))
+        if delivery:
+            delivery.register(request.sid)
+        if not replay and recent_buffers:
+            send_snapshot(subscribed, auth.get('since') if isinstance(auth, dict) else None)
+        metrics.CONNECTED_CLIENTS.labels().inc()
+        logger.log(f'客户端已连接，订阅{"回放" if replay else "房间"}: {subscribed}')
+
+    def send_snapshot(room_ids: List[int], since):
+        """把订阅房间里客户端还没收到的最近弹幕作为一个 danmaku_snapshot 事件发给它，只读内存"""
+        since = since if isinstance(since, dict) else {}
+        messages = []
+        cursors = {}
+        for room_id in room_ids:
+            buffer = recent_buffers.get(room_id)
+            if buffer is None:
+                continue
+            missed, cursors[str(room_id)] = buffer.since(since.get(str(room_id)))
+            messages.extend(missed)
+        if len(room_ids) > 1:
+            messages.sort(key=lambda message: message['time'])
+        (delivery or socketio).emit('danmaku_snapshot', {'cursors': cursors, 'messages': messages}, to=request.sid)
 
     @socketio.on('disconnect')
     def handle_disconnect():
+        if delivery:
+            delivery.unregister(request.sid)
+        metrics.CONNECTED_CLIENTS.labels().dec()
         logger.log('客户端已断开连接')
 
-    # 启动弹幕处理
-    danmaku_manager.start()
+    if role == 'web':
+        logger.log("Web 进程不保存最近弹幕：连接时不发送快照，断线重连不补发错过的弹幕")
+        return app, socketio
+
+    sender = delivery or socketio
+    emitter = BatchEmitter(sender, config, logger=logger)
+    keyword_filter = KeywordFilter(config.KEYWORD_FILE, config.KEYWORD_ACTION, config.KEYWORD_RELOAD_INTERVAL,
+                                   logger=logger) if config.KEYWORD_FILE else None
+    managers = [
+        DanmakuManager(config, file_manager.for_room(room_id) if config.multi_room else file_manager,
+                       socketio, logger=logger, room_id=room_id, emitter=emitter, keyword_filter=keyword_filter)
+        for room_id in config.room_ids()
+    ]
+    recent_buffers.update({manager.room_id: manager.recent for manager in managers if manager.recent is not None})
+    scheduler = RoomScheduler(config, managers, logger=logger)
+    replays = {manager.room_id: ReplaySource(manager, logger=logger) for manager in managers}
+    stats_pusher = StatsPusher(sender, config, managers, logger=logger)
+    metrics.REGISTRY.gauge_func('danmaku_writer_queue_depth', '写入队列中等待落盘的弹幕条数', ['room'],
+                                lambda: {(manager.room_id,): manager.writer.queue.qsize() for manager in managers})
+    metrics.REGISTRY.gauge_func('danmaku_emit_pending', '等待批量推送的弹幕条数', [],
+                                lambda: {(): emitter.pending_count()})
+    if delivery:
+        metrics.REGISTRY.gauge_func('danmaku_delivery_backlog', '各客户端待发弹幕条数合计和最大延迟（秒）', ['kind'],
+                                    lambda: _delivery_backlog(delivery.stats()))
+    register_api_routes(app, config, managers, replays)
+
+    def shutdown():
+        """先停回放和采集、刷完写入队列，再发出剩余的推送，可重复调用"""
+        for replay in replays.values():
+            replay.stop()
+        stats_pusher.stop()
+        scheduler.stop()
+        emitter.stop()
+        if delivery:
+            delivery.stop()
+        if keyword_filter:
+            keyword_filter.stop()
+
+    if delivery:
+        delivery.start()
+    emitter.start()
+    if keyword_filter:
+        keyword_filter.start()
+    scheduler.start()
+    stats_pusher.start()
+    atexit.register(shutdown)
+    # 同进程内嵌时（BackgroundServer）通过这里拿到采集组件
+    app.extensions['danmaku'] = {'config': config, 'managers': managers, 'replays': replays, 'shutdown': shutdown}
 
     return app, socketio
 
 
+class BackgroundServer:
+    """在后台线程里运行完整服务，供图形界面在同一进程内启动、停止和重启"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 5000,
+                 log_callback: Optional[Callable[[str], None]] = None):
+        self.host = host
+        self.port = port
+        self.log_callback = log_callback
+        self.app: Optional['Flask'] = None
+        self.socketio: Optional['SocketIO'] = None
+        self.managers: List[DanmakuManager] = []
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """创建应用并开始监听，端口被占用等错误直接抛出"""
+        from werkzeug.serving import make_server
+
+        with self._lock:
+            if self.running:
+                return
+            app, socketio = create_app(log_callback=self.log_callback)
+            extension = app.extensions['danmaku']
+            try:
+                server = make_server(self.host, self.port, app, threaded=True)
+            except (OSError, SystemExit) as e:  # 端口被占用时 werkzeug 直接 sys.exit
+                extension['shutdown']()
+                atexit.unregister(extension['shutdown'])
+                raise OSError(f"无法监听 {self.host}:{self.port}") from e
+            self.app, self.socketio, self.managers, self._server = app, socketio, extension['managers'], server
+            self._thread = threading.Thread(target=server.serve_forever, daemon=True, name='danmaku-web')
+            self._thread.start()
+
+    def stop(self):
+        """停止监听、断开客户端，再停采集并刷完写入队列"""
+        with self._lock:
+            if self._server is None:
+                return
+            self._server.shutdown()
+            self._server.server_close()
+            # 断开现有连接，前端会自动重连到重启后的服务；不等待发送队列清空，卡住的客户端不会拖住停止
+            for client in list(self.socketio.server.eio.sockets.values()):
+                client.close(wait=False)
+            shutdown = self.app.extensions['danmaku']['shutdown']
+            shutdown()
+            atexit.unregister(shutdown)
+            self._server = None
+            self._thread = None
+            self.managers = []
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def status(self) -> List[dict]:
+        """各房间的运行状态"""
+        return [manager.status() for manager in self.managers]
+
+
 if __name__ == '__main__':
     app, socketio = create_app()
     print("请访问 http://127.0.0.1:5000")